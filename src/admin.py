@@ -8,6 +8,9 @@ from telegram.constants import ParseMode
 from telegram.ext import CallbackContext, ConversationHandler
 
 from database import DatabaseSettings, DatabaseLogs
+from logger import logger
+from http_client import HTTP_CLIENT
+from mirrors import MIRRORS
 
 # Добавляем константы для пагинации
 USERS_PER_PAGE = 10
@@ -388,7 +391,33 @@ async def admin_system(update: Update, context: CallbackContext):
 
     # Получаем системную статистику
     from health import get_system_stats, get_memory_usage
+    from handlers import BOOKS_SEARCH, DOWNLOAD_SCHEDULER, DELIVERY_PLANNER, DOWNLOAD_CACHE, FILE_SERVER, \
+        EPUB_CONVERTER, FILE_WARMER
+    from utils import format_size
     stats = get_system_stats()
+    search_stats = BOOKS_SEARCH.get_stats()
+    cache_stats = BOOKS_SEARCH.cache.get_stats()
+    user_log_stats = logger.db_logger.get_stats()
+    http_stats = HTTP_CLIENT.get_stats()
+    download_stats = DOWNLOAD_SCHEDULER.get_stats()
+    mirror_stats = MIRRORS.get_stats()
+    download_cache_stats = DOWNLOAD_CACHE.get_stats()
+    file_server_stats = FILE_SERVER.get_stats()
+    epub_stats = EPUB_CONVERTER.get_stats()
+    warmer_stats = FILE_WARMER.get_stats()
+    delivery_text = "\n".join(
+        f"• {route['title'].capitalize()}: выбрано <code>{route['planned']}</code>, доставлено/ошибок "
+        f"<code>{route['delivered']}/{route['failed']}</code>, время сред./макс. "
+        f"<code>{route['time_avg']}/{route['time_max']} с</code>"
+        for route in DELIVERY_PLANNER.get_stats().values()
+    )
+    mirrors_text = "\n".join(
+        f"• {mirror['host']}: <code>{mirror['state']}</code>, ответ "
+        f"<code>{mirror['latency_ms'] if mirror['latency_ms'] is not None else '-'} мс</code>, "
+        f"успешно/ошибок <code>{mirror['successes']}/{mirror['failures']}</code>"
+        + (f", ошибок подряд <code>{mirror['consecutive_failures']}</code>" if mirror['consecutive_failures'] else "")
+        for mirror in mirror_stats['mirrors']
+    )
 
     # Получаем информацию о текущих админских сессиях
     active_admins = len([uid for uid in admin_sessions if admin_sessions[uid]["admin_until"] > time.time()])
@@ -403,10 +432,78 @@ async def admin_system(update: Update, context: CallbackContext):
 • Загрузка CPU: <code>{stats['cpu_percent']}%</code>
 
 <b>Процесс:</b>
-• Открытых файлов: <code>{stats['open_files']}</code>
+• Открытых дескрипторов: <code>{stats['open_files']}</code>
 • Потоков: <code>{stats['threads']}</code>
 • Время: <code>{stats['timestamp']}</code>
 
+<b>Поиск книг:</b>
+• Потоков пула: <code>{search_stats['pool_size']}</code>
+• Выполняется запросов: <code>{search_stats['running']}</code>
+• Запросов в очереди: <code>{search_stats['queue_depth']}</code>
+• Выполнено всего: <code>{search_stats['completed']}</code>
+
+<b>Кэш поиска:</b>
+• Записей: <code>{cache_stats['size']}/{cache_stats['max_size']}</code> (TTL <code>{cache_stats['ttl']}</code> с)
+• Попаданий, промахов: <code>{cache_stats['hits']}, {cache_stats['misses']}</code>
+• Объединено одновременных: <code>{cache_stats['coalesced']}</code>
+• Доля попаданий: <code>{cache_stats['hit_rate']}%</code>
+• Сбросов при обновлении БД: <code>{cache_stats['invalidations']}</code>
+
+<b>Журнал действий:</b>
+• Записей в очереди: <code>{user_log_stats['queue_depth']}</code>
+• Записано, пачек: <code>{user_log_stats['written']}, {user_log_stats['batches']}</code>
+• Время записи пачки, последняя/макс.: <code>{user_log_stats['last_flush_ms']}/{user_log_stats['max_flush_ms']} мс</code>
+• Ошибок записи: <code>{user_log_stats['errors']}</code>
+
+<b>HTTP-клиент:</b>
+• Запросов: <code>{http_stats['requests']}</code>
+• Соединений новых, переиспользовано: <code>{http_stats['connections_created']}, {http_stats['connections_reused']}</code> (<code>{http_stats['reuse_rate']}%</code>)
+• Кэш DNS, попаданий/промахов: <code>{http_stats['dns_cache_hits']}/{http_stats['dns_cache_misses']}</code>
+
+<b>Очередь отправки книг:</b>
+• Отправляется, в очереди: <code>{download_stats['active']}/{download_stats['max_active']}, {download_stats['queued']}</code>
+• Отправлено: <code>{download_stats['served']}</code>
+• Ожидание в очереди, среднее/макс.: <code>{download_stats['wait_avg']}/{download_stats['wait_max']} с</code>
+• Время отправки, среднее/макс.: <code>{download_stats['service_avg']}/{download_stats['service_max']} с</code>
+
+<b>Способы доставки книг:</b>
+{delivery_text}
+
+<b>Зеркала сайта:</b>
+{mirrors_text}
+• Отказов без запроса (все зеркала отключены): <code>{mirror_stats['fast_failures']}</code>
+• Повторов: <code>{mirror_stats['retries']}</code>, не уложились в срок: <code>{mirror_stats['deadline_exceeded']}</code>
+• Докачано книг: <code>{mirror_stats['resumed']}</code>, не скачано повторно <code>{format_size(mirror_stats['bytes_saved'])}</code>, начато заново: <code>{mirror_stats['restarted']}</code>
+• Недокачанных книг: <code>{mirror_stats['partials']['files']}</code>, <code>{format_size(mirror_stats['partials']['size'])}</code>
+• Наличие форматов на сайте: известно <code>{mirror_stats['availability']['size']}</code>, из них нет <code>{mirror_stats['availability']['missing']}</code>
+• Известно "есть"/"нет"/неизвестно: <code>{mirror_stats['availability']['available_hits']}/{mirror_stats['availability']['missing_hits']}/{mirror_stats['availability']['misses']}</code>, проверок HEAD <code>{mirror_stats['availability']['probes']}</code>
+
+<b>Кэш скачанных книг:</b>
+• Книг: <code>{download_cache_stats['files']}</code>, размер <code>{format_size(download_cache_stats['size'])}/{format_size(download_cache_stats['max_size'])}</code>
+• Попаданий, промахов: <code>{download_cache_stats['hits']}, {download_cache_stats['misses']}</code> (<code>{download_cache_stats['hit_rate']}%</code>)
+• Вытеснено: <code>{download_cache_stats['evicted']}</code>
+
+<b>Файловый сервер:</b>
+• Включён: <code>{'да' if file_server_stats['enabled'] else 'нет (ссылки через tmpfiles.org)'}</code>
+• Выдано ссылок, скачиваний: <code>{file_server_stats['links']}, {file_server_stats['served']}</code>
+• Собрано из архива заново: <code>{file_server_stats['rebuilt']}</code>
+• Отклонено: просрочено/неверная подпись/нет книги <code>{file_server_stats['expired']}/{file_server_stats['rejected']}/{file_server_stats['missing']}</code>
+
+<b>Преобразование fb2 в EPUB:</b>
+• Включено: <code>{'да' if epub_stats['enabled'] else 'нет (EPUB только с сайта)'}</code>
+• Преобразовано, из кэша: <code>{epub_stats['converted']}, {epub_stats['cache_hits']}</code>
+• Ошибок, нет исходного fb2: <code>{epub_stats['failed']}, {epub_stats['no_source']}</code>
+• Время преобразования, среднее/макс.: <code>{epub_stats['convert_avg']}/{epub_stats['convert_max']} с</code>
+• Скачано с сайта: <code>{epub_stats['upstream']}</code>, время среднее/макс. <code>{epub_stats['upstream_avg']}/{epub_stats['upstream_max']} с</code>
+• Кэш: <code>{epub_stats['cache']['files']}</code> книг, <code>{format_size(epub_stats['cache']['size'])}/{format_size(epub_stats['cache']['max_size'])}</code>
+
+<b>Прогрев кэша file_id:</b>
+• Включен: <code>{'да' if warmer_stats['enabled'] else 'нет'}</code>{' (выполняется)' if warmer_stats['running'] else ''}
+• Запусков: <code>{warmer_stats['runs']}</code>, последний: <code>{warmer_stats['last_run'] or '-'}</code> ({warmer_stats['last_result'] or '-'})
+• Загружено книг: <code>{warmer_stats['warmed']}</code>, уже в кэше: <code>{warmer_stats['already_cached']}</code>
+• Пропущено/ошибок: <code>{warmer_stats['skipped']}/{warmer_stats['failed']}</code>, пауз из-за нагрузки: <code>{warmer_stats['pauses']}</code>
+• Скачано: <code>{format_size(warmer_stats['bytes'])}</code> (за прогрев не более <code>{format_size(warmer_stats['budget'])}</code>)
+
 <b>Админские сессии:</b>
 • Активных сессий: <code>{active_admins}</code>
 • Очищено просроченных: <code>{cleaned_sessions}</code>
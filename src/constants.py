@@ -1,4 +1,4 @@
-#import os
+import os
 
 # Пути к базам данных и файлам
 #CONNECT_DB_AUX = "/media/sf_FlibustaBot/FlibustaAux.sqlite"
@@ -16,6 +16,11 @@ FLIBUSTA_LOG_PATH = './logs'
 FLIBUSTA_DB_BOOKS_PATH = f"{PREFIX_FILE_PATH}/Flibusta_FB2_local.hlc2"
 FLIBUSTA_DB_SETTINGS_PATH = f"{PREFIX_FILE_PATH}/FlibustaSettings.sqlite"
 FLIBUSTA_DB_LOGS_PATH = f"{PREFIX_FILE_PATH}/FlibustaLogs.sqlite"
+FLIBUSTA_DB_CACHE_PATH = f"{PREFIX_FILE_PATH}/FlibustaCache.sqlite"  # кэши бота, можно удалить без потери данных
+# Локальные zip-архивы библиотеки (имя архива - поле Folder книги); пустое значение - книги только с сайта
+FLIBUSTA_ARCHIVES_PATH = os.getenv("FLIBUSTA_ARCHIVES_PATH", PREFIX_FILE_PATH)
+# Хранилище уменьшенных обложек для карточек книг (собирается утилитой tools/db_book_cards.py)
+BOOK_CARDS_PATH = os.getenv("BOOK_CARDS_PATH", f"{PREFIX_FILE_PATH}/cards")
 
 # пути для резервных копий
 BACKUP_TMP_PATH = PREFIX_TMP_PATH
@@ -29,11 +34,105 @@ BACKUP_LOG_PATTERN = f"{FLIBUSTA_LOG_PATH}/*log*"
 MAX_BOOKS_SEARCH = 20
 #WEB
 FLIBUSTA_BASE_URL = "https://flibusta.is"
+# Зеркала сайта для скачивания книг через запятую (по умолчанию - только основной сайт)
+FLIBUSTA_MIRRORS = [url.strip().rstrip('/') for url in os.getenv("FLIBUSTA_MIRRORS", FLIBUSTA_BASE_URL).split(',')
+                    if url.strip()]
+# Повторы скачивания на других зеркалах: число попыток и начальная пауза между ними в миллисекундах (удваивается)
+MIRROR_RETRIES = int(os.getenv("MIRROR_RETRIES", "3"))
+MIRROR_RETRY_BACKOFF_MS = int(os.getenv("MIRROR_RETRY_BACKOFF_MS", "500"))
+# Зеркало после стольких ошибок подряд отключается на MIRROR_OPEN_TIME секунд, затем проверяется одним запросом
+MIRROR_FAILURE_THRESHOLD = int(os.getenv("MIRROR_FAILURE_THRESHOLD", "3"))
+MIRROR_OPEN_TIME = int(os.getenv("MIRROR_OPEN_TIME", "60"))
+# Общий срок скачивания книги с зеркал в секундах, включая все повторы и паузы между ними
+MIRROR_DOWNLOAD_DEADLINE = int(os.getenv("MIRROR_DOWNLOAD_DEADLINE", "600"))
+# Кэш наличия книг в форматах на сайте: число записей и время жизни в секундах ответов "есть" и "нет"
+FORMAT_CACHE_SIZE = int(os.getenv("FORMAT_CACHE_SIZE", "100000"))
+FORMAT_AVAILABLE_TTL = int(os.getenv("FORMAT_AVAILABLE_TTL", str(24 * 3600)))
+FORMAT_MISSING_TTL = int(os.getenv("FORMAT_MISSING_TTL", str(6 * 3600)))
+# Предварительная проверка наличия формата (HEAD) для книг показанной страницы: число одновременных запросов (0 - выкл.)
+FORMAT_PROBE_CONCURRENCY = int(os.getenv("FORMAT_PROBE_CONCURRENCY", "0"))
+# Общий HTTP-клиент: размер пула соединений (всего и на один сайт), время жизни кэша DNS и keep-alive в секундах
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "10"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_KEEPALIVE_TIMEOUT = int(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+# Таймауты HTTP-запросов в секундах: подключение, ожидание данных и весь запрос целиком
+HTTP_CONNECT_TIMEOUT = int(os.getenv("HTTP_CONNECT_TIMEOUT", "30"))
+HTTP_READ_TIMEOUT = int(os.getenv("HTTP_READ_TIMEOUT", "60"))
+HTTP_TOTAL_TIMEOUT = int(os.getenv("HTTP_TOTAL_TIMEOUT", "300"))
 DEFAULT_BOOK_FORMAT = 'fb2'  # По умолчанию формат не установлен
+COVER_FILE_FORMAT = 'cover'  # Формат, под которым в кэше file_id хранится обложка книги с подписью
 
 # Интервалы мониторинга загрузки и очистки ресурсов
 # MONITORING_INTERVAL=1800 # каждые полчаса мониторим потребление памяти
 CLEANUP_INTERVAL=3600 # каждый час очищаем старые сохранённые контексты поисков
+STATS_SAMPLE_INTERVAL=15 # раз в 15 секунд обновляем снимок системной статистики
+USER_LOG_FLUSH_INTERVAL=2 # не реже чем раз в 2 секунды сбрасываем накопленные действия пользователей в БД логов
+USER_LOG_BATCH_SIZE=200 # или сразу, как только накопилось столько записей
+
+# Сколько обновлений Telegram бот обрабатывает одновременно (и размер пула соединений с Bot API)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "16"))
+
+# Пул потоков для поиска книг (у каждого потока своё соединение с БД библиотеки только для чтения)
+SEARCH_POOL_SIZE = int(os.getenv("SEARCH_POOL_SIZE", "4"))
+# Пул потоков для чтения книг из локальных архивов
+LOCAL_ARCHIVES_POOL_SIZE = int(os.getenv("LOCAL_ARCHIVES_POOL_SIZE", "2"))
+# Пул процессов для разбора fb2 (обложка и описание книги); 0 - разбирать в потоке процесса бота
+FB2_PARSE_POOL_SIZE = int(os.getenv("FB2_PARSE_POOL_SIZE", "2"))
+# Предел подсчёта найденных книг: при большем числе совпадений выводится "N+" (0 - считать точно)
+SEARCH_COUNT_LIMIT = int(os.getenv("SEARCH_COUNT_LIMIT", "0"))
+# Общий кэш результатов поиска: максимальное число записей (0 - кэш выключен) и время жизни записи в секундах
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1000"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "600"))
+
+# Кэш настроек пользователей в памяти: максимальное число пользователей
+SETTINGS_CACHE_SIZE = int(os.getenv("SETTINGS_CACHE_SIZE", "10000"))
+
+# Очередь отправки книг: сколько книг скачивается и отправляется одновременно всего и с одного сайта
+DOWNLOADS_MAX_ACTIVE = int(os.getenv("DOWNLOADS_MAX_ACTIVE", "8"))
+DOWNLOADS_MAX_PER_HOST = int(os.getenv("DOWNLOADS_MAX_PER_HOST", "4"))
+# Скачиваемая книга пишется во временный файл: до этого размера (в байтах) он держится в памяти, дальше - на диске
+DOWNLOAD_SPOOL_SIZE = int(os.getenv("DOWNLOAD_SPOOL_SIZE", str(1024 * 1024)))
+# Максимальный размер скачиваемой книги в байтах (больше - скачивание прерывается)
+DOWNLOAD_MAX_SIZE = int(os.getenv("DOWNLOAD_MAX_SIZE", str(100 * 1024 * 1024)))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024 # книга читается и копируется частями по 64 КБ
+# Доставка книг: файлы больше этого размера (в байтах) сразу отправляются ссылкой, а не файлом в чат
+DELIVERY_DIRECT_MAX_SIZE = int(os.getenv("DELIVERY_DIRECT_MAX_SIZE", str(20 * 1024 * 1024)))
+# Книги, которые по каталогу больше этого размера (но не больше DOWNLOAD_MAX_SIZE), не скачиваются:
+# пользователь получает ссылку на сайт
+DELIVERY_ARCHIVE_ONLY_SIZE = int(os.getenv("DELIVERY_ARCHIVE_ONLY_SIZE", str(100 * 1024 * 1024)))
+# Дисковый кэш скачанных книг (из него раздаются ссылки на большие книги): каталог и максимальный размер в байтах
+DOWNLOAD_CACHE_PATH = os.getenv("DOWNLOAD_CACHE_PATH", f"{PREFIX_TMP_PATH}/books")
+DOWNLOAD_CACHE_SIZE = int(os.getenv("DOWNLOAD_CACHE_SIZE", str(2 * 1024 * 1024 * 1024)))
+# Недокачанные книги (докачиваются запросом Range): каталог внутри кэша скачиваний и сколько секунд их хранить (0 - не докачивать)
+DOWNLOAD_PARTIAL_PATH = os.path.join(DOWNLOAD_CACHE_PATH, 'partial') if DOWNLOAD_CACHE_PATH else ''
+DOWNLOAD_PARTIAL_TTL = int(os.getenv("DOWNLOAD_PARTIAL_TTL", "3600"))
+# Файловый сервер для ссылок на большие книги: публичный адрес (пусто - ссылки через tmpfiles.org), адрес и порт
+FILE_SERVER_PUBLIC_URL = os.getenv("FILE_SERVER_PUBLIC_URL", "")
+FILE_SERVER_HOST = os.getenv("FILE_SERVER_HOST", "0.0.0.0")
+FILE_SERVER_PORT = int(os.getenv("FILE_SERVER_PORT", "8000"))
+# Ключ подписи ссылок (пусто - случайный, ссылки перестают действовать после перезапуска) и срок их действия в секундах
+FILE_SERVER_SECRET = os.getenv("FILE_SERVER_SECRET", "")
+FILE_LINK_TTL = int(os.getenv("FILE_LINK_TTL", "3600"))
+# Кэш книг, преобразованных из fb2 в EPUB на стороне бота: каталог и максимальный размер в байтах (0 - не преобразовывать)
+CONVERTED_CACHE_PATH = os.getenv("CONVERTED_CACHE_PATH", f"{PREFIX_FILE_PATH}/converted")
+CONVERTED_CACHE_SIZE = int(os.getenv("CONVERTED_CACHE_SIZE", str(1024 * 1024 * 1024)))
+# Скачивание серии одним архивом: максимум книг в архиве и сколько книг серии скачивается одновременно
+SERIES_DOWNLOAD_MAX_BOOKS = int(os.getenv("SERIES_DOWNLOAD_MAX_BOOKS", "50"))
+SERIES_DOWNLOAD_CONCURRENCY = int(os.getenv("SERIES_DOWNLOAD_CONCURRENCY", "3"))
+SERIES_PROGRESS_INTERVAL = 3 # сообщение о ходе сборки архива серии обновляется не чаще раза в 3 секунды
+# Прогрев кэша file_id: служебный чат для загрузки популярных книг (0 - прогрев выключен),
+# сколько самых скачиваемых книг каждого формата прогревать и в какие часы (по местному времени, "2-6")
+WARMUP_CHAT_ID = int(os.getenv("WARMUP_CHAT_ID", "0"))
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", "50"))
+WARMUP_HOURS = os.getenv("WARMUP_HOURS", "2-6")
+# Ограничения прогрева: объём скачивания за один прогрев и скорость в байтах, допустимое число
+# пользовательских скачиваний (больше - прогрев приостанавливается)
+WARMUP_BUDGET = int(os.getenv("WARMUP_BUDGET", str(500 * 1024 * 1024)))
+WARMUP_RATE = int(os.getenv("WARMUP_RATE", str(1024 * 1024)))
+WARMUP_MAX_USER_LOAD = int(os.getenv("WARMUP_MAX_USER_LOAD", "0"))
+WARMUP_INTERVAL = 1800 # раз в полчаса проверяем, не пора ли прогревать кэш file_id
+WARMUP_PAUSE = 30 # приостановленный прогрев проверяет нагрузку раз в 30 секунд
 
 # Критерии поиска: русское название -> поле в БД
 SEARCH_CRITERIA = {
@@ -1,66 +1,52 @@
 import os
 import sqlite3
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
-from constants import FLIBUSTA_DB_BOOKS_PATH, FLIBUSTA_DB_SETTINGS_PATH, FLIBUSTA_DB_LOGS_PATH, SEARCH_CRITERIA
+from constants import FLIBUSTA_DB_BOOKS_PATH, FLIBUSTA_DB_SETTINGS_PATH, FLIBUSTA_DB_LOGS_PATH, FLIBUSTA_DB_CACHE_PATH, \
+    SEARCH_CRITERIA, SEARCH_COUNT_LIMIT, SETTINGS_CACHE_SIZE
 from utils import split_query_into_words, extract_criteria, remove_punctuation
 
 Book = namedtuple('Book', ['FileName', 'Title', 'SearchTitle', 'SearchLang', 'Author', 'LastName', 'FirstName', 'MiddleName', 'Genre', 'GenreParent', 'Folder', 'Ext', 'BookSize', 'SearchYear', 'LibRate', 'UpdateDate'])
+# Скомпилированный поисковый запрос: условие WHERE, его параметры и порядок сортировки
+BooksQuery = namedtuple('BooksQuery', ['sql_where', 'params', 'sort_order'])
 UserSettings = namedtuple('UserSettings',['User_ID', 'MaxBooks', 'Lang', 'DateSortOrder', 'BookFormat', 'LastNewsDate', 'IsBlocked'])
+# Файл, уже загруженный в Telegram: его file_id, имя файла и подпись
+TelegramFile = namedtuple('TelegramFile', ['FileID', 'FileName', 'Caption'])
+# Файл внутри локального zip-архива библиотеки (данные центрального каталога архива)
+ArchiveMember = namedtuple('ArchiveMember', ['MemberName', 'HeaderOffset', 'CompressSize', 'FileSize', 'CompressType', 'CRC'])
+# Карточка книги: поля BookSearch, выходные данные из Books_Meta, обложка и аннотация из Books_Cards
+BookCard = namedtuple('BookCard', ['FileName', 'Title', 'LastName', 'FirstName', 'MiddleName', 'Genre', 'SeriesTitle',
+                                   'SearchLang', 'BookSize', 'LibRate', 'Folder', 'Ext', 'Publisher', 'Year', 'City',
+                                   'ISBN', 'CoverHash', 'Annotation'])
 
 # SQL-запросы
-SQL_QUERY_BOOKS = """
-    SELECT 
-        Books.Title,
-        Books.SearchLang,
-        Books.BookSize,
-        Books.LibRate, 
-        case 
-          when BookSize <= 800 * 1024 then 'less800'
-          when BookSize > 800 * 1024 then 'more800'
-          end as BookSizeCat,        
-        Books.Folder,
-        Books.FileName,
-        Books.Ext,
-        Books.SearchTitle,
-        Books.UpdateDate,
-        Authors.SearchName AS Author,
-        Authors.LastName,
-        Authors.FirstName,
-        Authors.MiddleName,
-        --Books.SeriesID,
-        Series.SeriesTitle, 
-        Series.SearchSeriesTitle,
-        Genres.GenreAlias AS Genre,
-        Genres.SearchGenre as GenreUpper,
-        GenresParent.GenreAlias AS GenreParent,
-        Books_Meta.SearchYear,
-        Books_Meta.SearchCity,
-        Books_Meta.SearchPublisher,
-        REMOVE_PUNCTUATION(' ' || Books.SearchTitle || ' ' || coalesce(Authors.SearchName,'') || ' ' || coalesce(Series.SearchSeriesTitle,'') || ' ' || coalesce(Genres.SearchGenre,'') || ' ' || Books.SearchLang || ' ') AS FullSearch
-        /*replace(
-         replace(
-            replace(
-              replace(
-                replace(' ' || Books.SearchTitle || ' ' || coalesce(Authors.SearchName,'') || ' ' || coalesce(Series.SearchSeriesTitle,'') || ' ' || coalesce(Genres.SearchGenre,'') || ' ' || Books.SearchLang || ' ', '.',' ')
-                ,',',' '
-              )
-              ,'!',' '
-            )
-            ,'?',' '
-          )
-          ,':',' '
-        ) AS FullSearch */    
-    FROM Books
-    LEFT JOIN Author_List ON Author_List.BookID = Books.BookID
-    INNER JOIN Authors ON Author_List.AuthorID = Authors.AuthorID
-    LEFT JOIN Series ON Series.SeriesID = Books.SeriesID
-    LEFT JOIN Genre_List ON Genre_List.BookID = Books.BookID
-    INNER JOIN SearchGenres as Genres ON Genres.GenreCode = Genre_List.GenreCode
-    LEFT JOIN SearchGenres AS GenresParent ON GenresParent.GenreCode = Genres.ParentCode
-    INNER JOIN Books_Meta ON Books_Meta.BookID = Books.BookID
+# Книги ищутся по денормализованной таблице BookSearch (одна строка на книгу),
+# которая строится заранее утилитой tools/db_book_search.py
+SQL_QUERY_BOOKS = f"""
+    SELECT {', '.join(Book._fields)}
+    FROM BookSearch
+"""
+
+SQL_QUERY_BOOK_SEARCH_EXISTS = """
+    SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'BookSearch'
+"""
+
+# Индексы BookSearch, без которых карточка и размер книги ищутся полным просмотром таблицы
+BOOK_SEARCH_REQUIRED_INDEXES = ('IXBookSearch_FileName',)
+SQL_QUERY_BOOK_SEARCH_INDEXES = """
+    SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'BookSearch'
 """
 
+SQL_QUERY_BOOK_SEARCH_ACTUAL = """
+    SELECT
+        (SELECT BooksCount FROM BookSearchInfo) = (SELECT COUNT(*) FROM Books)
+        AND (SELECT MaxUpdateDate FROM BookSearchInfo) IS (SELECT MAX(UpdateDate) FROM Books)
+"""
+
+# Многозначные поля BookSearch (авторы и жанры книги) и разделитель их значений
+BOOK_SEARCH_MULTI_VALUE_FIELDS = ('Author', 'GenreUpper')
+BOOK_SEARCH_VALUE_SEPARATOR = '|'
+
 # SQL_QUERY_PARENT_GENRES = """
 #     SELECT GenreAlias
 #     FROM SearchGenres
@@ -109,6 +95,28 @@ SQL_QUERY_LANGS = """
     ORDER BY count DESC
 """
 
+# Полнотекстовый индекс по книгам (строится отдельно утилитой tools/db_books_fts.py)
+SQL_QUERY_FTS_EXISTS = """
+    SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'BooksFTS'
+"""
+
+SQL_QUERY_BOOKS_CARDS_EXISTS = """
+    SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Books_Cards'
+"""
+
+# Карточка книги без обращения к сайту; обложки и аннотации собирает утилита tools/db_book_cards.py
+SQL_QUERY_BOOK_CARD = """
+    SELECT s.FileName, s.Title, s.LastName, s.FirstName, s.MiddleName, s.Genre, s.SeriesTitle, s.SearchLang,
+           s.BookSize, s.LibRate, s.Folder, s.Ext, m.Publisher, m.Year, m.City, m.ISBN, {card_fields}
+    FROM BookSearch s
+    LEFT JOIN Books_Meta m ON m.BookID = s.BookID
+    {card_join}
+    WHERE s.FileName = ?
+"""
+
+# Условие отбора книг через полнотекстовый индекс вместо сканирования FullSearch
+SQL_CONDITION_FTS = "BookID IN (SELECT rowid FROM BooksFTS WHERE BooksFTS MATCH ?)"
+
 SQL_QUERY_USER_SETTINGS_GET = """
     SELECT * FROM UserSettings WHERE user_id = ?
 """
@@ -138,11 +146,15 @@ class Database:
     def connect(self):
         """Устанавливает соединение с базой данных и инициализирует её если нужно"""
         if self._conn is None:
-            self._conn = sqlite3.connect(self.db_path)
+            self._conn = self._open_connection()
             # Инициализируем БД при первом подключении
             self._initialize_database()
         return self._conn
 
+    def _open_connection(self):
+        """Открывает новое соединение с БД (переопределяется в дочерних классах)"""
+        return sqlite3.connect(self.db_path)
+
     def _initialize_database(self):
         """Базовый метод инициализации (переопределяется в дочерних классах)"""
         pass
@@ -196,6 +208,22 @@ class DatabaseLogs(Database):
 
             conn.commit()
 
+    def write_user_logs(self, records):
+        """
+        Записывает пачку действий пользователей одной транзакцией
+        :param records: список кортежей (Timestamp, UserID, UserName, Action, Detail)
+        """
+        with self.connect() as conn:
+            cursor = conn.cursor()
+
+            # Совпадение первичного ключа (та же миллисекунда у того же пользователя) не должно отменять всю пачку
+            cursor.executemany("""
+                INSERT OR IGNORE INTO UserLog (Timestamp, UserID, UserName, Action, Detail) 
+                VALUES (?, ?, ?, ?, ?)
+            """, records)
+
+            conn.commit()
+
 
     def get_user_stats_period(self, days):
         """Возвращает статистику пользователей за указанный период в днях"""
@@ -528,8 +556,16 @@ class DatabaseLogs(Database):
 
 # Класс для работы с БД настроек бота
 class DatabaseSettings(Database):
-    def __init__(self, db_path = FLIBUSTA_DB_SETTINGS_PATH):
+    # Кэш настроек пользователей общий для всех экземпляров класса (бот и админка работают с одной БД настроек):
+    # путь к БД -> {user_id: UserSettings}, давно не запрашивавшиеся пользователи вытесняются
+    _settings_cache = {}
+
+    def __init__(self, db_path = FLIBUSTA_DB_SETTINGS_PATH, cache_size = SETTINGS_CACHE_SIZE):
         super().__init__(db_path)
+        self.cache_size = cache_size
+        self._cache = DatabaseSettings._settings_cache.setdefault(os.path.abspath(db_path), OrderedDict())
+        # Соответствие имён полей без учёта регистра (update_user_settings вызывается с maxbooks=, lang= и т.п.)
+        self._fields_by_lower = {field.lower(): field for field in UserSettings._fields}
 
     def _initialize_database(self):
         """Инициализирует БД настроек при первом подключении"""
@@ -558,36 +594,54 @@ class DatabaseSettings(Database):
 
             conn.commit()
 
+    def _cache_settings(self, settings):
+        """Кладёт настройки пользователя в кэш"""
+        self._cache[settings.User_ID] = settings
+        self._cache.move_to_end(settings.User_ID)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
     def get_user_settings(self,user_id):
         """
-        Получает настройки пользователя из базы данных.
+        Получает настройки пользователя: из кэша, а при промахе из базы данных.
         """
+        settings = self._cache.get(user_id)
+        if settings is not None:
+            self._cache.move_to_end(user_id)
+            return settings
+
         fields = UserSettings._fields
         processed_fields = [field for field in fields]
         select_fields = ', '.join(processed_fields)
 
         with self.connect() as conn:
             cursor = conn.cursor()
-            cursor.execute(f"SELECT {select_fields} FROM UserSettings WHERE user_id = ?", (user_id,))
-            settings = cursor.fetchone()
-            # Если настроек нет, добавляем значения по умолчанию
-            if not settings:
-                cursor.execute("INSERT INTO UserSettings (user_id) VALUES (?)", (user_id,))
-                conn.commit()
-                cursor.execute(f"SELECT {select_fields} FROM UserSettings WHERE user_id = ?", (user_id,))
-                settings = cursor.fetchone()
-        return UserSettings(*settings)
+            # Один запрос: если настроек нет, добавляем значения по умолчанию, и в любом случае возвращаем строку
+            cursor.execute(f"""
+                INSERT INTO UserSettings (user_id) VALUES (?)
+                ON CONFLICT(User_ID) DO UPDATE SET User_ID = excluded.User_ID
+                RETURNING {select_fields}
+            """, (user_id,))
+            settings = UserSettings(*cursor.fetchone())
+            conn.commit()
+
+        if self.cache_size > 0:
+            self._cache_settings(settings)
+        return settings
 
     def update_user_settings(self, user_id, **kwargs):
         """
-        Обновляет настройки пользователя в базе данных.
+        Обновляет настройки пользователя в базе данных и в кэше.
         """
+        # Сначала проверяем имена полей: они подставляются в текст запроса
+        fields = {self._fields_by_lower[key.lower()]: value for key, value in kwargs.items()}
+
         with self.connect() as conn:
             cursor = conn.cursor()
 
             # Формируем SQL-запрос для обновления настроек
-            set_clause = ", ".join([f"{key} = ?" for key in kwargs])
-            values = list(kwargs.values()) + [user_id]
+            set_clause = ", ".join([f"{key} = ?" for key in fields])
+            values = list(fields.values()) + [user_id]
 
             cursor.execute(f"""
                 UPDATE UserSettings 
@@ -597,6 +651,11 @@ class DatabaseSettings(Database):
 
             conn.commit()
 
+        # Сквозная запись: обновляем настройки в кэше, если пользователь там есть
+        settings = self._cache.get(user_id)
+        if settings is not None:
+            self._cache[user_id] = settings._replace(**fields)
+
     def get_user_stats(self):
         """Возвращает статистику пользователей"""
         with self.connect() as conn:
@@ -619,31 +678,150 @@ class DatabaseSettings(Database):
             }
 
 
+# Класс для работы с БД кэшей бота
+class DatabaseCache(Database):
+    def __init__(self, db_path = FLIBUSTA_DB_CACHE_PATH):
+        super().__init__(db_path)
+
+    def _initialize_database(self):
+        """Инициализирует БД кэшей при первом подключении"""
+        with self.connect() as conn:
+            cursor = conn.cursor()
+
+            # file_id отправленных книг и обложек: повторная отправка не требует скачивания и загрузки файла
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS TelegramFiles (
+                    BookID VARCHAR(20) NOT NULL,
+                    Format VARCHAR(10) NOT NULL,
+                    FileID VARCHAR(255),
+                    FileName VARCHAR(255),
+                    Caption TEXT,
+                    CreatedAt VARCHAR(19) DEFAULT (datetime('now', 'localtime')),
+                    PRIMARY KEY(BookID, Format)
+                );
+            """)
+
+            # Индекс центральных каталогов локальных архивов: файл книги читается одним позиционированием в архиве
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ArchiveFiles (
+                    Archive VARCHAR(255) NOT NULL,
+                    MTime INTEGER NOT NULL,
+                    Size INTEGER NOT NULL,
+                    IndexedAt VARCHAR(19) DEFAULT (datetime('now', 'localtime')),
+                    PRIMARY KEY(Archive)
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ArchiveMembers (
+                    Archive VARCHAR(255) NOT NULL,
+                    MemberName VARCHAR(255) NOT NULL,
+                    HeaderOffset INTEGER NOT NULL,
+                    CompressSize INTEGER NOT NULL,
+                    FileSize INTEGER NOT NULL,
+                    CompressType INTEGER NOT NULL,
+                    CRC INTEGER NOT NULL,
+                    PRIMARY KEY(Archive, MemberName)
+                ) WITHOUT ROWID;
+            """)
+
+            conn.commit()
+
+    def get_telegram_file(self, book_id, file_format):
+        """Возвращает сохранённый файл книги в указанном формате или None"""
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT FileID, FileName, Caption FROM TelegramFiles WHERE BookID = ? AND Format = ?
+            """, (str(book_id), file_format))
+            row = cursor.fetchone()
+        return TelegramFile(*row) if row else None
+
+    def save_telegram_file(self, book_id, file_format, file_id, file_name=None, caption=None):
+        """Сохраняет file_id, полученный от Telegram после отправки файла"""
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT OR REPLACE INTO TelegramFiles (BookID, Format, FileID, FileName, Caption)
+                VALUES (?, ?, ?, ?, ?)
+            """, (str(book_id), file_format, file_id, file_name, caption))
+            conn.commit()
+
+    def delete_telegram_file(self, book_id, file_format):
+        """Удаляет сохранённый файл (например, если Telegram больше не принимает его file_id)"""
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM TelegramFiles WHERE BookID = ? AND Format = ?", (str(book_id), file_format))
+            conn.commit()
+
+    def get_archive_state(self, archive):
+        """Возвращает (MTime, Size) архива на момент построения его индекса или None"""
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MTime, Size FROM ArchiveFiles WHERE Archive = ?", (archive,))
+            row = cursor.fetchone()
+        return tuple(row) if row else None
+
+    def get_archive_member(self, archive, member_name):
+        """Возвращает положение файла в архиве или None"""
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT {', '.join(ArchiveMember._fields)} FROM ArchiveMembers WHERE Archive = ? AND MemberName = ?
+            """, (archive, member_name))
+            row = cursor.fetchone()
+        return ArchiveMember(*row) if row else None
+
+    def save_archive_index(self, archive, mtime, size, members):
+        """
+        Заменяет индекс архива одной транзакцией
+        :param members: список ArchiveMember
+        """
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM ArchiveMembers WHERE Archive = ?", (archive,))
+            cursor.executemany(f"""
+                INSERT OR REPLACE INTO ArchiveMembers (Archive, {', '.join(ArchiveMember._fields)})
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [(archive, *member) for member in members])
+            cursor.execute("""
+                INSERT OR REPLACE INTO ArchiveFiles (Archive, MTime, Size) VALUES (?, ?, ?)
+            """, (archive, mtime, size))
+            conn.commit()
+
+
 # Класс для работы с БД библиотеки
 class DatabaseBooks(Database):
-    def __init__(self, db_path = FLIBUSTA_DB_BOOKS_PATH):
+    def __init__(self, db_path = FLIBUSTA_DB_BOOKS_PATH, read_only = False):
         super().__init__(db_path)
+        self.read_only = read_only  # Соединение только для чтения (для потоков пула поиска)
         self._cached_langs = None
         self._cached_parent_genres = None
         self._cached_genres = {}  # Словарь для кеширования жанров по родительским категориям
+        self._has_fts = None  # Признак наличия полнотекстового индекса BooksFTS
+        self._has_cards = None  # Признак наличия таблицы карточек книг Books_Cards
 
-    def connect(self):
+    def _open_connection(self):
+        """Открывает соединение с БД библиотеки, при необходимости только для чтения"""
+        if self.read_only:
+            return sqlite3.connect(f"file:{os.path.abspath(self.db_path)}?mode=ro", uri=True)
+        return sqlite3.connect(self.db_path)
+
+    def _initialize_database(self):
         """
-        Устанавливает соединение с базой данных, если оно ещё не установлено.
+        Регистрирует пользовательские функции и сортировки один раз при создании соединения
         """
-        with super().connect() as conn:
-            conn.create_collation('MHL_SYSTEM_NOCASE', self.custom_collation)
+        self._conn.create_collation('MHL_SYSTEM_NOCASE', self.custom_collation)
+        self._conn.create_function("REMOVE_PUNCTUATION", 1, remove_punctuation)
 
-            # Устанавливаем параметры SQLite
-            #self._conn.execute("PRAGMA case_sensitive_like = OFF;")  # Регистронезависимый LIKE
-            #self._conn.execute("PRAGMA cache_size = 0;")  # Отключаем кэширование
-            #self._conn.execute("PRAGMA foreign_keys = '1';")
-            #self._conn.execute("PRAGMA database_list;")
-            #self._conn.execute("PRAGMA encoding;")
+        # Устанавливаем параметры SQLite
+        #self._conn.execute("PRAGMA case_sensitive_like = OFF;")  # Регистронезависимый LIKE
+        #self._conn.execute("PRAGMA cache_size = 0;")  # Отключаем кэширование
+        #self._conn.execute("PRAGMA foreign_keys = '1';")
+        #self._conn.execute("PRAGMA database_list;")
+        #self._conn.execute("PRAGMA encoding;")
 
-            #cursor = self._conn.cursor()
-            #cursor.execute(f"ATTACH DATABASE '{CONNECT_DB_AUX}' as aux_db")
-            return conn
+        #cursor = self._conn.cursor()
+        #cursor.execute(f"ATTACH DATABASE '{CONNECT_DB_AUX}' as aux_db")
 
     @staticmethod
     def custom_collation(a, b):
@@ -703,34 +881,198 @@ class DatabaseBooks(Database):
                 self._cached_langs = cursor.fetchall()
         return self._cached_langs
 
-    def search_books(self, query, max_books, lang, sort_order, size_limit, rating_filter=None):
+    def has_fts_index(self):
+        """Проверяет наличие полнотекстового индекса BooksFTS (с кешированием)"""
+        if self._has_fts is None:
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(SQL_QUERY_FTS_EXISTS)
+                self._has_fts = cursor.fetchone() is not None
+            if not self._has_fts:
+                print("Полнотекстовый индекс BooksFTS не найден, поиск по словам выполняется через LIKE. "
+                      "Постройте индекс утилитой tools/db_books_fts.py")
+        return self._has_fts
+
+    def get_book_card(self, file_name):
+        """Возвращает карточку книги или None, если книга не найдена"""
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            if self._has_cards is None:
+                cursor.execute(SQL_QUERY_BOOKS_CARDS_EXISTS)
+                self._has_cards = cursor.fetchone() is not None
+            if self._has_cards:
+                sql = SQL_QUERY_BOOK_CARD.format(card_fields="c.CoverHash, c.Annotation",
+                                                 card_join="LEFT JOIN Books_Cards c ON c.BookID = s.BookID")
+            else:
+                sql = SQL_QUERY_BOOK_CARD.format(card_fields="NULL, NULL", card_join="")
+            cursor.execute(sql, (file_name,))
+            row = cursor.fetchone()
+        return BookCard(*row) if row else None
+
+    def get_book_size(self, file_name):
+        """Возвращает размер книги по каталогу или None, если книга не найдена"""
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT BookSize FROM BookSearch WHERE FileName = ?", (file_name,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def check_search_table(self):
+        """
+        Проверяет наличие и актуальность таблицы BookSearch.
+        Возвращает текст ошибки, если искать книги невозможно, иначе None
+        """
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(SQL_QUERY_BOOK_SEARCH_EXISTS)
+            if cursor.fetchone() is None:
+                return "Таблица BookSearch не найдена. Постройте её утилитой tools/db_book_search.py"
+
+            try:
+                cursor.execute(SQL_QUERY_BOOK_SEARCH_ACTUAL)
+                is_actual = cursor.fetchone()[0]
+            except sqlite3.Error as e:
+                print(f"Не удалось проверить актуальность BookSearch: {e}")
+                is_actual = False
+
+            cursor.execute(SQL_QUERY_BOOK_SEARCH_INDEXES)
+            existing_indexes = {row[0] for row in cursor.fetchall()}
+
+        missing_indexes = [name for name in BOOK_SEARCH_REQUIRED_INDEXES if name not in existing_indexes]
+        if missing_indexes:
+            print(f"В таблице BookSearch нет индексов {', '.join(missing_indexes)}: поиск карточки книги будет медленным. "
+                  f"Создайте их утилитой tools/db_book_search.py --indexes")
+        if not is_actual:
+            print("Таблица BookSearch устарела относительно Books. Пересоберите её утилитой tools/db_book_search.py")
+        return None
+
+    def compile_books_query(self, query, lang, sort_order, size_limit, rating_filter=None):
+        """
+        Разбирает поисковый запрос и формирует условие поиска книг
+        :return: BooksQuery с условием WHERE, параметрами и порядком сортировки
+        """
+        use_fts = self.has_fts_index()
         # Разбиваем запрос на критерии и их значения
         criteries = extract_criteria(query)
         if criteries:
             # Если критерии заданы, формируем условие поиска книг по этим критериям
-            sql_where, params = self.build_sql_where_by_criteria(criteries, lang, size_limit, rating_filter)
+            sql_where, params = self.build_sql_where_by_criteria(criteries, lang, size_limit, rating_filter, use_fts)
         else:
             # Если критерии не заданы, формируем условие поиска книг по словам в запросе
             words = split_query_into_words(query)
-            sql_where, params = self.build_sql_where(words, lang, size_limit, rating_filter)
+            sql_where, params = self.build_sql_where(words, lang, size_limit, rating_filter, use_fts)
+
+        # Порядок сортировки подставляется в SQL, поэтому допускаем только два значения
+        sort_order = 'ASC' if str(sort_order).upper() == 'ASC' else 'DESC'
+        return BooksQuery(sql_where, tuple(params), sort_order)
 
-        # Строим запросы для поиска книг и подсчёта количества найденных книг
-        sql_query, sql_query_cnt = self.build_sql_queries(sql_where, max_books, sort_order)
+    def search_books(self, query, max_books, lang, sort_order, size_limit, rating_filter=None):
+        books_query = self.compile_books_query(query, lang, sort_order, size_limit, rating_filter)
+        sql_where, params = books_query.sql_where, books_query.params
+
+        # Строим запрос для поиска книг, количество найденных книг считаем по выбранным строкам
+        sql_query = self.build_sql_query(sql_where, max_books, books_query.sort_order)
 
         # #DEBUG
         # print(sql_query)
         # print(params)
 
-        # выполняем запросы поиска книг и подсчёта количества найденных книг
+        # выполняем запрос поиска книг, выборка не ограничена - её размер и есть количество найденных книг
         with self.connect() as conn:
-            conn.create_function("REMOVE_PUNCTUATION", 1, remove_punctuation)
             cursor = conn.cursor()
             cursor.execute(sql_query, params)
             books = [Book(*row) for row in cursor.fetchall()]
-            cursor.execute(sql_query_cnt, params)
+
+        return books, len(books)
+
+    def search_books_page(self, query, page_size, lang, sort_order, size_limit, rating_filter=None,
+                          count_limit=SEARCH_COUNT_LIMIT):
+        """
+        Ищет книги постранично: возвращает скомпилированный запрос, первую страницу книг и количество найденных книг.
+        Следующие страницы читаются через fetch_books_page по сохранённому запросу
+        :param count_limit: предел подсчёта; 0 - точное количество считается в том же проходе, что и первая страница
+        :return: (BooksQuery, книги первой страницы, количество, признак того, что количество ограничено пределом)
+        """
+        books_query = self.compile_books_query(query, lang, sort_order, size_limit, rating_filter)
+
+        if not count_limit:
+            # Оконный COUNT(*) OVER () считает все совпадения за тот же проход, что выбирает первую страницу
+            sql_query, params, _ = self.build_books_page_query(books_query, page_size, extra_fields="COUNT(*) OVER ()")
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql_query, params)
+                rows = cursor.fetchall()
+            books = [Book(*row[:-1]) for row in rows]
+            count = rows[0][-1] if rows else 0
+            return books_query, books, count, False
+
+        # Подсчёт с пределом останавливается на count_limit + 1 совпадении
+        books = self.fetch_books_page(books_query, page_size)
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM BookSearch {books_query.sql_where} LIMIT ?)",
+                           (*books_query.params, count_limit + 1))
             count = cursor.fetchone()[0]
 
-        return books, count
+        if count > count_limit:
+            return books_query, books, count_limit, True
+        return books_query, books, count, False
+
+    def fetch_books_page(self, books_query, page_size, after=None, before=None, from_end=False):
+        """
+        Читает одну страницу книг keyset-пагинацией по ключу (UpdateDate, FileName)
+        :param books_query: скомпилированный запрос BooksQuery
+        :param page_size: количество книг на странице
+        :param after: ключ последней книги предыдущей страницы - читаем следующую страницу
+        :param before: ключ первой книги следующей страницы - читаем предыдущую страницу
+        :param from_end: читаем последнюю страницу
+        :return: список книг страницы в порядке выдачи
+        """
+        sql_query, params, reverse = self.build_books_page_query(books_query, page_size, after, before, from_end)
+
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query, params)
+            books = [Book(*row) for row in cursor.fetchall()]
+
+        # Предыдущую и последнюю страницы читаем в обратном порядке и затем разворачиваем
+        if reverse:
+            books.reverse()
+        return books
+
+    @staticmethod
+    def build_books_page_query(books_query, page_size, after=None, before=None, from_end=False, extra_fields=None):
+        """
+        Строит запрос одной страницы книг по ключу (UpdateDate, FileName)
+        :param extra_fields: дополнительные выражения в конце списка полей
+        :return: текст запроса, параметры и признак обратного порядка чтения
+        """
+        reverse = before is not None or from_end
+        direction = books_query.sort_order
+        if reverse:
+            direction = 'ASC' if direction == 'DESC' else 'DESC'
+
+        sql_where = books_query.sql_where
+        params = list(books_query.params)
+        cursor_key = after if after is not None else before
+        if cursor_key is not None:
+            comparison = '>' if direction == 'ASC' else '<'
+            sql_where += f" AND (UpdateDate, FileName) {comparison} (?, ?)"
+            params.extend(cursor_key)
+        params.append(page_size)
+
+        fields = ', '.join(Book._fields) + (f", {extra_fields}" if extra_fields else '')
+        sql_query = f"""
+            SELECT {fields} FROM BookSearch {sql_where}
+            ORDER BY UpdateDate {direction}, FileName {direction}
+            LIMIT ?
+        """
+        return sql_query, params, reverse
+
+    @staticmethod
+    def get_book_key(book):
+        """Ключ книги для keyset-пагинации"""
+        return book.UpdateDate, book.FileName
 
 #    @staticmethod
 #    def build_sql_where(words):
@@ -763,6 +1105,11 @@ class DatabaseBooks(Database):
             #condition = f"{field} NOT LIKE '%{word}%'"  # COLLATE MHL_SYSTEM_NOCASE")
             condition = f"{field} NOT LIKE ?"  # COLLATE MHL_SYSTEM_NOCASE")
             value = '%{word}%'
+        elif operator == '=' and field in BOOK_SEARCH_MULTI_VALUE_FIELDS:
+            # точное совпадение с одним из значений многозначного поля (например, одним из авторов книги)
+            sep = BOOK_SEARCH_VALUE_SEPARATOR
+            condition = f"'{sep}' || {field} || '{sep}' LIKE ?"
+            value = f'%{sep}{word}{sep}%'
         elif operator == '=':
             #condition = f"{field} LIKE '{word}'"  # COLLATE MHL_SYSTEM_NOCASE")
             condition = f"{field} = ?"  # COLLATE MHL_SYSTEM_NOCASE") #LIKE
@@ -783,16 +1130,112 @@ class DatabaseBooks(Database):
         return  condition, value
 
     @staticmethod
-    def build_sql_where(words, lang, size_limit, rating_filter=None):
+    def make_fts_term(source_word, whole_word=True):
+        """
+        Формирует терм запроса FTS5 для отдельного слова
+        :param source_word: исходное слово поиска
+        :param whole_word: индикатор поиска целого слова, иначе слово ищется как префикс
+        :return: терм FTS5 или None, если слово нельзя выразить через индекс (например, % в начале или середине слова)
+        """
+        word = source_word.upper()
+        prefix = not whole_word
+        # Символ % в конце слова означает поиск по началу слова
+        if word.endswith('%'):
+            word = word.rstrip('%')
+            prefix = True
+        if '%' in word or '_' in word:
+            return None
+
+        # Слово разбивается так же, как и строка FullSearch, несколько частей ищутся как фраза
+        tokens = remove_punctuation(word).split()
+        if not tokens:
+            return None
+
+        term = '"' + ' '.join(tokens) + '"'
+        return term + '*' if prefix else term
+
+    @staticmethod
+    def build_fts_match(positive_terms, negative_terms):
+        """
+        Собирает выражение MATCH из обязательных и исключаемых термов.
+        FTS5 не умеет искать только по исключениям, в этом случае возвращается None
+        """
+        if not positive_terms:
+            return None
+        match = f"({' AND '.join(positive_terms)})"
+        for term in negative_terms:
+            match += f" NOT {term}"
+        return match
+
+    @staticmethod
+    def build_fts_match_by_words(words, whole_word=True):
+        """
+        Формирует выражение MATCH по списку кортежей (слово, оператор).
+        Возвращает None, если хотя бы одно слово нельзя выразить через индекс
+        """
+        positive_terms = []
+        negative_terms = []
+        for word, operator in words:
+            term = DatabaseBooks.make_fts_term(word, whole_word and operator != '=')
+            if term is None:
+                return None
+            if operator in ('<>', 'NOT LIKE'):
+                negative_terms.append(term)
+            elif operator in ('LIKE', '='):
+                positive_terms.append(term)
+            else:
+                return None
+        return DatabaseBooks.build_fts_match(positive_terms, negative_terms)
+
+    @staticmethod
+    def build_fts_match_by_criteria(criteria_tuples):
+        """
+        Формирует выражение MATCH по критериям "полный" (с учётом OR-групп через |).
+        Возвращает None, если критерии нельзя выразить через индекс
+        """
+        and_words = [(value, operator) for _, value, operator, combiner in criteria_tuples if combiner != 'OR']
+        or_words = [(value, operator) for _, value, operator, combiner in criteria_tuples if combiner == 'OR']
+
+        # В критериях слово ищется как подстрока, ближайший аналог в индексе - поиск по префиксу
+        positive_terms = []
+        negative_terms = []
+        for word, operator in and_words:
+            term = DatabaseBooks.make_fts_term(word, operator == '=')
+            if term is None:
+                return None
+            if operator in ('<>', 'NOT LIKE'):
+                negative_terms.append(term)
+            else:
+                positive_terms.append(term)
+
+        if or_words:
+            or_terms = []
+            for word, operator in or_words:
+                term = DatabaseBooks.make_fts_term(word, operator == '=')
+                if term is None or operator in ('<>', 'NOT LIKE'):
+                    return None
+                or_terms.append(term)
+            positive_terms.append(f"({' OR '.join(or_terms)})")
+
+        return DatabaseBooks.build_fts_match(positive_terms, negative_terms)
+
+    @staticmethod
+    def build_sql_where(words, lang, size_limit, rating_filter=None, use_fts=False):
         """
         Создает SQL-условие WHERE на основе списка слов и их операторов.
+        При наличии полнотекстового индекса слова ищутся через него, иначе сканированием FullSearch.
         """
         conditions = []
         params = []
-        for word, operator in words:
-            condition, param = DatabaseBooks.make_condition("FullSearch", word, operator)
-            conditions.append(condition)
-            params.append(param)
+        fts_match = DatabaseBooks.build_fts_match_by_words(words) if use_fts else None
+        if fts_match:
+            conditions.append(SQL_CONDITION_FTS)
+            params.append(fts_match)
+        else:
+            for word, operator in words:
+                condition, param = DatabaseBooks.make_condition("FullSearch", word, operator)
+                conditions.append(condition)
+                params.append(param)
 
         # Добавляем условие по языку, если задан в настройках пользователя
         if lang and conditions:
@@ -814,27 +1257,18 @@ class DatabaseBooks(Database):
         return sql_where, params
 
     @staticmethod
-    def build_sql_queries(sql_where, max_books, sort_order):
+    def build_sql_query(sql_where, max_books, sort_order):
         fields = Book._fields
-        processed_fields = [fields[0]] + [f"max({field})" for field in fields[1:]]
-        select_fields = ', '.join(processed_fields)
 
         sql_query = f"""
-            SELECT {select_fields} 
-            FROM ({SQL_QUERY_BOOKS} {sql_where} --LIMIT {max_books * 3}
-            )
-            GROUP BY {fields[0]}
-            ORDER BY {fields[-1]} {sort_order}
+            {SQL_QUERY_BOOKS} {sql_where}
+            ORDER BY {fields[-1]} {sort_order}, FileName {sort_order}
             --LIMIT {max_books}
         """
-        sql_query_cnt = f"""
-            SELECT COUNT(*) 
-            FROM (SELECT {select_fields} FROM ({SQL_QUERY_BOOKS} {sql_where}) GROUP BY {fields[0]})
-        """
-        return sql_query, sql_query_cnt
+        return sql_query
 
     @staticmethod
-    def build_sql_where_by_criteria(criteria_tuples, lang, size_limit, rating_filter=None):
+    def build_sql_where_by_criteria(criteria_tuples, lang, size_limit, rating_filter=None, use_fts=False):
         # Базовая часть SQL-запроса
         sql_where = "WHERE "
 
@@ -846,6 +1280,15 @@ class DatabaseBooks(Database):
 
         column_mapping = SEARCH_CRITERIA
 
+        # Критерии "полный" по возможности ищем через полнотекстовый индекс
+        if use_fts:
+            fts_criteria = [c for c in criteria_tuples if column_mapping.get(c[0].lower()) == 'FullSearch']
+            fts_match = DatabaseBooks.build_fts_match_by_criteria(fts_criteria) if fts_criteria else None
+            if fts_match:
+                conditions.append(SQL_CONDITION_FTS)
+                params.append(fts_match)
+                criteria_tuples = [c for c in criteria_tuples if c not in fts_criteria]
+
         # Формируем условия для каждого критерия
         for criterion, value, operator, combiner in criteria_tuples:
             # Преобразуем критерий в название столбца
@@ -954,40 +1397,37 @@ class DatabaseBooks(Database):
 
     def search_series(self, query, max_books, lang, size_limit, rating_filter=None):
         """Ищет серии по запросу"""
+        use_fts = self.has_fts_index()
         # Разбиваем запрос на критерии
         criteries = extract_criteria(query)
 
         if criteries:
-            sql_where, params = self.build_sql_where_by_criteria(criteries, lang, size_limit, rating_filter)
+            sql_where, params = self.build_sql_where_by_criteria(criteries, lang, size_limit, rating_filter, use_fts)
         else:
             words = split_query_into_words(query)
-            sql_where, params = self.build_sql_where(words, lang, size_limit, rating_filter)
+            sql_where, params = self.build_sql_where(words, lang, size_limit, rating_filter, use_fts)
 
         # Модифицируем запрос для поиска серий
         sql_query = f"""
         SELECT 
             SeriesTitle, 
             SearchSeriesTitle,
-            COUNT(DISTINCT FileName) as book_count
-        FROM ({SQL_QUERY_BOOKS} {sql_where}) 
+            COUNT(*) as book_count
+        FROM (SELECT SeriesTitle, SearchSeriesTitle FROM BookSearch {sql_where}) 
         WHERE SeriesTitle IS NOT NULL
         GROUP BY SeriesTitle, SearchSeriesTitle
         ORDER BY book_count DESC, SeriesTitle
         --LIMIT {max_books}
         """
 
-        sql_query_cnt = f"SELECT COUNT(*) FROM ({sql_query})"
-
         # #debug
         # print(sql_query)
         # print(params)
 
         with self.connect() as conn:
-            conn.create_function("REMOVE_PUNCTUATION", 1, remove_punctuation)
             cursor = conn.cursor()
             cursor.execute(sql_query, params)
             series = cursor.fetchall()
-            cursor.execute(sql_query_cnt, params)
-            count = cursor.fetchone()[0]
 
-        return series, count
\ No newline at end of file
+        # Серии выбираются целиком, поэтому их количество известно без отдельного подсчёта
+        return series, len(series)
\ No newline at end of file
@@ -0,0 +1,69 @@
+from constants import DELIVERY_DIRECT_MAX_SIZE, DELIVERY_ARCHIVE_ONLY_SIZE, DOWNLOAD_MAX_SIZE
+
+# Способы доставки книги
+ROUTE_DIRECT = 'direct'              # файлом в чат
+ROUTE_LINK = 'link'                  # ссылкой на скачивание
+ROUTE_ARCHIVE_ONLY = 'archive_only'  # не отправляется, только сообщение, где её взять
+
+ROUTE_TITLES = {
+    ROUTE_DIRECT: 'файлом',
+    ROUTE_LINK: 'ссылкой',
+    ROUTE_ARCHIVE_ONLY: 'только в архиве'
+}
+
+
+class DeliveryPlanner:
+    """
+    Выбирает способ доставки книги по размеру заранее, а не после таймаута отправки:
+    до скачивания - по размеру из каталога (слишком большие книги не скачиваются вовсе),
+    после скачивания - по фактическому размеру файла (большие файлы сразу отправляются ссылкой).
+    Ведёт статистику решений и времени доставки по каждому способу.
+    """
+
+    def __init__(self, direct_max_size=DELIVERY_DIRECT_MAX_SIZE, archive_only_size=DELIVERY_ARCHIVE_ONLY_SIZE,
+                 download_max_size=DOWNLOAD_MAX_SIZE):
+        self.direct_max_size = direct_max_size
+        # Книги больше допустимого для скачивания размера всё равно не скачаются - их сразу не скачиваем
+        self.archive_only_size = min(archive_only_size or download_max_size, download_max_size)
+        self._routes = {route: {'planned': 0, 'delivered': 0, 'failed': 0, 'time_total': 0.0, 'time_max': 0.0}
+                        for route in ROUTE_TITLES}
+
+    def plan_before_download(self, catalogue_size):
+        """
+        Решение до скачивания по размеру книги из каталога
+        :return: ROUTE_ARCHIVE_ONLY или None, если книгу нужно скачать и решить по фактическому размеру
+        """
+        if catalogue_size and self.archive_only_size and catalogue_size > self.archive_only_size:
+            self._routes[ROUTE_ARCHIVE_ONLY]['planned'] += 1
+            return ROUTE_ARCHIVE_ONLY
+        return None
+
+    def plan_after_download(self, actual_size):
+        """Решение по фактическому размеру скачанного файла: файлом или ссылкой"""
+        route = ROUTE_LINK if actual_size > self.direct_max_size else ROUTE_DIRECT
+        self._routes[route]['planned'] += 1
+        return route
+
+    def record(self, route, elapsed, success=True):
+        """Записывает результат доставки выбранным способом и её время в секундах"""
+        stats = self._routes[route]
+        if success:
+            stats['delivered'] += 1
+            stats['time_total'] += elapsed
+            stats['time_max'] = max(stats['time_max'], elapsed)
+        else:
+            stats['failed'] += 1
+
+    def get_stats(self):
+        """Возвращает статистику по способам доставки"""
+        return {
+            route: {
+                'title': ROUTE_TITLES[route],
+                'planned': stats['planned'],
+                'delivered': stats['delivered'],
+                'failed': stats['failed'],
+                'time_avg': round(stats['time_total'] / stats['delivered'], 2) if stats['delivered'] else 0,
+                'time_max': round(stats['time_max'], 2)
+            }
+            for route, stats in self._routes.items()
+        }
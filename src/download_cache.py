@@ -0,0 +1,142 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from constants import DOWNLOAD_CACHE_PATH, DOWNLOAD_CACHE_SIZE
+
+
+class DownloadCache:
+    """
+    Дисковый кэш скачанных книг: <каталог>/<id книги>.<формат>/<оригинальное имя файла>.
+    Размер ограничен: при переполнении удаляются давно не использованные книги.
+    Методы блокирующие (копирование файлов) - из цикла событий их вызывают через asyncio.to_thread.
+    """
+
+    def __init__(self, path=DOWNLOAD_CACHE_PATH, max_size=DOWNLOAD_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (id книги, формат) -> (путь к файлу, размер); порядок - от старых к новым
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evicted = 0
+        if self.path:
+            self._load()
+
+    @property
+    def enabled(self):
+        return bool(self.path) and self.max_size > 0
+
+    def _get_entry_dir(self, book_id, book_format):
+        return os.path.join(self.path, f"{book_id}.{book_format}")
+
+    def _load(self):
+        """Читает содержимое кэша с диска (порядок вытеснения - по времени последнего использования)"""
+        os.makedirs(self.path, exist_ok=True)
+        found = []
+        for entry_name in os.listdir(self.path):
+            book_id, _, book_format = entry_name.rpartition('.')
+            entry_dir = os.path.join(self.path, entry_name)
+            if not book_id or not os.path.isdir(entry_dir):
+                continue
+            for file_name in os.listdir(entry_dir):
+                file_path = os.path.join(entry_dir, file_name)
+                if file_name.endswith('.tmp'):
+                    # Недописанный файл от прерванной записи
+                    os.remove(file_path)
+                    continue
+                stat = os.stat(file_path)
+                found.append((stat.st_mtime, (book_id, book_format), file_path, stat.st_size))
+        for _, key, file_path, size in sorted(found):
+            self._entries[key] = (file_path, size)
+            self._size += size
+
+    def get(self, book_id, book_format):
+        """
+        Возвращает путь к книге в кэше или None
+        Время изменения файла обновляется - по нему определяется порядок вытеснения после перезапуска
+        """
+        key = (book_id, book_format)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not os.path.isfile(entry[0]):
+                if entry is not None:
+                    self._remove(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+        try:
+            os.utime(entry[0])
+        except OSError:
+            pass
+        return entry[0]
+
+    def put(self, book_id, book_format, book_file, file_name):
+        """
+        Сохраняет книгу из открытого файла в кэш
+        :return: путь к книге в кэше или None, если кэш выключен
+        """
+        if not self.enabled:
+            return None
+        file_name = os.path.basename(file_name) or f"{book_id}.{book_format}"
+        entry_dir = self._get_entry_dir(book_id, book_format)
+        os.makedirs(entry_dir, exist_ok=True)
+        file_path = os.path.join(entry_dir, file_name)
+
+        # Пишем во временный файл и переименовываем, чтобы недописанную книгу никто не прочитал
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        book_file.seek(0)
+        with open(tmp_path, 'wb') as cache_file:
+            shutil.copyfileobj(book_file, cache_file)
+        book_file.seek(0)
+        os.replace(tmp_path, file_path)
+        size = os.path.getsize(file_path)
+
+        key = (book_id, book_format)
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._size -= old_entry[1]
+                if old_entry[0] != file_path:
+                    self._delete_file(old_entry[0])
+            self._entries[key] = (file_path, size)
+            self._size += size
+            self._evict()
+        return file_path
+
+    def _remove(self, key):
+        file_path, size = self._entries.pop(key)
+        self._size -= size
+        self._delete_file(file_path)
+
+    @staticmethod
+    def _delete_file(file_path):
+        try:
+            os.remove(file_path)
+            os.rmdir(os.path.dirname(file_path))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Удаляет давно не использованные книги, пока кэш больше допустимого (последнюю добавленную не трогаем)"""
+        while self._size > self.max_size and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self._evicted += 1
+
+    def get_stats(self):
+        """Возвращает статистику кэша"""
+        with self._lock:
+            requests_count = self._hits + self._misses
+            return {
+                'files': len(self._entries),
+                'size': self._size,
+                'max_size': self.max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evicted': self._evicted,
+                'hit_rate': round(self._hits / requests_count * 100, 1) if requests_count else 0
+            }
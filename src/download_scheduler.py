@@ -0,0 +1,134 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from constants import DOWNLOADS_MAX_ACTIVE, DOWNLOADS_MAX_PER_HOST
+
+
+class DownloadTicket:
+    """Заявка на отправку книги в очереди планировщика"""
+
+    def __init__(self, owner, host):
+        self.owner = owner
+        self.host = host
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self._granted = asyncio.Event()
+
+    @property
+    def is_granted(self):
+        return self._granted.is_set()
+
+    async def wait(self):
+        """Ждёт своей очереди"""
+        await self._granted.wait()
+
+
+class DownloadScheduler:
+    """
+    Планировщик отправки книг.
+    Ограничивает число одновременных скачиваний и загрузок всего и на один сайт-источник,
+    а очередь обходит по кругу между пользователями: один пользователь с десятком книг не задерживает остальных.
+    """
+
+    def __init__(self, max_active=DOWNLOADS_MAX_ACTIVE, max_per_host=DOWNLOADS_MAX_PER_HOST):
+        self.max_active = max(1, max_active)
+        self.max_per_host = max(1, max_per_host)
+        # Владелец заявок -> его очередь; порядок ключей - порядок обхода по кругу
+        self._queues = OrderedDict()
+        self._active = 0
+        self._active_by_host = {}
+        self._served = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._service_total = 0.0
+        self._service_max = 0.0
+
+    def enqueue(self, owner, host):
+        """
+        Ставит заявку в очередь
+        :param owner: кто запросил книгу (для справедливой очереди), например (chat_id, user_id)
+        :param host: сайт, с которого будет скачиваться книга
+        """
+        ticket = DownloadTicket(owner, host)
+        self._queues.setdefault(owner, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    def _pick_next(self):
+        """Выбирает следующую заявку: первого по кругу владельца, чей сайт не исчерпал лимит"""
+        for owner, queue in self._queues.items():
+            ticket = queue[0]
+            if self._active_by_host.get(ticket.host, 0) < self.max_per_host:
+                queue.popleft()
+                # Обслуженный владелец уходит в конец круга
+                del self._queues[owner]
+                if queue:
+                    self._queues[owner] = queue
+                return ticket
+        return None
+
+    def _dispatch(self):
+        """Запускает заявки, пока есть свободные места"""
+        while self._active < self.max_active:
+            ticket = self._pick_next()
+            if ticket is None:
+                break
+            self._active += 1
+            self._active_by_host[ticket.host] = self._active_by_host.get(ticket.host, 0) + 1
+            ticket.started_at = time.monotonic()
+            wait_time = ticket.started_at - ticket.enqueued_at
+            self._wait_total += wait_time
+            self._wait_max = max(self._wait_max, wait_time)
+            ticket._granted.set()
+
+    def get_position(self, ticket):
+        """Позиция заявки в очереди с учётом обхода по кругу (0 - заявка уже выполняется)"""
+        queue = self._queues.get(ticket.owner)
+        if ticket.is_granted or queue is None or ticket not in queue:
+            return 0
+        index = queue.index(ticket)
+        position = index
+        owner_passed = False
+        for owner, other_queue in self._queues.items():
+            if owner == ticket.owner:
+                owner_passed = True
+            else:
+                # Владельцы раньше по кругу успеют получить на одну книгу больше
+                position += min(len(other_queue), index if owner_passed else index + 1)
+        return position + 1
+
+    def release(self, ticket):
+        """Освобождает место заявки (или убирает её из очереди, если она так и не была запущена)"""
+        if not ticket.is_granted:
+            queue = self._queues.get(ticket.owner)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[ticket.owner]
+            return
+
+        service_time = time.monotonic() - ticket.started_at
+        self._service_total += service_time
+        self._service_max = max(self._service_max, service_time)
+        self._served += 1
+        self._active -= 1
+        self._active_by_host[ticket.host] -= 1
+        if not self._active_by_host[ticket.host]:
+            del self._active_by_host[ticket.host]
+        self._dispatch()
+
+    def get_stats(self):
+        """Возвращает статистику очереди отправки книг"""
+        started = self._served + self._active
+        return {
+            'max_active': self.max_active,
+            'max_per_host': self.max_per_host,
+            'active': self._active,
+            'queued': sum(len(queue) for queue in self._queues.values()),
+            'served': self._served,
+            'wait_avg': round(self._wait_total / started, 2) if started else 0,
+            'wait_max': round(self._wait_max, 2),
+            'service_avg': round(self._service_total / self._served, 2) if self._served else 0,
+            'service_max': round(self._service_max, 2)
+        }
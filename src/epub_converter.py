@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+from io import BytesIO
+
+from constants import DEFAULT_BOOK_FORMAT
+from fb2_epub import EPUB_FORMAT
+
+
+class EpubConverter:
+    """
+    EPUB из fb2 на стороне бота, без запроса к сайту (сайт преобразует книги медленно и бывает недоступен).
+    Исходный fb2 берётся из кэша скачиваний или из локального архива, результат сохраняется в дисковый кэш
+    преобразованных книг. Для сравнения ведётся статистика времени преобразования и скачивания EPUB с сайта.
+    """
+
+    def __init__(self, parser, converted_cache, download_cache, local_archives):
+        self.parser = parser
+        self.converted_cache = converted_cache
+        self.download_cache = download_cache
+        self.local_archives = local_archives
+        self._stats = {'cache_hits': 0, 'converted': 0, 'failed': 0, 'no_source': 0,
+                       'convert_total': 0.0, 'convert_max': 0.0, 'upstream': 0, 'upstream_total': 0.0,
+                       'upstream_max': 0.0}
+
+    @property
+    def enabled(self):
+        return self.converted_cache.enabled
+
+    def can_convert(self, book_format, file_ext):
+        return self.enabled and book_format == EPUB_FORMAT and file_ext == f".{DEFAULT_BOOK_FORMAT}"
+
+    async def _read_source(self, book_id, file_name, file_ext, folder):
+        """Исходный fb2 (zip): сначала из кэша скачиваний, затем из локального архива"""
+        source_path = await asyncio.to_thread(self.download_cache.get, book_id, DEFAULT_BOOK_FORMAT)
+        if source_path is not None:
+            return open(source_path, 'rb')
+        source_file, _ = await self.local_archives.read_book(folder, file_name, file_ext)
+        return source_file
+
+    async def get_epub(self, book_id, file_name, file_ext, folder=None):
+        """
+        Возвращает книгу в EPUB из кэша или преобразует её из fb2
+        :return: (открытый файл EPUB, имя файла) или (None, None), если EPUB нужно брать с сайта
+        """
+        epub_path = await asyncio.to_thread(self.converted_cache.get, book_id, EPUB_FORMAT)
+        if epub_path is not None:
+            self._stats['cache_hits'] += 1
+            return open(epub_path, 'rb'), os.path.basename(epub_path)
+
+        source_file = await self._read_source(book_id, file_name, file_ext, folder)
+        if source_file is None:
+            self._stats['no_source'] += 1
+            return None, None
+
+        started_at = time.monotonic()
+        try:
+            epub_bytes, epub_filename = await self.parser.convert_to_epub(source_file, book_id)
+        except Exception as e:
+            print(f"Ошибка преобразования книги {book_id} в EPUB: {e}")
+            self._stats['failed'] += 1
+            return None, None
+        finally:
+            source_file.close()
+        self._record('convert', time.monotonic() - started_at)
+        self._stats['converted'] += 1
+
+        epub_path = await asyncio.to_thread(self.converted_cache.put, book_id, EPUB_FORMAT, BytesIO(epub_bytes),
+                                            epub_filename)
+        return (open(epub_path, 'rb') if epub_path else BytesIO(epub_bytes)), epub_filename
+
+    def record_upstream(self, elapsed):
+        """Записывает время скачивания EPUB с сайта (для сравнения со временем преобразования)"""
+        self._stats['upstream'] += 1
+        self._record('upstream', elapsed)
+
+    def _record(self, name, elapsed):
+        self._stats[f"{name}_total"] += elapsed
+        self._stats[f"{name}_max"] = max(self._stats[f"{name}_max"], elapsed)
+
+    def get_stats(self):
+        """Возвращает статистику преобразования и скачивания EPUB с сайта"""
+        stats = self._stats
+        return {
+            'enabled': self.enabled,
+            'cache_hits': stats['cache_hits'],
+            'converted': stats['converted'],
+            'failed': stats['failed'],
+            'no_source': stats['no_source'],
+            'convert_avg': round(stats['convert_total'] / stats['converted'], 2) if stats['converted'] else 0,
+            'convert_max': round(stats['convert_max'], 2),
+            'upstream': stats['upstream'],
+            'upstream_avg': round(stats['upstream_total'] / stats['upstream'], 2) if stats['upstream'] else 0,
+            'upstream_max': round(stats['upstream_max'], 2),
+            'cache': self.converted_cache.get_stats()
+        }
@@ -0,0 +1,337 @@
+import base64
+import binascii
+import os
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from html import escape
+from io import BytesIO
+
+from utils import detect_fb2_encoding, FB2_NAMESPACE, XLINK_NAMESPACE, FB2_SNIFF_SIZE
+
+EPUB_FORMAT = 'epub'
+
+FB = f"{{{FB2_NAMESPACE}}}"
+XLINK_HREF = f"{{{XLINK_NAMESPACE}}}href"
+
+# Простые элементы fb2 -> элементы XHTML
+BLOCK_TAGS = {
+    'p': ('p', None),
+    'subtitle': ('p', 'subtitle'),
+    'text-author': ('p', 'text-author'),
+    'v': ('p', 'v'),
+    'epigraph': ('div', 'epigraph'),
+    'cite': ('blockquote', None),
+    'poem': ('div', 'poem'),
+    'stanza': ('div', 'stanza'),
+    'annotation': ('div', 'annotation'),
+    'table': ('table', None),
+    'tr': ('tr', None),
+    'th': ('th', None),
+    'td': ('td', None),
+    'date': ('p', 'date'),
+}
+INLINE_TAGS = {
+    'strong': 'strong',
+    'emphasis': 'em',
+    'style': 'span',
+    'strikethrough': 'del',
+    'sub': 'sub',
+    'sup': 'sup',
+    'code': 'code',
+}
+IMAGE_EXTENSIONS = {'image/jpeg': 'jpg', 'image/jpg': 'jpg', 'image/png': 'png', 'image/gif': 'gif'}
+
+EPUB_CSS = """body { margin: 0 2%; text-align: justify; }
+h1, h2, h3, h4, h5, h6 { text-align: center; page-break-after: avoid; }
+p { margin: 0; text-indent: 1.5em; }
+p.subtitle, p.empty { text-align: center; text-indent: 0; }
+p.text-author, p.date { text-align: right; font-style: italic; }
+p.v { text-indent: 0; margin-left: 2em; }
+div.epigraph { margin: 1em 0 1em 30%; font-style: italic; }
+div.stanza { margin: 1em 0; }
+div.image { text-align: center; margin: 1em 0; }
+img { max-width: 100%; }
+blockquote { margin: 1em 2em; }
+"""
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+XHTML_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title>{title}</title><link rel="stylesheet" type="text/css" href="style.css"/></head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+
+def _local_name(element):
+    tag = element.tag
+    return tag[len(FB):] if isinstance(tag, str) and tag.startswith(FB) else None
+
+
+def _text(element):
+    """Текст элемента без разметки, пробелы схлопнуты"""
+    return ' '.join(''.join(element.itertext()).split()) if element is not None else ''
+
+
+def _title_text(title):
+    """Текст заголовка: строки заголовка через пробел"""
+    if title is None:
+        return ''
+    return ' '.join(filter(None, (_text(line) for line in title))) or _text(title)
+
+
+def load_fb2(fb2_data):
+    """Разбирает fb2 целиком (кодировка определяется так же, как при извлечении обложки)"""
+    encoding, declared = detect_fb2_encoding(fb2_data[:FB2_SNIFF_SIZE])
+    if declared or encoding == 'utf-8':
+        # Мусор перед началом XML (встречается в битых файлах) expat не принимает
+        start = 0 if encoding.startswith('utf-16') else max(fb2_data.find(b'<'), 0)
+        return ET.fromstring(fb2_data[start:])
+    text = fb2_data.decode(encoding, errors='replace')
+    return ET.fromstring(text[text.find('<'):])
+
+
+class Fb2EpubConverter:
+    """
+    Преобразует fb2 в EPUB 2: каждый раздел верхнего уровня - отдельный XHTML-файл,
+    сноски - отдельный файл, картинки из binary - отдельные файлы, оглавление - toc.ncx
+    """
+
+    def __init__(self, root, book_id=None):
+        self.root = root
+        self.book_id = book_id
+        self.images = {}     # id картинки в fb2 -> (имя файла, тип)
+        self.anchors = {}    # id элемента в fb2 -> файл XHTML, в котором он окажется
+        self.chapters = []   # (имя файла, заголовок, элементы fb2, уровень заголовков)
+        self.description = root.find(f"{FB}description")
+        self.title_info = self.description.find(f"{FB}title-info") if self.description is not None else None
+
+    def _find_info(self, path):
+        return self.title_info.find(path) if self.title_info is not None else None
+
+    def _collect_images(self):
+        for binary in self.root.iter(f"{FB}binary"):
+            image_id = binary.get('id')
+            content_type = (binary.get('content-type') or '').lower()
+            extension = IMAGE_EXTENSIONS.get(content_type)
+            if image_id and extension and binary.text:
+                self.images[image_id] = (f"images/img{len(self.images)}.{extension}", content_type)
+
+    def _plan_chapters(self):
+        """Делит книгу на файлы и запоминает, в каком файле окажется каждый якорь для ссылок"""
+        for body in self.root.iter(f"{FB}body"):
+            is_notes = body.get('name') in ('notes', 'comments')
+            if is_notes:
+                self._add_chapter(_title_text(body.find(f"{FB}title")) or "Примечания", [body], 1)
+                continue
+            intro = [child for child in body if _local_name(child) != 'section']
+            sections = [child for child in body if _local_name(child) == 'section']
+            if intro:
+                self._add_chapter(_title_text(body.find(f"{FB}title")) or self._book_title(), intro, 1)
+            for section in sections:
+                self._add_chapter(_title_text(section.find(f"{FB}title")), [section], 1)
+
+    def _add_chapter(self, title, elements, level):
+        file_name = f"text{len(self.chapters)}.xhtml"
+        for element in elements:
+            for child in element.iter():
+                if child.get('id'):
+                    self.anchors[child.get('id')] = file_name
+        self.chapters.append((file_name, title or f"Глава {len(self.chapters) + 1}", elements, level))
+
+    def _book_title(self):
+        return _text(self._find_info(f"{FB}book-title")) or "Без названия"
+
+    def _authors(self):
+        authors = []
+        if self.title_info is not None:
+            for author in self.title_info.findall(f"{FB}author"):
+                name = ' '.join(_text(author.find(f"{FB}{part}"))
+                                for part in ('first-name', 'middle-name', 'last-name'))
+                name = ' '.join(name.split()) or _text(author.find(f"{FB}nickname"))
+                if name:
+                    authors.append(name)
+        return authors
+
+    def _render_link(self, href):
+        if href.startswith('#'):
+            anchor = href[1:]
+            return f"{self.anchors[anchor]}#{anchor}" if anchor in self.anchors else '#'
+        return href
+
+    def _render_image(self, element, block):
+        image = self.images.get((element.get(XLINK_HREF) or '').lstrip('#'))
+        if image is None:
+            return ''
+        img = f'<img src="{image[0]}" alt=""/>'
+        return f'<div class="image">{img}</div>' if block else img
+
+    def _render_inline(self, element):
+        parts = [escape(element.text or '', quote=False)]
+        for child in element:
+            name = _local_name(child)
+            inner = self._render_inline(child)
+            if name in INLINE_TAGS:
+                parts.append(f"<{INLINE_TAGS[name]}>{inner}</{INLINE_TAGS[name]}>")
+            elif name == 'a':
+                href = escape(self._render_link(child.get(XLINK_HREF) or ''), quote=True)
+                if child.get('type') == 'note':
+                    inner = f"<sup>{inner}</sup>"
+                parts.append(f'<a href="{href}">{inner}</a>')
+            elif name == 'image':
+                parts.append(self._render_image(child, block=False))
+            else:
+                parts.append(inner)
+            parts.append(escape(child.tail or '', quote=False))
+        return ''.join(parts)
+
+    def _render_block(self, element, level):
+        name = _local_name(element)
+        element_id = element.get('id')
+        id_attr = f' id="{escape(element_id, quote=True)}"' if element_id else ''
+        if name == 'section':
+            inner = ''.join(self._render_block(child, level + 1) for child in element)
+            return f'<div class="section"{id_attr}>{inner}</div>'
+        if name == 'title':
+            heading = f"h{min(level, 6)}"
+            lines = '<br/>'.join(self._render_inline(child) for child in element if _local_name(child) == 'p')
+            return f"<{heading}{id_attr}>{lines}</{heading}>"
+        if name == 'empty-line':
+            return '<p class="empty">&#160;</p>'
+        if name == 'image':
+            return self._render_image(element, block=True)
+        if name in ('p', 'subtitle', 'text-author', 'v', 'date', 'th', 'td'):
+            tag, css_class = BLOCK_TAGS[name]
+            class_attr = f' class="{css_class}"' if css_class else ''
+            return f"<{tag}{id_attr}{class_attr}>{self._render_inline(element)}</{tag}>"
+        if name in BLOCK_TAGS:
+            tag, css_class = BLOCK_TAGS[name]
+            class_attr = f' class="{css_class}"' if css_class else ''
+            inner = ''.join(self._render_block(child, level) for child in element)
+            return f"<{tag}{id_attr}{class_attr}>{inner}</{tag}>"
+        if name == 'body':
+            return ''.join(self._render_block(child, level) for child in element)
+        return ''
+
+    def _render_chapter(self, title, elements, level):
+        body = '\n'.join(self._render_block(element, level) for element in elements)
+        return XHTML_TEMPLATE.format(title=escape(title, quote=False), body=body)
+
+    def _render_cover(self):
+        cover = self._find_info(f"{FB}coverpage/{FB}image")
+        image = self.images.get((cover.get(XLINK_HREF) or '').lstrip('#')) if cover is not None else None
+        if image is None:
+            return None, None
+        body = f'<div class="image"><img src="{image[0]}" alt="{escape(self._book_title(), quote=True)}"/></div>'
+        return image, XHTML_TEMPLATE.format(title="Обложка", body=body)
+
+    def _render_opf(self, cover_image, has_cover_page):
+        title = escape(self._book_title(), quote=False)
+        language = _text(self._find_info(f"{FB}lang")) or 'ru'
+        identifier = f"flibusta-{self.book_id}" if self.book_id else \
+            _text(self.description.find(f"{FB}document-info/{FB}id")) if self.description is not None else ''
+        metadata = [f"<dc:title>{title}</dc:title>", f"<dc:language>{escape(language, quote=False)}</dc:language>",
+                    f'<dc:identifier id="book-id">{escape(identifier or title, quote=False)}</dc:identifier>']
+        metadata += [f'<dc:creator opf:role="aut">{escape(author, quote=False)}</dc:creator>'
+                     for author in self._authors()]
+        annotation = _text(self._find_info(f"{FB}annotation"))
+        if annotation:
+            metadata.append(f"<dc:description>{escape(annotation, quote=False)}</dc:description>")
+
+        manifest = ['<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>',
+                    '<item id="css" href="style.css" media-type="text/css"/>']
+        spine = []
+        if has_cover_page:
+            manifest.append('<item id="cover-page" href="cover.xhtml" media-type="application/xhtml+xml"/>')
+            spine.append('<itemref idref="cover-page" linear="no"/>')
+        for index, (file_name, _, _, _) in enumerate(self.chapters):
+            manifest.append(f'<item id="text{index}" href="{file_name}" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="text{index}"/>')
+        for index, (file_name, content_type) in enumerate(self.images.values()):
+            item_id = 'cover-image' if cover_image and file_name == cover_image[0] else f"img{index}"
+            manifest.append(f'<item id="{item_id}" href="{file_name}" media-type="{content_type}"/>')
+        if cover_image:
+            metadata.append('<meta name="cover" content="cover-image"/>')
+
+        return ('<?xml version="1.0" encoding="utf-8"?>\n'
+                '<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="book-id" version="2.0">\n'
+                '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">\n'
+                + '\n'.join(metadata) + '\n</metadata>\n<manifest>\n' + '\n'.join(manifest) +
+                '\n</manifest>\n<spine toc="ncx">\n' + '\n'.join(spine) + '\n</spine>\n</package>\n')
+
+    def _render_ncx(self):
+        points = [
+            f'<navPoint id="nav{index}" playOrder="{index + 1}"><navLabel><text>{escape(title, quote=False)}</text>'
+            f'</navLabel><content src="{file_name}"/></navPoint>'
+            for index, (file_name, title, _, _) in enumerate(self.chapters)
+        ]
+        return ('<?xml version="1.0" encoding="utf-8"?>\n'
+                '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">\n'
+                '<head><meta name="dtb:uid" content=""/></head>\n'
+                f'<docTitle><text>{escape(self._book_title(), quote=False)}</text></docTitle>\n'
+                '<navMap>\n' + '\n'.join(points) + '\n</navMap>\n</ncx>\n')
+
+    def convert(self):
+        """:return: байты EPUB"""
+        self._collect_images()
+        self._plan_chapters()
+        cover_image, cover_page = self._render_cover()
+
+        output = BytesIO()
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as epub:
+            # mimetype - первым и без сжатия, как требует стандарт
+            epub.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+            epub.writestr('META-INF/container.xml', CONTAINER_XML)
+            epub.writestr('OEBPS/content.opf', self._render_opf(cover_image, cover_page is not None))
+            epub.writestr('OEBPS/toc.ncx', self._render_ncx())
+            epub.writestr('OEBPS/style.css', EPUB_CSS)
+            if cover_page is not None:
+                epub.writestr('OEBPS/cover.xhtml', cover_page)
+            for file_name, title, elements, level in self.chapters:
+                epub.writestr(f"OEBPS/{file_name}", self._render_chapter(title, elements, level))
+            for binary in self.root.iter(f"{FB}binary"):
+                image = self.images.get(binary.get('id'))
+                if image is None:
+                    continue
+                try:
+                    image_bytes = base64.b64decode(binary.text)
+                except (binascii.Error, ValueError):
+                    continue
+                # Картинки уже сжаты - повторно не сжимаем
+                epub.writestr(f"OEBPS/{image[0]}", image_bytes, compress_type=zipfile.ZIP_STORED)
+        return output.getvalue()
+
+
+def get_epub_filename(fb2_filename):
+    """Имя файла EPUB по имени fb2 (или zip с fb2)"""
+    name = os.path.basename(fb2_filename)
+    name = re.sub(r'(\.fb2)?(\.zip)?$', '', name, flags=re.IGNORECASE)
+    return f"{name}.{EPUB_FORMAT}"
+
+
+def convert_fb2_zip_to_epub(zip_source, book_id=None):
+    """
+    Преобразует fb2 из zip-архива книги в EPUB (для выполнения в отдельном процессе)
+    :param zip_source: байты архива или путь к нему на диске
+    :return: (байты EPUB, имя файла EPUB)
+    """
+    with zipfile.ZipFile(BytesIO(zip_source) if isinstance(zip_source, bytes) else zip_source, 'r') as zip_file:
+        members = [info for info in zip_file.infolist() if info.filename.lower().endswith('.fb2')]
+        if not members:
+            raise ValueError("в архиве нет fb2")
+        fb2_data = zip_file.read(members[0])
+    root = load_fb2(fb2_data)
+    if root.tag != f"{FB}FictionBook":
+        raise ValueError(f"не fb2: корневой элемент {root.tag}")
+    return Fb2EpubConverter(root, book_id).convert(), get_epub_filename(members[0].filename)
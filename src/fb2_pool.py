@@ -0,0 +1,97 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from constants import FB2_PARSE_POOL_SIZE, DOWNLOAD_SPOOL_SIZE, DOWNLOAD_CHUNK_SIZE
+from utils import parse_fb2_zip
+from fb2_epub import convert_fb2_zip_to_epub
+
+
+class Fb2ParsePool:
+    """
+    Разбор fb2 (обложка и описание книги) и преобразование fb2 в EPUB в отдельных процессах,
+    чтобы обработка больших книг не останавливала цикл событий бота и не конкурировала с ним за GIL.
+    При pool_size=0 обработка выполняется в потоке текущего процесса.
+    """
+
+    def __init__(self, pool_size=FB2_PARSE_POOL_SIZE):
+        self.pool_size = pool_size
+        self._executor = None
+
+    def _get_executor(self):
+        """Создаёт пул процессов при первом обращении"""
+        if self._executor is None:
+            # spawn: процессы не наследуют потоки и соединения с БД бота. Модуль запуска (main.py) в них
+            # импортируется заново, поэтому обработчики бота он импортирует только внутри main()
+            self._executor = ProcessPoolExecutor(max_workers=self.pool_size,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    async def parse(self, book_file):
+        """
+        Разбирает книгу из временного файла с zip
+        :return: список (байты обложки, метаданные) по файлам архива
+        """
+        return await self._run_on_file(parse_fb2_zip, book_file)
+
+    async def convert_to_epub(self, book_file, book_id=None):
+        """
+        Преобразует fb2 из временного файла с zip в EPUB
+        :return: (байты EPUB, имя файла EPUB)
+        """
+        return await self._run_on_file(convert_fb2_zip_to_epub, book_file, book_id)
+
+    async def _run_on_file(self, func, book_file, *args):
+        """
+        Выполняет обработку книги из открытого файла. В процесс пула передаются байты только небольших книг;
+        большие передаются путём к файлу на диске, чтобы не держать книгу в памяти целиком (и ещё раз - при передаче)
+        """
+        source, tmp_path = await asyncio.to_thread(self._get_source, book_file)
+        try:
+            return await self._run(func, source, *args)
+        finally:
+            if tmp_path is not None:
+                os.remove(tmp_path)
+            book_file.seek(0)
+
+    @staticmethod
+    def _get_source(book_file):
+        """
+        :return: (байты книги или путь к файлу с ней, путь к временной копии для удаления или None)
+        """
+        size = book_file.seek(0, os.SEEK_END)
+        book_file.seek(0)
+        if size <= DOWNLOAD_SPOOL_SIZE:
+            return book_file.read(), None
+        path = getattr(book_file, 'name', None)
+        if isinstance(path, str) and os.path.isfile(path):
+            # Книга из кэша на диске
+            return path, None
+        # Временный файл без имени (или уже удалённый) - копируем частями в файл, доступный процессу пула
+        with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as tmp_file:
+            shutil.copyfileobj(book_file, tmp_file, DOWNLOAD_CHUNK_SIZE)
+        book_file.seek(0)
+        return tmp_file.name, tmp_file.name
+
+    async def _run(self, func, *args):
+        if self.pool_size <= 0:
+            return await asyncio.to_thread(func, *args)
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        except BrokenProcessPool:
+            # Процесс пула упал (например, из-за нехватки памяти) - пересоздаём пул для следующих книг
+            print("Пул разбора fb2 перезапущен после сбоя процесса")
+            self._executor = None
+            raise
+
+    def close(self):
+        """Останавливает процессы пула"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from urllib.parse import quote
+
+from aiohttp import web
+
+from constants import FILE_SERVER_HOST, FILE_SERVER_PORT, FILE_SERVER_PUBLIC_URL, FILE_SERVER_SECRET, FILE_LINK_TTL, \
+    DEFAULT_BOOK_FORMAT
+
+
+class FileServer:
+    """
+    Встроенный HTTP-сервер для больших книг: вместо повторной загрузки на внешний сервис
+    пользователь получает подписанную ссылку с ограниченным сроком действия.
+    Книга отдаётся из дискового кэша скачиваний (FileResponse использует sendfile - без копирования в память);
+    если её уже вытеснили, fb2 заново собирается из локального архива.
+    Сервер включается, только если задан публичный адрес FILE_SERVER_PUBLIC_URL.
+    """
+
+    def __init__(self, download_cache, local_archives, public_url=FILE_SERVER_PUBLIC_URL, host=FILE_SERVER_HOST,
+                 port=FILE_SERVER_PORT, secret=FILE_SERVER_SECRET, link_ttl=FILE_LINK_TTL):
+        self.download_cache = download_cache
+        self.local_archives = local_archives
+        self.public_url = public_url.rstrip('/')
+        self.host = host
+        self.port = port
+        # Без заданного ключа ссылки действуют только до перезапуска бота
+        self._secret = (secret or secrets.token_hex(32)).encode()
+        self.link_ttl = link_ttl
+        self._runner = None
+        self._stats = {'links': 0, 'served': 0, 'rebuilt': 0, 'expired': 0, 'rejected': 0, 'missing': 0}
+
+    @property
+    def enabled(self):
+        return bool(self.public_url) and self.download_cache.enabled
+
+    def _sign(self, book_id, book_format, expires, folder):
+        message = f"{book_id}/{book_format}/{expires}/{folder}".encode()
+        return hmac.new(self._secret, message, hashlib.sha256).hexdigest()[:32]
+
+    def make_link(self, book_id, book_format, file_name, folder=''):
+        """Подписанная ссылка на книгу из кэша скачиваний, действующая link_ttl секунд"""
+        expires = int(time.time()) + self.link_ttl
+        folder = folder or ''
+        signature = self._sign(book_id, book_format, expires, folder)
+        self._stats['links'] += 1
+        link = f"{self.public_url}/books/{book_id}/{book_format}/{expires}/{signature}/{quote(file_name)}"
+        return link + (f"?a={quote(folder)}" if folder else "")
+
+    async def _handle_book(self, request):
+        book_id = request.match_info['book_id']
+        book_format = request.match_info['book_format']
+        folder = request.query.get('a', '')
+        try:
+            expires = int(request.match_info['expires'])
+        except ValueError:
+            expires = 0
+
+        signature = self._sign(book_id, book_format, expires, folder)
+        if not hmac.compare_digest(signature, request.match_info['signature']):
+            self._stats['rejected'] += 1
+            raise web.HTTPForbidden(text="Неверная ссылка")
+        if expires < time.time():
+            self._stats['expired'] += 1
+            raise web.HTTPGone(text="Срок действия ссылки истёк, запросите книгу у бота заново")
+
+        file_path = await asyncio.to_thread(self.download_cache.get, book_id, book_format)
+        if file_path is None and book_format == DEFAULT_BOOK_FORMAT and folder:
+            file_path = await self._rebuild_from_archive(book_id, book_format, folder)
+        if file_path is None:
+            self._stats['missing'] += 1
+            raise web.HTTPGone(text="Книга больше недоступна по этой ссылке, запросите её у бота заново")
+
+        self._stats['served'] += 1
+        file_name = os.path.basename(file_path)
+        return web.FileResponse(file_path, headers={
+            'Content-Disposition': f"attachment; filename*=UTF-8''{quote(file_name)}",
+            'Cache-Control': 'private, no-store'
+        })
+
+    async def _rebuild_from_archive(self, book_id, book_format, folder):
+        """Собирает fb2 из локального архива заново и кладёт в кэш скачиваний"""
+        book_file, file_name = await self.local_archives.read_book(folder, book_id, f".{book_format}")
+        if book_file is None:
+            return None
+        try:
+            file_path = await asyncio.to_thread(self.download_cache.put, book_id, book_format, book_file, file_name)
+        finally:
+            book_file.close()
+        self._stats['rebuilt'] += 1
+        return file_path
+
+    @staticmethod
+    async def _handle_health(request):
+        return web.Response(text="ok")
+
+    async def start(self):
+        """Запускает сервер (вызывается при запуске бота)"""
+        if not self.enabled or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get('/books/{book_id}/{book_format}/{expires}/{signature}/{file_name}', self._handle_book)
+        app.router.add_get('/health', self._handle_health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        print(f"Файловый сервер запущен на {self.host}:{self.port}, ссылки: {self.public_url}")
+
+    async def stop(self):
+        """Останавливает сервер (вызывается при остановке бота)"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def get_stats(self):
+        """Возвращает статистику выданных и обслуженных ссылок"""
+        return dict(self._stats, enabled=self.enabled, link_ttl=self.link_ttl)
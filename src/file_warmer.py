@@ -0,0 +1,202 @@
+import asyncio
+import os
+from datetime import datetime
+from functools import partial
+
+from constants import DEFAULT_BOOK_FORMAT, COVER_FILE_FORMAT, SETTING_OPTIONS, SETTING_BOOK_FORMAT, WARMUP_CHAT_ID, WARMUP_TOP_N, \
+    WARMUP_HOURS, WARMUP_BUDGET, WARMUP_RATE, WARMUP_MAX_USER_LOAD, WARMUP_PAUSE, DELIVERY_DIRECT_MAX_SIZE
+from utils import send_book_metadata
+
+# Форматы, в которых пользователи скачивают книги
+WARMUP_FORMATS = [book_format for book_format, _ in SETTING_OPTIONS[SETTING_BOOK_FORMAT]]
+# Владелец скачиваний прогрева в общей очереди (у пользователей - пара (чат, пользователь))
+WARMUP_OWNER = ('warmup', 0)
+
+
+def parse_quiet_hours(hours):
+    """Часы "2-6" -> (2, 6); пустая строка - прогрев в любое время"""
+    if not hours:
+        return None
+    start, _, end = hours.partition('-')
+    return int(start) % 24, int(end or start) % 24
+
+
+def get_download_format(public_filename):
+    """Формат скачанной книги по имени отправленного файла: Author_Title.fb2.zip -> fb2"""
+    name = public_filename.lower().removesuffix('.zip')
+    book_format = os.path.splitext(name)[1].lstrip('.')
+    return book_format if book_format in WARMUP_FORMATS else None
+
+
+class FileIdWarmer:
+    """
+    Прогрев кэша file_id: в тихие часы самые скачиваемые книги каждого формата заранее
+    загружаются в служебный чат, чтобы запросы пользователей сразу пересылались по file_id без скачивания с сайта.
+    Объём скачивания за один прогрев ограничен, скорость - тоже; при появлении пользовательских скачиваний
+    прогрев приостанавливается. Книги скачиваются через общую очередь с её ограничениями на сайт.
+    """
+
+    def __init__(self, db_logs, books_search, db_cache, parser, scheduler, chat_id=WARMUP_CHAT_ID, top_n=WARMUP_TOP_N,
+                 quiet_hours=WARMUP_HOURS, budget=WARMUP_BUDGET, rate=WARMUP_RATE, max_user_load=WARMUP_MAX_USER_LOAD,
+                 pause=WARMUP_PAUSE):
+        self.db_logs = db_logs
+        self.books_search = books_search
+        self.db_cache = db_cache
+        self.parser = parser
+        self.scheduler = scheduler
+        self.chat_id = chat_id
+        self.top_n = top_n
+        self.quiet_hours = parse_quiet_hours(quiet_hours)
+        self.budget = budget
+        self.rate = rate
+        self.max_user_load = max_user_load
+        self.pause = pause
+        self._running = False
+        self._stats = {'runs': 0, 'warmed': 0, 'already_cached': 0, 'skipped': 0, 'failed': 0, 'bytes': 0,
+                       'pauses': 0, 'last_run': None, 'last_result': None}
+
+    @property
+    def enabled(self):
+        return bool(self.chat_id) and self.top_n > 0
+
+    def is_quiet_time(self, now=None):
+        """Сейчас тихие часы (конец диапазона не включается, диапазон может переходить через полночь)"""
+        if self.quiet_hours is None:
+            return True
+        hour = (now or datetime.now()).hour
+        start, end = self.quiet_hours
+        return start <= hour < end if start <= end else hour >= start or hour < end
+
+    def get_user_load(self):
+        """Пользовательские скачивания: выполняются и ждут в очереди"""
+        stats = self.scheduler.get_stats()
+        return stats['active'] + stats['queued']
+
+    async def _wait_for_quiet(self):
+        """
+        Ждёт, пока пользовательская нагрузка спадёт
+        :return: False, если тихие часы закончились и прогрев нужно прекратить
+        """
+        paused = False
+        while self.get_user_load() > self.max_user_load:
+            if not paused:
+                paused = True
+                self._stats['pauses'] += 1
+            await asyncio.sleep(self.pause)
+            if not self.is_quiet_time():
+                return False
+        return self.is_quiet_time()
+
+    async def get_candidates(self):
+        """
+        Самые скачиваемые книги по форматам из журнала действий
+        :return: список (id книги, расширение файла, формат) - сначала самые популярные
+        """
+        # Журнал группирует по имени файла, поэтому берём с запасом на все форматы
+        top_downloads = await asyncio.to_thread(self.db_logs.get_top_downloads,
+                                                self.top_n * len(WARMUP_FORMATS) * 2)
+        per_format = {book_format: 0 for book_format in WARMUP_FORMATS}
+        candidates, seen = [], set()
+        for detail, _ in top_downloads:
+            book_file, _, public_filename = (detail or '').partition(':')
+            book_format = get_download_format(public_filename)
+            if book_format is None or per_format[book_format] >= self.top_n:
+                continue
+            book_id, file_ext = os.path.splitext(book_file)
+            if (book_id, book_format) in seen:
+                continue
+            seen.add((book_id, book_format))
+            per_format[book_format] += 1
+            candidates.append((book_id, file_ext, book_format))
+        return candidates
+
+    async def run(self, bot, fetch_book, get_download_host):
+        """
+        Один проход прогрева
+        :param fetch_book: функция получения книги (как handlers.fetch_book)
+        :param get_download_host: источник книги для очереди скачивания (как handlers.get_download_host)
+        """
+        if not self.enabled or self._running or not self.is_quiet_time():
+            return
+        self._running = True
+        self._stats['runs'] += 1
+        self._stats['last_run'] = datetime.now().strftime('%Y-%m-%d %H:%M')
+        downloaded, warmed = 0, 0
+        try:
+            for book_id, file_ext, book_format in await self.get_candidates():
+                if self.db_cache.get_telegram_file(book_id, book_format):
+                    self._stats['already_cached'] += 1
+                    continue
+                if downloaded >= self.budget:
+                    self._stats['last_result'] = 'исчерпан объём'
+                    return
+                if not await self._wait_for_quiet():
+                    self._stats['last_result'] = 'закончились тихие часы'
+                    return
+
+                card = await self.books_search.get_book_card(book_id)
+                if card is None or (card.BookSize or 0) > DELIVERY_DIRECT_MAX_SIZE:
+                    # Большие книги отправляются ссылкой - file_id для них не нужен
+                    self._stats['skipped'] += 1
+                    continue
+
+                file_ext = file_ext or card.Ext
+                ticket = self.scheduler.enqueue(WARMUP_OWNER, get_download_host(book_format, file_ext, card.Folder))
+                try:
+                    await ticket.wait()
+                    size = await self._warm_book(bot, fetch_book, book_id, book_format, file_ext, card.Folder)
+                finally:
+                    self.scheduler.release(ticket)
+                if size:
+                    downloaded += size
+                    warmed += 1
+                    # Ограничение скорости: пауза пропорционально скачанному
+                    if self.rate > 0:
+                        await asyncio.sleep(size / self.rate)
+            self._stats['last_result'] = 'завершён'
+        finally:
+            self._running = False
+            print(f"Прогрев кэша файлов: загружено {warmed} книг, скачано {downloaded} байт")
+
+    async def _warm_book(self, bot, fetch_book, book_id, book_format, file_ext, folder):
+        """
+        Скачивает книгу и загружает её в служебный чат, сохраняя file_id
+        :return: размер скачанного файла или 0
+        """
+        book_data = None
+        try:
+            book_data, original_filename = await fetch_book(book_id, book_format, book_id, file_ext, folder)
+            if book_data is None:
+                self._stats['skipped'] += 1
+                return 0
+            size = book_data.seek(0, os.SEEK_END)
+            book_data.seek(0)
+            public_filename = original_filename or f"{book_id}.{book_format}"
+
+            if book_format == DEFAULT_BOOK_FORMAT and not self.db_cache.get_telegram_file(book_id, COVER_FILE_FORMAT):
+                # Обложка и описание - как при обычной отправке fb2, но в служебный чат
+                await send_book_metadata(self.parser, self.db_cache, book_data, partial(bot.send_photo, self.chat_id),
+                                         partial(bot.send_message, self.chat_id), book_id)
+                book_data.seek(0)
+
+            sent_message = await bot.send_document(
+                chat_id=self.chat_id,
+                document=book_data,
+                filename=public_filename,
+                disable_notification=True
+            )
+            self.db_cache.save_telegram_file(book_id, book_format, sent_message.document.file_id, public_filename)
+            self._stats['warmed'] += 1
+            self._stats['bytes'] += size
+            return size
+        except Exception as e:
+            print(f"Ошибка прогрева книги {book_id}.{book_format}: {e}")
+            self._stats['failed'] += 1
+            return 0
+        finally:
+            if book_data is not None:
+                book_data.close()
+
+    def get_stats(self):
+        """Возвращает статистику прогрева"""
+        return dict(self._stats, enabled=self.enabled, running=self._running, budget=self.budget)
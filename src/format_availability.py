@@ -0,0 +1,57 @@
+import time
+from collections import OrderedDict
+
+from constants import FORMAT_CACHE_SIZE, FORMAT_AVAILABLE_TTL, FORMAT_MISSING_TTL
+
+
+class FormatAvailabilityCache:
+    """
+    Есть ли книга в формате на сайте: ответ сайта запоминается на время,
+    чтобы следующий пользователь не ждал заведомо неудачного запроса.
+    Отсутствие формата хранится меньше, чем наличие: сайт может сделать книгу в этом формате позже.
+    Ограничен по размеру: вытесняются давно не запрошенные записи.
+    """
+
+    def __init__(self, max_size=FORMAT_CACHE_SIZE, available_ttl=FORMAT_AVAILABLE_TTL, missing_ttl=FORMAT_MISSING_TTL):
+        self.max_size = max_size
+        self.available_ttl = available_ttl
+        self.missing_ttl = missing_ttl
+        self._entries = OrderedDict()  # ключ -> (время истечения, есть ли формат)
+        self._stats = {'available_hits': 0, 'missing_hits': 0, 'misses': 0, 'probes': 0}
+
+    def get(self, key):
+        """
+        :param key: путь книги на сайте, например /b/123/epub
+        :return: True - формат есть, False - формата нет, None - неизвестно
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self._stats['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._stats['available_hits' if entry[1] else 'missing_hits'] += 1
+        return entry[1]
+
+    def is_known(self, key):
+        """Есть ли действующая запись (без учёта в статистике обращений)"""
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] >= time.monotonic()
+
+    def set(self, key, available, probe=False):
+        """Запоминает ответ сайта; probe - ответ получен предварительной проверкой (HEAD)"""
+        if self.max_size <= 0:
+            return
+        ttl = self.available_ttl if available else self.missing_ttl
+        self._entries[key] = (time.monotonic() + ttl, available)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        if probe:
+            self._stats['probes'] += 1
+
+    def get_stats(self):
+        """Возвращает статистику кэша"""
+        missing = sum(1 for _, available in self._entries.values() if not available)
+        return dict(self._stats, size=len(self._entries), max_size=self.max_size, missing=missing)
@@ -1,31 +1,71 @@
+import asyncio
 from datetime import datetime
+import hashlib
+from html import escape
 import os
-import zipfile
-from io import BytesIO
+import re
+import time
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.error import TimedOut, BadRequest, Forbidden
 from telegram.ext import CallbackContext #, ConversationHandler
 
-from database import DatabaseBooks, DatabaseSettings
+from database import DatabaseBooks, DatabaseSettings, DatabaseCache, DatabaseLogs
 from constants import FLIBUSTA_BASE_URL, DEFAULT_BOOK_FORMAT, \
     SETTING_MAX_BOOKS, SETTING_LANG_SEARCH, SETTING_SORT_ORDER, SETTING_SIZE_LIMIT, \
     SETTING_BOOK_FORMAT, SETTING_SEARCH_TYPE, SETTING_OPTIONS, SETTING_TITLES, SETTING_RATING_FILTER, BOOK_RATINGS, \
-    BOT_NEWS_FILE_PATH
+    BOT_NEWS_FILE_PATH, BOOK_CARDS_PATH, CONVERTED_CACHE_PATH, CONVERTED_CACHE_SIZE, SERIES_DOWNLOAD_MAX_BOOKS, \
+    SERIES_DOWNLOAD_CONCURRENCY, SERIES_PROGRESS_INTERVAL, FORMAT_PROBE_CONCURRENCY, COVER_FILE_FORMAT
 from health import log_stats
-from utils import format_size, extract_cover_from_fb2, extract_metadata_from_fb2, format_metadata_message, \
-    get_platform_recommendations, download_book_with_filename, upload_to_tmpfiles, is_message_for_bot, \
+from utils import format_size, send_book_metadata, \
+    get_platform_recommendations, upload_to_tmpfiles, is_message_for_bot, \
     extract_clean_query, get_latest_news
 from logger import logger
+from search_pool import BooksSearchPool
+from local_archives import LocalArchives
+from download_scheduler import DownloadScheduler
+from mirrors import MIRRORS, MirrorsUnavailableError
+from fb2_pool import Fb2ParsePool
+from delivery_planner import DeliveryPlanner, ROUTE_DIRECT, ROUTE_LINK, ROUTE_ARCHIVE_ONLY
+from download_cache import DownloadCache
+from file_server import FileServer
+from epub_converter import EpubConverter
+from series_zip import SeriesZip
+from file_warmer import FileIdWarmer
 
 
 DB_BOOKS = DatabaseBooks()
 DB_SETTINGS = DatabaseSettings()
-
-BOOKS = 'BOOKS'
-PAGES_OF_BOOKS = 'PAGES_OF_BOOKS'
+DB_CACHE = DatabaseCache()
+# Поиск книг выполняется вне цикла событий, в пуле потоков
+BOOKS_SEARCH = BooksSearchPool()
+# Книги fb2 по возможности отдаются из локальных архивов библиотеки
+LOCAL_ARCHIVES = LocalArchives()
+# Обложка и описание fb2 извлекаются в отдельных процессах
+FB2_PARSER = Fb2ParsePool()
+# Выбор способа доставки книги по размеру
+DELIVERY_PLANNER = DeliveryPlanner()
+# Большие книги сохраняются в дисковый кэш и отдаются собственным файловым сервером по ссылке
+DOWNLOAD_CACHE = DownloadCache()
+FILE_SERVER = FileServer(DOWNLOAD_CACHE, LOCAL_ARCHIVES)
+# EPUB из fb2 по возможности делается на стороне бота, а не скачивается с сайта
+EPUB_CONVERTER = EpubConverter(FB2_PARSER, DownloadCache(CONVERTED_CACHE_PATH, CONVERTED_CACHE_SIZE), DOWNLOAD_CACHE,
+                               LOCAL_ARCHIVES)
+# Очередь скачивания и отправки книг: общие лимиты и очерёдность по кругу между пользователями
+DOWNLOAD_SCHEDULER = DownloadScheduler()
+# Источник в очереди скачивания для книг из локальных архивов
+LOCAL_ARCHIVES_HOST = 'local'
+# В тихие часы популярные книги заранее загружаются в Telegram, чтобы отдавать их по file_id
+FILE_WARMER = FileIdWarmer(DatabaseLogs(), BOOKS_SEARCH, DB_CACHE, FB2_PARSER, DOWNLOAD_SCHEDULER)
+
+# В сессии храним не найденные книги, а скомпилированный запрос и ключи границ уже открытых страниц
+BOOKS_QUERY = 'BOOKS_QUERY'
+BOOKS_PAGE_SIZE = 'BOOKS_PAGE_SIZE'
+BOOKS_PAGE_KEYS = 'BOOKS_PAGE_KEYS'
 FOUND_BOOKS_COUNT = 'FOUND_BOOKS_COUNT'
+FOUND_BOOKS_CAPPED = 'FOUND_BOOKS_CAPPED'
+BOOKS_CARDS_MODE = 'BOOKS_CARDS_MODE'  # Кнопки книг на странице открывают карточки, а не скачивание
 USER_PARAMS = 'USER_PARAMS'
 SERIES = 'SERIES'
 PAGES_OF_SERIES = 'PAGES_OF_SERIES'
@@ -37,6 +77,18 @@ CONTACT_INFO = {'email': os.getenv("FEEDBACK_EMAIL", "не указан"), 'pika
 SEARCH_CONTEXT = 'SEARCH_CONTEXT'
 SEARCH_TYPE_BOOKS = 'books'
 SEARCH_TYPE_SERIES = 'series'
+# Максимальная длина подписи к фото в Telegram
+BOOK_CARD_CAPTION_LIMIT = 1024
+
+# Получения книг в процессе: (book_id, формат) -> future с результатом "книга получена".
+# Future завершается после первой отправки, поэтому остальные чаты получают книгу по уже сохранённому file_id
+BOOK_FETCHES_IN_FLIGHT = {}
+# Отправки в процессе по пользователям: повторные нажатия той же кнопки игнорируются
+USER_SENDS_IN_FLIGHT = set()
+# Предварительные проверки наличия форматов на сайте: выполняющиеся пути и задачи (ссылки держим до завершения)
+FORMAT_PROBES_IN_FLIGHT = set()
+FORMAT_PROBE_TASKS = set()
+FORMAT_PROBE_LIMIT = asyncio.Semaphore(max(1, FORMAT_PROBE_CONCURRENCY))
 
 # ===== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ =====
 
@@ -45,12 +97,14 @@ def create_back_button() -> list:
     return [[InlineKeyboardButton("⬅ Назад в настройки", callback_data="back_to_settings")]]
 
 
-def form_header_books(page, max_books, found_count, search_type='книг', series_name=None):
+def form_header_books(page, max_books, found_count, search_type='книг', series_name=None, count_capped=False):
     # return f"Показываю с {max_books * page + 1} по {min(max_books * (page + 1), found_count)} из {found_count} найденных {search_type}:"
     start = max_books * page + 1
-    end = min(max_books * (page + 1), found_count)
+    # Подсчёт остановлен на пределе - точное количество неизвестно, а страницы заполнены полностью
+    end = max_books * (page + 1) if count_capped else min(max_books * (page + 1), found_count)
+    found_count_text = f"{found_count}+" if count_capped else f"{found_count}"
 
-    header = f"Показываю с {start} по {end} из {found_count} найденных {search_type}"
+    header = f"Показываю с {start} по {end} из {found_count_text} найденных {search_type}"
 
     if series_name:
         header += f" в серии '{series_name}'"
@@ -58,47 +112,98 @@ def form_header_books(page, max_books, found_count, search_type='книг', seri
     return header
 
 
-def create_books_keyboard(page, pages_of_books, search_context=SEARCH_TYPE_BOOKS):
+def create_books_keyboard(page, books_in_page, pages_count, search_context=SEARCH_TYPE_BOOKS, count_capped=False,
+                          cards_mode=False):
     # reply_markup = None
     keyboard = []
 
-    if pages_of_books:
-        books_in_page = pages_of_books[page]
+    if books_in_page:
+        # keyboard = []
+        for book in books_in_page:
+            # ДОБАВЛЯЕМ ЭМОДЗИ РЕЙТИНГА
+            rating_emoji = get_rating_emoji(book.LibRate)
+            text = f"{rating_emoji} {book.Title} ({book.LastName} {book.FirstName}) {format_size(book.BookSize)}/{book.Genre}"
+            if book.SearchYear != 0:
+                text += f"/{str(book.SearchYear)}"
+            # Кнопка книги занимает всю строку, чтобы название не обрезалось;
+            # карточки книг открываются теми же кнопками в режиме описаний
+            if cards_mode:
+                callback_data = f"book_card:{book.FileName}"
+            else:
+                callback_data = f"send_file:{book.Folder}:{book.FileName}:{book.Ext}"
+            keyboard.append([InlineKeyboardButton(text, callback_data=callback_data)])
+
+        # Добавляем кнопки для навигации
+        navigation_buttons = []
+        if page > 0:
+            navigation_buttons.append(InlineKeyboardButton("⬆ В начало", callback_data=f"page_0"))
+            navigation_buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"page_{page - 1}"))
+        if page < pages_count - 1:
+            navigation_buttons.append(InlineKeyboardButton("Вперёд ➡️", callback_data=f"page_{page + 1}"))
+            # Если количество ограничено пределом подсчёта, конец выдачи неизвестен
+            if not count_capped:
+                navigation_buttons.append(InlineKeyboardButton("В конец ⬇️️️", callback_data=f"page_{pages_count - 1}"))
+        if navigation_buttons:
+            keyboard.append(navigation_buttons)
 
-        if books_in_page:
-            # keyboard = []
-            for book in books_in_page:
-                # ДОБАВЛЯЕМ ЭМОДЗИ РЕЙТИНГА
-                rating_emoji = get_rating_emoji(book.LibRate)
-                text = f"{rating_emoji} {book.Title} ({book.LastName} {book.FirstName}) {format_size(book.BookSize)}/{book.Genre}"
-                if book.SearchYear != 0:
-                    text += f"/{str(book.SearchYear)}"
-                keyboard.append([InlineKeyboardButton(
-                    text,
-                    callback_data=f"send_file:{book.Folder}:{book.FileName}:{book.Ext}"
-                )])
-
-            # Добавляем кнопки для навигации
-            navigation_buttons = []
-            if page > 0:
-                navigation_buttons.append(InlineKeyboardButton("⬆ В начало", callback_data=f"page_0"))
-                navigation_buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"page_{page - 1}"))
-            if page < len(pages_of_books) - 1:
-                navigation_buttons.append(InlineKeyboardButton("Вперёд ➡️", callback_data=f"page_{page + 1}"))
-                navigation_buttons.append(InlineKeyboardButton("В конец ⬇️️️", callback_data=f"page_{len(pages_of_books) - 1}"))
-            if navigation_buttons:
-                keyboard.append(navigation_buttons)
+        keyboard.append([InlineKeyboardButton(
+            "📥 Вернуться к скачиванию" if cards_mode else "ℹ️ Описания книг", callback_data=f"cards_mode_{page}"
+        )])
 
-            # Добавляем кнопку "Назад к сериям" только при поиске по сериям
-            if search_context == SEARCH_TYPE_SERIES:
-                keyboard.append([InlineKeyboardButton("⤴️ Назад к сериям", callback_data="back_to_series")])
+        # Добавляем кнопку "Назад к сериям" только при поиске по сериям
+        if search_context == SEARCH_TYPE_SERIES:
+            keyboard.append([InlineKeyboardButton("📦 Скачать серию одним архивом", callback_data="download_series")])
+            keyboard.append([InlineKeyboardButton("⤴️ Назад к сериям", callback_data="back_to_series")])
 
-            # reply_markup = InlineKeyboardMarkup(keyboard)
+        # reply_markup = InlineKeyboardMarkup(keyboard)
 
     # return reply_markup
     return keyboard
 
 
+def get_pages_count(found_count, page_size):
+    """Количество страниц выдачи"""
+    return max(1, (found_count + page_size - 1) // page_size)
+
+
+def save_books_page_keys(search_data, page, books_in_page):
+    """Запоминает ключи первой и последней книги страницы для перехода на соседние страницы"""
+    if books_in_page:
+        search_data[BOOKS_PAGE_KEYS][page] = (DatabaseBooks.get_book_key(books_in_page[0]),
+                                              DatabaseBooks.get_book_key(books_in_page[-1]))
+
+
+async def load_books_page(search_data, page):
+    """
+    Читает страницу книг по сохранённому в сессии запросу
+    :param search_data: user_data пользователя или контекст поиска группы
+    :return: список книг страницы или None, если до страницы нельзя дойти от известных ключей
+    """
+    books_query = search_data[BOOKS_QUERY]
+    page_size = search_data[BOOKS_PAGE_SIZE]
+    page_keys = search_data[BOOKS_PAGE_KEYS]
+    pages_count = get_pages_count(search_data[FOUND_BOOKS_COUNT], page_size)
+
+    if page < 0 or page >= pages_count:
+        return None
+
+    if page == 0:
+        books_in_page = await BOOKS_SEARCH.fetch_books_page(books_query, page_size)
+    elif page == pages_count - 1 and not search_data.get(FOUND_BOOKS_CAPPED):
+        # Последняя страница может быть неполной - читаем с конца ровно её остаток
+        last_page_size = search_data[FOUND_BOOKS_COUNT] - page * page_size
+        books_in_page = await BOOKS_SEARCH.fetch_books_page(books_query, last_page_size, from_end=True)
+    elif page - 1 in page_keys:
+        books_in_page = await BOOKS_SEARCH.fetch_books_page(books_query, page_size, after=page_keys[page - 1][1])
+    elif page + 1 in page_keys:
+        books_in_page = await BOOKS_SEARCH.fetch_books_page(books_query, page_size, before=page_keys[page + 1][0])
+    else:
+        return None
+
+    save_books_page_keys(search_data, page, books_in_page)
+    return books_in_page
+
+
 def create_series_keyboard(page, pages_of_series):
     # reply_markup = None
     keyboard = []
@@ -140,32 +245,99 @@ async def edit_or_reply_message(query, text, reply_markup=None):
         await query.message.reply_text(text, reply_markup=reply_markup)
 
 
-async def process_book_download(query, book_id, book_format, file_name, file_ext, for_user=None):
-    """Обрабатывает скачивание и отправку книги"""
-    processing_msg = await query.message.reply_text(
-        "⏰ <i>Ожидайте, отправляю книгу"+(f" для {for_user.first_name}" if for_user else "")+"...</i>",
-        parse_mode=ParseMode.HTML,
-        disable_notification=True
-    )
+async def process_book_download(query, book_id, book_format, file_name, file_ext, for_user=None, folder=None,
+                                processing_msg=None, book_size=None):
+    """
+    Обрабатывает скачивание и отправку книги
+    :param processing_msg: уже показанное сообщение "Ожидайте" (например, с позицией в очереди)
+    :param book_size: размер книги по каталогу (для выбора способа доставки до скачивания)
+    """
+    processing_text = "⏰ <i>Ожидайте, отправляю книгу"+(f" для {for_user.first_name}" if for_user else "")+"...</i>"
+    if processing_msg:
+        await processing_msg.edit_text(processing_text, parse_mode=ParseMode.HTML)
+    else:
+        processing_msg = await query.message.reply_text(
+            processing_text,
+            parse_mode=ParseMode.HTML,
+            disable_notification=True
+        )
 
+    book_data, original_filename = None, None
+    url = f"{FLIBUSTA_BASE_URL}/b/{book_id}/{book_format}"
+    fetch_key = (book_id, book_format)
+    fetch_future = None
+    route, route_started_at = None, None
     try:
-        url = f"{FLIBUSTA_BASE_URL}/b/{book_id}/{book_format}"
-        book_data, original_filename = await download_book_with_filename(url)
+        # Книгу уже отправляли - пересылаем по file_id без скачивания и загрузки
+        public_filename = await send_cached_book(query, book_id, book_format)
+        if public_filename:
+            await processing_msg.delete()
+            return public_filename
+
+        # Слишком большую книгу не скачиваем: ни файлом, ни ссылкой её не отправить
+        if DELIVERY_PLANNER.plan_before_download(book_size) == ROUTE_ARCHIVE_ONLY:
+            await processing_msg.edit_text(
+                f"📦 Книга слишком большая для отправки ({format_size(book_size)}). "
+                f"Она есть в архиве библиотеки" + (f" {folder}" if folder else "") + f", скачайте её с сайта: {url}"
+            )
+            DELIVERY_PLANNER.record(ROUTE_ARCHIVE_ONLY, 0)
+            logger.log_user_action(query.from_user, "send file archive only", url)
+            return None
+
+        in_flight = BOOK_FETCHES_IN_FLIGHT.get(fetch_key)
+        if in_flight is not None:
+            # Ту же книгу уже получают для другого запроса - ждём его и пересылаем по file_id,
+            # а большую книгу (её отправили ссылкой) - ссылкой на ту же копию в кэше скачиваний
+            fetched = await asyncio.shield(in_flight)
+            public_filename = await send_cached_book(query, book_id, book_format) or \
+                await send_cached_book_link(query, book_id, book_format, folder)
+            if public_filename:
+                await processing_msg.delete()
+                return public_filename
+            if fetched:
+                # Книга была получена, но в Telegram не ушла (например, по таймауту) - берём её из кэша
+                # скачиваний, если первый запрос её туда положил, иначе получаем сами
+                book_data, original_filename = await fetch_book_through_cache(book_id, book_format, file_name,
+                                                                              file_ext, folder)
+        else:
+            fetch_future = asyncio.get_running_loop().create_future()
+            BOOK_FETCHES_IN_FLIGHT[fetch_key] = fetch_future
+            book_data, original_filename = await fetch_book(book_id, book_format, file_name, file_ext, folder)
         public_filename = original_filename if original_filename else f"{book_id}.{book_format}"
 
-        if book_data:
+        if book_data is not None:
             if book_format == DEFAULT_BOOK_FORMAT:
-                await extract_and_send_metadata(book_data, query)
-
-            await query.message.reply_document(
+                await send_book_metadata(FB2_PARSER, DB_CACHE, book_data, query.message.reply_photo,
+                                         query.message.reply_text, book_id)
+
+            route = DELIVERY_PLANNER.plan_after_download(book_data.seek(0, os.SEEK_END))
+            book_data.seek(0)
+            route_started_at = time.monotonic()
+            if route == ROUTE_LINK:
+                # Большой файл сразу отправляем ссылкой, не дожидаясь таймаута загрузки в Telegram
+                delivered = await send_book_link(processing_msg, book_data, book_id, book_format, public_filename,
+                                                 query, folder)
+                DELIVERY_PLANNER.record(route, time.monotonic() - route_started_at, delivered)
+                return public_filename if delivered else None
+
+            sent_message = await query.message.reply_document(
                 document=book_data,
                 filename=public_filename,
                 disable_notification=True
             )
+            DELIVERY_PLANNER.record(route, time.monotonic() - route_started_at)
+            DB_CACHE.save_telegram_file(book_id, book_format, sent_message.document.file_id, public_filename)
         else:
+            reply_markup = None
+            if book_format != DEFAULT_BOOK_FORMAT and file_ext == f".{DEFAULT_BOOK_FORMAT}":
+                # Книги нет в выбранном формате - предлагаем исходный fb2
+                reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(
+                    "📥 Скачать в FB2", callback_data=f"send_fb2:{folder or ''}:{file_name}:{file_ext}"
+                )]])
             await query.message.reply_text(
                 "😞 Не удалось скачать книгу в этом формате" + (f" для {for_user.first_name}" if for_user else "") +
                 f" ({url})",
+                reply_markup=reply_markup,
                 disable_notification=True
             )
 
@@ -173,7 +345,21 @@ async def process_book_download(query, book_id, book_format, file_name, file_ext
         return public_filename
 
     except TimedOut:
-        await handle_timeout_error(processing_msg, book_data, file_name, file_ext, query)
+        if route == ROUTE_DIRECT:
+            # Файл не успел загрузиться в Telegram - отмечаем неудачу и отправляем ссылкой
+            DELIVERY_PLANNER.record(route, time.monotonic() - route_started_at, False)
+            route_started_at = time.monotonic()
+            delivered = await send_book_link(processing_msg, book_data, book_id, book_format, public_filename,
+                                             query, folder)
+            DELIVERY_PLANNER.record(ROUTE_LINK, time.monotonic() - route_started_at, delivered)
+        elif book_data is not None:
+            await send_book_link(processing_msg, book_data, book_id, book_format, public_filename, query, folder)
+        else:
+            await processing_msg.edit_text("❌ Не удалось отправить книгу. Попробуйте позже.")
+    except MirrorsUnavailableError as e:
+        print(f"Сайт библиотеки недоступен: {e}")
+        await processing_msg.edit_text("❌ Сайт библиотеки сейчас недоступен, попробуйте позже")
+        logger.log_user_action(query.from_user, "error sending book mirrors", url)
     except Exception as e:
         #await handle_download_error(processing_msg, url, e, query)
         """Обрабатывает ошибку загрузки"""
@@ -182,41 +368,199 @@ async def process_book_download(query, book_id, book_format, file_name, file_ext
             f"❌ Произошла ошибка при подготовке книги {url}. Возможно она доступна только в локальной базе"
         )
         logger.log_user_action(query.from_user.id, "error sending book direct", url)
+    finally:
+        # Сообщаем ожидающим запросам, получена ли книга (и при ошибке, чтобы они не зависли)
+        if fetch_future is not None:
+            BOOK_FETCHES_IN_FLIGHT.pop(fetch_key, None)
+            fetch_future.set_result(book_data is not None)
+        if book_data is not None:
+            book_data.close()
 
     return None
 
 
-async def extract_and_send_metadata(book_data, query):
-    """Извлекает и отправляет метаданные книги"""
-    with zipfile.ZipFile(BytesIO(book_data), 'r') as zip_file:
-        for file_info in zip_file.infolist():
-            file_data = zip_file.read(file_info.filename)
-            file_io = BytesIO(file_data)
-            file_io.seek(0)
+def get_book_path(book_id, book_format):
+    """Путь книги в формате на сайте"""
+    return f"/b/{book_id}/{book_format}"
 
-            cover_bytes = extract_cover_from_fb2(file_io)
-            metadata = extract_metadata_from_fb2(file_io)
-            caption = format_metadata_message(metadata)
 
-            if cover_bytes:
+def schedule_format_probes(books, book_format):
+    """
+    Проверяет в фоне запросами HEAD, есть ли на сайте книги показанной страницы в формате пользователя,
+    чтобы при нажатии на книгу без этого формата сразу предложить fb2
+    """
+    if FORMAT_PROBE_CONCURRENCY <= 0 or not books or not book_format or book_format == DEFAULT_BOOK_FORMAT:
+        return
+    for book in books:
+        # EPUB из fb2 делается на месте - сайт не нужен
+        if EPUB_CONVERTER.can_convert(book_format, book.Ext) and LOCAL_ARCHIVES.has_archive(book.Folder):
+            continue
+        path = get_book_path(book.FileName, book_format)
+        if path in FORMAT_PROBES_IN_FLIGHT or MIRRORS.availability.is_known(path):
+            continue
+        FORMAT_PROBES_IN_FLIGHT.add(path)
+        task = asyncio.create_task(probe_book_format(path))
+        FORMAT_PROBE_TASKS.add(task)
+        task.add_done_callback(FORMAT_PROBE_TASKS.discard)
+
+
+async def probe_book_format(path):
+    try:
+        async with FORMAT_PROBE_LIMIT:
+            await MIRRORS.check_book(path)
+    finally:
+        FORMAT_PROBES_IN_FLIGHT.discard(path)
+
+
+def get_download_host(book_format, file_ext, folder=None):
+    """Источник, из которого будет получена книга (для ограничения одновременных скачиваний с одного сайта)"""
+    from_fb2 = book_format == DEFAULT_BOOK_FORMAT and file_ext == f".{DEFAULT_BOOK_FORMAT}" or \
+        EPUB_CONVERTER.can_convert(book_format, file_ext)
+    if from_fb2 and LOCAL_ARCHIVES.has_archive(folder):
+        return LOCAL_ARCHIVES_HOST
+    return MIRRORS.get_preferred_host()
+
+
+async def fetch_book(book_id, book_format, file_name, file_ext, folder=None):
+    """
+    Получает файл книги: fb2 из локального архива, EPUB - преобразованием из fb2,
+    остальное (и то, чего нет локально) - с сайта
+    :return: (файл с книгой, оригинальное имя файла)
+    """
+    book_data, original_filename = None, None
+    if book_format == DEFAULT_BOOK_FORMAT and file_ext == f".{DEFAULT_BOOK_FORMAT}":
+        book_data, original_filename = await LOCAL_ARCHIVES.read_book(folder, file_name, file_ext)
+    elif EPUB_CONVERTER.can_convert(book_format, file_ext):
+        book_data, original_filename = await EPUB_CONVERTER.get_epub(book_id, file_name, file_ext, folder)
+    if book_data is None:
+        started_at = time.monotonic()
+        book_data, original_filename = await MIRRORS.download_book(get_book_path(book_id, book_format))
+        if book_data is not None and EPUB_CONVERTER.can_convert(book_format, file_ext):
+            EPUB_CONVERTER.record_upstream(time.monotonic() - started_at)
+    return book_data, original_filename
+
+
+async def fetch_book_through_cache(book_id, book_format, file_name, file_ext, folder=None):
+    """
+    Получает книгу через кэш скачиваний: книги с сайта после скачивания сохраняются в кэш
+    (книги из локальных архивов не кэшируются - они и так читаются быстро)
+    :return: (файл с книгой, оригинальное имя файла)
+    """
+    cached_path = await asyncio.to_thread(DOWNLOAD_CACHE.get, book_id, book_format)
+    if cached_path is not None:
+        return open(cached_path, 'rb'), os.path.basename(cached_path)
+
+    book_data, original_filename = await fetch_book(book_id, book_format, file_name, file_ext, folder)
+    if book_data is not None and get_download_host(book_format, file_ext, folder) != LOCAL_ARCHIVES_HOST:
+        await asyncio.to_thread(DOWNLOAD_CACHE.put, book_id, book_format, book_data,
+                                original_filename or f"{book_id}.{book_format}")
+    return book_data, original_filename
+
+
+async def warm_popular_books(context: CallbackContext):
+    """Периодическая задача: прогрев кэша file_id самыми скачиваемыми книгами"""
+    await FILE_WARMER.run(context.bot, fetch_book, get_download_host)
+
+
+async def send_cached_book(query, book_id, book_format):
+    """
+    Отправляет книгу (и для fb2 - обложку с описанием) по сохранённым file_id
+    :return: имя файла книги или None, если книги нет в кэше или Telegram отклонил file_id
+    """
+    cached_book = DB_CACHE.get_telegram_file(book_id, book_format)
+    if not cached_book:
+        return None
+
+    try:
+        await query.message.reply_document(
+            document=cached_book.FileID,
+            disable_notification=True
+        )
+    except BadRequest as e:
+        # Устаревший или чужой file_id - удаляем из кэша и отправляем книгу обычным путём
+        # (обложку ещё не отправляли, её вместе с книгой отправит обычный путь)
+        print(f"Telegram отклонил сохранённый файл книги {book_id}.{book_format}: {e}")
+        DB_CACHE.delete_telegram_file(book_id, book_format)
+        DB_CACHE.delete_telegram_file(book_id, COVER_FILE_FORMAT)
+        return None
+
+    # Обложку отправляем после книги: если Telegram отклонит file_id книги, обычный путь не пришлёт её второй раз
+    cached_cover = DB_CACHE.get_telegram_file(book_id, COVER_FILE_FORMAT) if book_format == DEFAULT_BOOK_FORMAT else None
+    if cached_cover:
+        try:
+            if cached_cover.FileID:
                 await query.message.reply_photo(
-                    photo=cover_bytes,
-                    caption=caption or "",
+                    photo=cached_cover.FileID,
+                    caption=cached_cover.Caption or "",
                     disable_notification=True
                 )
-            elif caption:
-                await query.message.reply_text(caption, disable_notification=True)
+            elif cached_cover.Caption:
+                await query.message.reply_text(cached_cover.Caption, disable_notification=True)
+        except BadRequest as e:
+            # Книга уже отправлена - устаревшую обложку только удаляем из кэша
+            print(f"Telegram отклонил сохранённую обложку книги {book_id}: {e}")
+            DB_CACHE.delete_telegram_file(book_id, COVER_FILE_FORMAT)
+
+    return cached_book.FileName
+
+
+async def reply_file_server_link(query, book_id, book_format, public_filename, folder=None):
+    """Отправляет ссылку на книгу из кэша скачиваний на собственном файловом сервере"""
+    link = FILE_SERVER.make_link(book_id, book_format, public_filename, folder)
+    await query.message.reply_text(
+        text=f"<a href='{escape(link, quote=True)}'>📥 Скачать книгу</a>\n"
+             f"⏳ Ссылка действительна {FILE_SERVER.link_ttl // 60} минут",
+        parse_mode=ParseMode.HTML,
+        disable_web_page_preview=True,
+        disable_notification=True
+    )
+
+
+async def send_cached_book_link(query, book_id, book_format, folder=None):
+    """
+    Отправляет ссылкой книгу, которую уже положили в кэш скачиваний (большие книги file_id не получают)
+    :return: имя файла книги или None, если книги нет в кэше или файловый сервер выключен
+    """
+    if not FILE_SERVER.enabled:
+        return None
+    cached_path = await asyncio.to_thread(DOWNLOAD_CACHE.get, book_id, book_format)
+    if cached_path is None:
+        return None
+    public_filename = os.path.basename(cached_path)
+    started_at = time.monotonic()
+    await reply_file_server_link(query, book_id, book_format, public_filename, folder)
+    DELIVERY_PLANNER.record(ROUTE_LINK, time.monotonic() - started_at)
+    return public_filename
+
+
+async def send_book_link(processing_msg, book_data, book_id, book_format, public_filename, query, folder=None):
+    """
+    Отправляет большую книгу ссылкой на скачивание (для больших файлов и после таймаута отправки файлом):
+    со своего файлового сервера, если он настроен, иначе через внешний сервис
+    :param folder: архив библиотеки, из которого сервер соберёт fb2 заново, если книгу вытеснят из кэша
+    :return: True, если ссылка отправлена
+    """
+    # Книга сохраняется в кэш скачиваний и без файлового сервера: запросы, ждавшие этого скачивания,
+    # возьмут её оттуда, а не с сайта
+    cached_path = None
+    try:
+        cached_path = await asyncio.to_thread(DOWNLOAD_CACHE.put, book_id, book_format, book_data, public_filename)
+    except Exception as cache_error:
+        print(f"Ошибка сохранения книги {public_filename} в кэш скачиваний: {cache_error}")
 
+    if FILE_SERVER.enabled and cached_path:
+        await reply_file_server_link(query, book_id, book_format, public_filename, folder)
+        await processing_msg.delete()
+        return True
 
-async def handle_timeout_error(processing_msg, book_data, file_name, file_ext, query):
-    """Обрабатывает ошибку таймаута"""
     await processing_msg.edit_text(
         "⏳ Книга большая, использую внешний сервис...",
         parse_mode=ParseMode.HTML
     )
 
     try:
-        download_url = await upload_to_tmpfiles(book_data, f"{file_name}{file_ext}")
+        book_data.seek(0)
+        download_url = await upload_to_tmpfiles(book_data, public_filename)
         if download_url:
             direct_download_url = download_url.replace(
                 "https://tmpfiles.org/",
@@ -233,10 +577,13 @@ async def handle_timeout_error(processing_msg, book_data, file_name, file_ext, q
                 disable_web_page_preview=True,
                 disable_notification=True
             )
+            return True
     except Exception as upload_error:
         print(f"Ошибка загрузки на tmpfiles: {upload_error}")
-        await processing_msg.edit_text("❌ Не удалось отправить книгу. Попробуйте позже.")
-        logger.log_user_action(query.from_user.id, "error sending book cloud", f"{file_name}{file_ext}")
+
+    await processing_msg.edit_text("❌ Не удалось отправить книгу. Попробуйте позже.")
+    logger.log_user_action(query.from_user.id, "error sending book cloud", public_filename)
+    return False
 
 
 # def update_user_activity(context: CallbackContext, user_id: int=0):
@@ -445,27 +792,32 @@ async def handle_search_books(update: Update, context: CallbackContext):
     context.user_data[USER_PARAMS] = user_params
     context.user_data[SEARCH_CONTEXT] = SEARCH_TYPE_BOOKS  # Сохраняем контекст
 
-    books, found_books_count = DB_BOOKS.search_books(
+    books_query, books_in_page, found_books_count, count_capped = await BOOKS_SEARCH.search_books_page(
         query_text, user_params.MaxBooks, user_params.Lang,
         user_params.DateSortOrder, size_limit, rating_filter
     )
 
     # Проверяем, найдены ли книги
-    if books or found_books_count > 0:
-        pages_of_books = [books[i:i + user_params.MaxBooks] for i in range(0, len(books), user_params.MaxBooks)]
-
+    if books_in_page or found_books_count > 0:
         await processing_msg.delete()
 
         page = 0
-        keyboard = create_books_keyboard(page, pages_of_books)
+        pages_count = get_pages_count(found_books_count, user_params.MaxBooks)
+        keyboard = create_books_keyboard(page, books_in_page, pages_count, count_capped=count_capped)
+        schedule_format_probes(books_in_page, user_params.BookFormat)
         reply_markup = InlineKeyboardMarkup(keyboard)
         if reply_markup:
-            header_found_text = form_header_books(page, user_params.MaxBooks, found_books_count)
+            header_found_text = form_header_books(page, user_params.MaxBooks, found_books_count,
+                                                  count_capped=count_capped)
             result_message = await message.reply_text(header_found_text, reply_markup=reply_markup)
 
-        context.user_data[BOOKS] = books
-        context.user_data[PAGES_OF_BOOKS] = pages_of_books
+        context.user_data[BOOKS_QUERY] = books_query
+        context.user_data[BOOKS_PAGE_SIZE] = user_params.MaxBooks
+        context.user_data[BOOKS_PAGE_KEYS] = {}
         context.user_data[FOUND_BOOKS_COUNT] = found_books_count
+        context.user_data[FOUND_BOOKS_CAPPED] = count_capped
+        context.user_data[BOOKS_CARDS_MODE] = False
+        save_books_page_keys(context.user_data, page, books_in_page)
         context.user_data['last_activity'] = datetime.now()  # Сохраняем время поиска
     else:
         result_message = await message.reply_text("😞 Не нашёл подходящих книг. Попробуйте другие критерии поиска")
@@ -510,7 +862,7 @@ async def handle_search_series(update: Update, context: CallbackContext):
     context.user_data[SEARCH_CONTEXT] = SEARCH_TYPE_SERIES  # Сохраняем контекст
 
     # Ищем серии
-    series, found_series_count = DB_BOOKS.search_series(
+    series, found_series_count = await BOOKS_SEARCH.search_series(
         query_text, user_params.MaxBooks, user_params.Lang, size_limit, rating_filter
     )
 
@@ -570,20 +922,25 @@ async def handle_search_series_books(query, context, action, params):
         # #debug
         # print(query_text)
 
-        books, found_books_count = DB_BOOKS.search_books(
+        books_query, books_in_page, found_books_count, count_capped = await BOOKS_SEARCH.search_books_page(
             query_text, user_params.MaxBooks, user_params.Lang,
             user_params.DateSortOrder, size_limit, rating_filter
         )
 
-        if books:
-            pages_of_books = [books[i:i + user_params.MaxBooks] for i in range(0, len(books), user_params.MaxBooks)]
-            context.user_data[BOOKS] = books
-            context.user_data[PAGES_OF_BOOKS] = pages_of_books
+        if books_in_page:
+            page = 0
+            context.user_data[BOOKS_QUERY] = books_query
+            context.user_data[BOOKS_PAGE_SIZE] = user_params.MaxBooks
+            context.user_data[BOOKS_PAGE_KEYS] = {}
             context.user_data[FOUND_BOOKS_COUNT] = found_books_count
+            context.user_data[FOUND_BOOKS_CAPPED] = count_capped
+            context.user_data[BOOKS_CARDS_MODE] = False
             context.user_data['last_activity'] = datetime.now()  # Сохраняем время поиска
+            save_books_page_keys(context.user_data, page, books_in_page)
 
-            page = 0
-            keyboard = create_books_keyboard(page, pages_of_books, SEARCH_TYPE_SERIES)
+            pages_count = get_pages_count(found_books_count, user_params.MaxBooks)
+            keyboard = create_books_keyboard(page, books_in_page, pages_count, SEARCH_TYPE_SERIES, count_capped)
+            schedule_format_probes(books_in_page, user_params.BookFormat)
 
             # Добавляем кнопку возврата к сериям
             if keyboard:
@@ -591,7 +948,8 @@ async def handle_search_series_books(query, context, action, params):
                 reply_markup = InlineKeyboardMarkup(keyboard)
 
                 # header_text = f"Книги серии '{series_name}' ({book_count}):"
-                header_text = form_header_books(page, user_params.MaxBooks, found_books_count, 'книг', series_name)
+                header_text = form_header_books(page, user_params.MaxBooks, found_books_count, 'книг', series_name,
+                                                count_capped)
                 await query.edit_message_text(header_text, reply_markup=reply_markup)
         else:
             await query.edit_message_text(f"Не найдено книг в серии '{series_name}'")
@@ -695,6 +1053,8 @@ async def handle_private_callback(query, context, action, params):
     # Затем проверяем ПОЛЬЗОВАТЕЛЬСКИЕ действия
     action_handlers = {
         'send_file': handle_send_file,
+        'send_fb2': handle_send_file,
+        'book_card': handle_book_card,
         'show_genres': handle_show_genres,
         'back_to_settings': handle_back_to_settings,
         f'set_{SETTING_MAX_BOOKS}': handle_set_max_books,
@@ -705,6 +1065,7 @@ async def handle_private_callback(query, context, action, params):
         f'set_{SETTING_SEARCH_TYPE}': handle_set_search_type,
         f'set_{SETTING_RATING_FILTER}': handle_set_rating_filter,
         'show_series': handle_search_series_books,
+        'download_series': handle_download_series,
         'back_to_series': handle_back_to_series,
         'reset_ratings': handle_reset_ratings,
     }
@@ -721,6 +1082,10 @@ async def handle_private_callback(query, context, action, params):
         return
 
     # Затем проверяем префиксы
+    if action.startswith('cards_mode_'):
+        await handle_cards_mode(query, context, action, params)
+        return
+
     if action.startswith('page_'):
         await handle_page_change(query, context, action, params)
         return
@@ -739,19 +1104,255 @@ async def handle_private_callback(query, context, action, params):
     await query.edit_message_text("❌ Неизвестное действие")
 
 async def handle_send_file(query, context, action, params, for_user = None):
-    """Обрабатывает отправку файла"""
+    """Обрабатывает отправку файла (send_fb2 - в fb2 независимо от настроек, когда нужного формата нет)"""
     file_path, file_name, file_ext = params
     book_id = file_name
     user_params = context.user_data.get(USER_PARAMS)
-    book_format = user_params.BookFormat or DEFAULT_BOOK_FORMAT
+    book_format = DEFAULT_BOOK_FORMAT if action == 'send_fb2' else user_params.BookFormat or DEFAULT_BOOK_FORMAT
 
-    public_filename = await process_book_download(query, book_id, book_format, file_name, file_ext, for_user)
+    # Повторное нажатие той же кнопки, пока книга ещё отправляется, игнорируем
+    send_key = (query.from_user.id, book_id, book_format)
+    if send_key in USER_SENDS_IN_FLIGHT:
+        return
+    USER_SENDS_IN_FLIGHT.add(send_key)
+    ticket = None
+    try:
+        processing_msg, book_size = None, None
+        download_host = get_download_host(book_format, file_ext, file_path)
+        # Уже отправленные книги пересылаются по file_id мгновенно, а об отсутствии формата на сайте
+        # известно заранее - такие запросы в очередь не ставим
+        known_missing = download_host != LOCAL_ARCHIVES_HOST and MIRRORS.is_missing(get_book_path(book_id, book_format))
+        if not known_missing and not DB_CACHE.get_telegram_file(book_id, book_format):
+            owner = (query.message.chat.id, query.from_user.id)
+            book_size = await BOOKS_SEARCH.get_book_size(file_name)
+            ticket = DOWNLOAD_SCHEDULER.enqueue(owner, download_host)
+            position = DOWNLOAD_SCHEDULER.get_position(ticket)
+            if position:
+                processing_msg = await query.message.reply_text(
+                    "⏰ <i>Ожидайте, книга" + (f" для {for_user.first_name}" if for_user else "") +
+                    f" в очереди на отправку: {position}-я...</i>",
+                    parse_mode=ParseMode.HTML,
+                    disable_notification=True
+                )
+            await ticket.wait()
+        public_filename = await process_book_download(query, book_id, book_format, file_name, file_ext, for_user,
+                                                      file_path, processing_msg, book_size)
+    finally:
+        if ticket is not None:
+            DOWNLOAD_SCHEDULER.release(ticket)
+        USER_SENDS_IN_FLIGHT.discard(send_key)
 
     log_detail = f"{file_name}{file_ext}"
     log_detail += ":" + public_filename if public_filename else ""
     logger.log_user_action(query.from_user, "send file", log_detail)
 
 
+async def handle_download_series(query, context, action, params):
+    """
+    Скачивает книги текущей серии одним zip-архивом: книги скачиваются через общую очередь по несколько сразу
+    и дописываются в архив по мере получения, ход сборки показывается в одном сообщении
+    """
+    series_name = context.user_data.get('current_series_name')
+    books_query = context.user_data.get(BOOKS_QUERY)
+    if context.user_data.get(SEARCH_CONTEXT) != SEARCH_TYPE_SERIES or not series_name or not books_query:
+        await query.message.reply_text("❌ Сессия поиска истекла. Выберите серию заново.")
+        return
+
+    user_params = context.user_data.get(USER_PARAMS)
+    book_format = user_params.BookFormat or DEFAULT_BOOK_FORMAT
+    send_key = (query.from_user.id, 'series', series_name, book_format)
+    if send_key in USER_SENDS_IN_FLIGHT:
+        return
+    USER_SENDS_IN_FLIGHT.add(send_key)
+
+    series_zip, progress_msg = None, None
+    try:
+        found_books_count = context.user_data.get(FOUND_BOOKS_COUNT) or 0
+        books = await BOOKS_SEARCH.fetch_books_page(books_query, min(found_books_count, SERIES_DOWNLOAD_MAX_BOOKS))
+        if not books:
+            await query.message.reply_text(f"Не найдено книг в серии '{series_name}'")
+            return
+
+        # Серия больше предела архива - сообщаем об этом, а не выдаём первые книги за всю серию
+        series_books_text, limit_text = f"{len(books)}", ""
+        if found_books_count > len(books) or context.user_data.get(FOUND_BOOKS_CAPPED):
+            series_books_text = f"{found_books_count}" + ("+" if context.user_data.get(FOUND_BOOKS_CAPPED) else "")
+            limit_text = f", архив ограничен {len(books)} книгами"
+
+        catalogue_size = sum(book.BookSize or 0 for book in books)
+        if DELIVERY_PLANNER.plan_before_download(catalogue_size) == ROUTE_ARCHIVE_ONLY:
+            await query.message.reply_text(
+                f"📦 Серия '{series_name}' слишком большая для отправки одним архивом "
+                f"({format_size(catalogue_size)}). Скачайте книги по одной."
+            )
+            DELIVERY_PLANNER.record(ROUTE_ARCHIVE_ONLY, 0)
+            return
+
+        progress_msg = await query.message.reply_text(
+            f"📦 <i>Собираю архив серии '{escape(series_name)}': 0 из {len(books)} книг"
+            f"{escape(limit_text)}...</i>",
+            parse_mode=ParseMode.HTML,
+            disable_notification=True
+        )
+        series_zip = SeriesZip()
+        zip_lock = asyncio.Lock()
+        semaphore = asyncio.Semaphore(max(1, SERIES_DOWNLOAD_CONCURRENCY))
+        owner = (query.message.chat.id, query.from_user.id)
+        progress = {'done': 0, 'failed': 0, 'shown_at': time.monotonic()}
+
+        async def add_book(index, book):
+            book_data, original_filename = None, None
+            async with semaphore:
+                ticket = DOWNLOAD_SCHEDULER.enqueue(owner, get_download_host(book_format, book.Ext, book.Folder))
+                try:
+                    await ticket.wait()
+                    book_data, original_filename = await fetch_book_through_cache(
+                        book.FileName, book_format, book.FileName, book.Ext, book.Folder)
+                except Exception as e:
+                    print(f"Ошибка скачивания книги {book.FileName} серии '{series_name}': {e}")
+                finally:
+                    DOWNLOAD_SCHEDULER.release(ticket)
+
+            if book_data is not None:
+                try:
+                    # В архив пишем по одной книге: zipfile не поддерживает одновременную запись
+                    async with zip_lock:
+                        await asyncio.to_thread(series_zip.add_book, f"{index:02d}. ", book_data,
+                                                original_filename or f"{book.FileName}.{book_format}")
+                except Exception as e:
+                    print(f"Ошибка добавления книги {book.FileName} в архив серии '{series_name}': {e}")
+                    book_data.close()
+                    book_data = None
+                else:
+                    book_data.close()
+            if book_data is None:
+                progress['failed'] += 1
+
+            progress['done'] += 1
+            now = time.monotonic()
+            if progress['done'] < len(books) and now - progress['shown_at'] >= SERIES_PROGRESS_INTERVAL:
+                progress['shown_at'] = now
+                try:
+                    await progress_msg.edit_text(
+                        f"📦 <i>Собираю архив серии '{escape(series_name)}': {progress['done']} из {len(books)} "
+                        f"книг{escape(limit_text)}" +
+                        (f", не удалось скачать: {progress['failed']}" if progress['failed'] else "") + "...</i>",
+                        parse_mode=ParseMode.HTML
+                    )
+                except BadRequest:
+                    pass
+
+        await asyncio.gather(*(add_book(index, book) for index, book in enumerate(books, 1)))
+
+        if not series_zip.books_count:
+            await progress_msg.edit_text(f"😞 Не удалось скачать книги серии '{series_name}'")
+            return
+
+        zip_size = await asyncio.to_thread(series_zip.finish)
+        zip_name = re.sub(r'[\\/:*?"<>|]+', '_', series_name).strip() + '.zip'
+        caption = f"📦 {series_name}: {series_zip.books_count} из {series_books_text} книг{limit_text}"
+        if progress['failed']:
+            caption += f" (не удалось скачать: {progress['failed']})"
+        # Архив серии отдаётся файловым сервером под ключом из набора книг и формата
+        series_id = 'series-' + hashlib.sha1(
+            ','.join(book.FileName for book in books).encode()).hexdigest()[:16]
+
+        route = DELIVERY_PLANNER.plan_after_download(zip_size)
+        route_started_at = time.monotonic()
+        if route == ROUTE_LINK:
+            delivered = await send_book_link(progress_msg, series_zip.file, series_id, book_format, zip_name, query)
+            DELIVERY_PLANNER.record(route, time.monotonic() - route_started_at, delivered)
+        else:
+            try:
+                await query.message.reply_document(
+                    document=series_zip.file,
+                    filename=zip_name,
+                    caption=caption,
+                    disable_notification=True
+                )
+                DELIVERY_PLANNER.record(route, time.monotonic() - route_started_at)
+                await progress_msg.delete()
+            except TimedOut:
+                DELIVERY_PLANNER.record(route, time.monotonic() - route_started_at, False)
+                route_started_at = time.monotonic()
+                delivered = await send_book_link(progress_msg, series_zip.file, series_id, book_format, zip_name,
+                                                 query)
+                DELIVERY_PLANNER.record(ROUTE_LINK, time.monotonic() - route_started_at, delivered)
+
+        logger.log_user_action(query.from_user, "send series",
+                               f"{series_name}:{book_format}:{series_zip.books_count}/{series_books_text}")
+    except Exception as e:
+        print(f"Общая ошибка при отправке архива серии '{series_name}': {e}")
+        error_text = f"❌ Не удалось отправить архив серии '{series_name}'. Попробуйте позже."
+        if progress_msg is not None:
+            await progress_msg.edit_text(error_text)
+        else:
+            await query.message.reply_text(error_text)
+        logger.log_user_action(query.from_user, "error sending series", f"{series_name}:{book_format}")
+    finally:
+        if series_zip is not None:
+            series_zip.close()
+        USER_SENDS_IN_FLIGHT.discard(send_key)
+
+
+def format_book_card(card):
+    """Текст карточки книги (HTML); аннотация обрезается, чтобы карточка поместилась в подпись к обложке"""
+    author = ' '.join(name for name in (card.LastName, card.FirstName, card.MiddleName) if name)
+    lines = [f"📖 <b>{escape(card.Title or '')}</b>"]
+    if author:
+        lines.append(f"✍️ {escape(author)}")
+    if card.SeriesTitle:
+        lines.append(f"📚 Серия: {escape(card.SeriesTitle)}")
+    lines.append(f"🏷 {escape(card.Genre or '')}, {escape(card.SearchLang or '')}, {format_size(card.BookSize)}")
+    rating_emoji, rating_text = BOOK_RATINGS.get(card.LibRate, ("⚪️", ""))
+    if rating_text:
+        lines.append(f"{rating_emoji} {escape(rating_text)}")
+    publish_info = ", ".join(escape(str(value)) for value in (card.Publisher, card.Year, card.City) if value)
+    if publish_info:
+        lines.append(f"🏢 {publish_info}")
+    if card.ISBN:
+        lines.append(f"ISBN: {escape(card.ISBN)}")
+    text = "\n".join(lines)
+
+    if card.Annotation:
+        room = BOOK_CARD_CAPTION_LIMIT - len(text) - 2
+        annotation = card.Annotation if len(card.Annotation) <= room else card.Annotation[:max(0, room - 1)] + "…"
+        if annotation:
+            text += f"\n\n<i>{escape(annotation)}</i>"
+    return text
+
+
+async def handle_book_card(query, context, action, params):
+    """Показывает карточку книги из локальных данных (без скачивания книги с сайта)"""
+    file_name = params[0]
+    card = await BOOKS_SEARCH.get_book_card(file_name)
+    if card is None:
+        await query.message.reply_text("❌ Книга не найдена", disable_notification=True)
+        return
+
+    reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(
+        "📥 Скачать", callback_data=f"send_file:{card.Folder}:{card.FileName}:{card.Ext}"
+    )]])
+    caption = format_book_card(card)
+    cover_path = get_book_card_cover_path(card.CoverHash)
+    if cover_path:
+        with open(cover_path, 'rb') as cover_file:
+            await query.message.reply_photo(photo=cover_file, caption=caption, parse_mode=ParseMode.HTML,
+                                            reply_markup=reply_markup, disable_notification=True)
+    else:
+        await query.message.reply_text(caption, parse_mode=ParseMode.HTML, reply_markup=reply_markup,
+                                       disable_notification=True)
+    logger.log_user_action(query.from_user, "show book card", file_name)
+
+
+def get_book_card_cover_path(cover_hash):
+    """Путь к обложке в хранилище карточек или None, если обложки нет"""
+    if not cover_hash:
+        return None
+    cover_path = os.path.join(BOOK_CARDS_PATH, cover_hash[:2], f"{cover_hash}.jpg")
+    return cover_path if os.path.isfile(cover_path) else None
+
+
 async def handle_show_genres(query, context, action, params):
     """Показывает жанры выбранной категории"""
     try:
@@ -857,25 +1458,32 @@ async def handle_page_change(query, context, action, params):
     """Обрабатывает смену страницы с проверкой данных"""
     try:
         # Проверяем, что данные поиска еще существуют
-        if 'PAGES_OF_BOOKS' not in context.user_data or not context.user_data['PAGES_OF_BOOKS']:
+        if BOOKS_QUERY not in context.user_data or not context.user_data[BOOKS_QUERY]:
             await query.edit_message_text("❌ Сессия поиска истекла. Начните поиск заново.")
             return
 
         page = int(action.removeprefix('page_'))
-        pages_of_books = context.user_data.get(PAGES_OF_BOOKS)
+        books_in_page = await load_books_page(context.user_data, page)
+        if not books_in_page:
+            await query.answer("❌ Ошибка при загрузке страницы")
+            return
+
+        found_books_count = context.user_data.get(FOUND_BOOKS_COUNT)
+        count_capped = context.user_data.get(FOUND_BOOKS_CAPPED, False)
+        page_size = context.user_data.get(BOOKS_PAGE_SIZE)
         # Определяем контекст поиска
         search_context = context.user_data.get(SEARCH_CONTEXT, SEARCH_TYPE_BOOKS)
-        keyboard = create_books_keyboard(page, pages_of_books, search_context)
+        keyboard = create_books_keyboard(page, books_in_page, get_pages_count(found_books_count, page_size),
+                                         search_context, count_capped, context.user_data.get(BOOKS_CARDS_MODE, False))
+        schedule_format_probes(books_in_page, context.user_data[USER_PARAMS].BookFormat)
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         if reply_markup:
-            found_books_count = context.user_data.get(FOUND_BOOKS_COUNT)
-            user_params = context.user_data.get(USER_PARAMS)
             # Формируем заголовок в зависимости от контекста
             series_name = None
             if search_context == SEARCH_TYPE_SERIES:
                 series_name = context.user_data.get('current_series_name', None)
-            header_text = form_header_books(page, user_params.MaxBooks, found_books_count, 'книг', series_name)
+            header_text = form_header_books(page, page_size, found_books_count, 'книг', series_name, count_capped)
             await query.edit_message_text(header_text, reply_markup=reply_markup)
 
     except ValueError:
@@ -887,6 +1495,12 @@ async def handle_page_change(query, context, action, params):
     logger.log_user_action(query.from_user, "changed page of books", page)
 
 
+async def handle_cards_mode(query, context, action, params):
+    """Переключает кнопки книг на странице между скачиванием и показом карточек"""
+    context.user_data[BOOKS_CARDS_MODE] = not context.user_data.get(BOOKS_CARDS_MODE, False)
+    await handle_page_change(query, context, f"page_{action.removeprefix('cards_mode_')}", params)
+
+
 async def handle_series_page_change(query, context, action, params):
     try:
         # Проверяем, что данные серий еще существуют
@@ -1327,7 +1941,7 @@ async def handle_group_search(update: Update, context: CallbackContext):
         context.user_data[USER_PARAMS] = user_params
 
         # Выполняем поиск книг
-        books, found_books_count = DB_BOOKS.search_books(
+        books_query, books_in_page, found_books_count, count_capped = await BOOKS_SEARCH.search_books_page(
             clean_query_text, user_params.MaxBooks, user_params.Lang,
             user_params.DateSortOrder, '', ''
         )
@@ -1335,17 +1949,18 @@ async def handle_group_search(update: Update, context: CallbackContext):
         # Удаляем сообщение "Ищу книги..."
         await processing_msg.delete()
 
-        if books and found_books_count > 0:
-            pages_of_books = [books[i:i + user_params.MaxBooks] for i in range(0, len(books), user_params.MaxBooks)]
+        if books_in_page and found_books_count > 0:
             page = 0
 
-            keyboard = create_books_keyboard(page, pages_of_books)
+            pages_count = get_pages_count(found_books_count, user_params.MaxBooks)
+            keyboard = create_books_keyboard(page, books_in_page, pages_count, count_capped=count_capped)
             reply_markup = InlineKeyboardMarkup(keyboard)
 
             if reply_markup:
                 user_name = (user.first_name if user.first_name else "") #+ (f" @{user.username}" if user.username else "")
                 header_found_text = f"📚 Результаты поиска" + (f" для {user_name}" if user_name else "") + ":\n\n"
-                header_found_text += form_header_books(page, user_params.MaxBooks, found_books_count)
+                header_found_text += form_header_books(page, user_params.MaxBooks, found_books_count,
+                                                       count_capped=count_capped)
 
                 # Отправляем результаты поиска
                 result_message = await context.bot.send_message(
@@ -1356,15 +1971,18 @@ async def handle_group_search(update: Update, context: CallbackContext):
 
                 # Сохраняем контекст поиска в bot_data (доступно всем пользователям группы)
                 context.bot_data[search_context_key] = {
-                    BOOKS: books,
-                    PAGES_OF_BOOKS: pages_of_books,
+                    BOOKS_QUERY: books_query,
+                    BOOKS_PAGE_SIZE: user_params.MaxBooks,
+                    BOOKS_PAGE_KEYS: {},
                     FOUND_BOOKS_COUNT: found_books_count,
+                    FOUND_BOOKS_CAPPED: count_capped,
                     USER_PARAMS: user_params,
                     # 'user': user,
                     'query': clean_query_text,
                     'last_activity': datetime.now(),
                     'last_bot_message_id': result_message.message_id
                 }
+                save_books_page_keys(context.bot_data[search_context_key], page, books_in_page)
         else:
             # Отправляем сообщение о том, что книги не найдены
             result_message = await context.bot.send_message(
@@ -1402,8 +2020,15 @@ async def handle_group_callback(query, context, action, params, user):
         return
 
     # Обрабатываем действия
-    if action == 'send_file':
+    if action in ('send_file', 'send_fb2'):
         await handle_send_file(query, context, action, params, user)
+    elif action == 'book_card':
+        await handle_book_card(query, context, action, params)
+    elif action.startswith('cards_mode_'):
+        # Режим описаний в группе общий для всех, кто листает результаты поиска
+        search_context[BOOKS_CARDS_MODE] = not search_context.get(BOOKS_CARDS_MODE, False)
+        await handle_group_page_change(query, context, f"page_{action.removeprefix('cards_mode_')}", params, user,
+                                       search_context_key)
     elif action.startswith('page_'):
         await handle_group_page_change(query, context, action, params, user, search_context_key)
     else:
@@ -1424,22 +2049,23 @@ async def handle_group_page_change(query, context, action, params, user, search_
         await query.edit_message_text("❌ Сессия поиска истекла. Начните поиск заново.")
         return
 
-    pages_of_books = search_context.get(PAGES_OF_BOOKS)
     page = int(action.removeprefix('page_'))
+    books_in_page = await load_books_page(search_context, page) if search_context.get(BOOKS_QUERY) else None
 
-    if not pages_of_books or page >= len(pages_of_books):
+    if not books_in_page:
         await query.edit_message_text("❌ Ошибка при загрузке страницы")
         return
 
-    keyboard = create_books_keyboard(page, pages_of_books)
+    found_books_count = search_context.get(FOUND_BOOKS_COUNT)
+    count_capped = search_context.get(FOUND_BOOKS_CAPPED, False)
+    page_size = search_context.get(BOOKS_PAGE_SIZE)
+    keyboard = create_books_keyboard(page, books_in_page, get_pages_count(found_books_count, page_size),
+                                     count_capped=count_capped, cards_mode=search_context.get(BOOKS_CARDS_MODE, False))
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     if reply_markup:
-        found_books_count = search_context.get(FOUND_BOOKS_COUNT)
-        user_params = search_context.get(USER_PARAMS)
-
         user_name = (user.first_name if user.first_name else "") #+ (f" @{user.username}" if user.username else "")
         header_text = f"📚 Результаты поиска" + (f" для {user_name}" if user_name else "") + ":\n\n"
-        header_text += form_header_books(page, user_params.MaxBooks, found_books_count)
+        header_text += form_header_books(page, page_size, found_books_count, count_capped=count_capped)
 
         await query.edit_message_text(header_text, reply_markup=reply_markup)
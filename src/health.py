@@ -1,10 +1,11 @@
 import psutil
 import gc
+import threading
 from datetime import datetime
 
 from telegram.ext import CallbackContext
 
-from constants import CLEANUP_INTERVAL
+from constants import CLEANUP_INTERVAL, STATS_SAMPLE_INTERVAL
 from logger import logger
 
 def get_memory_usage():
@@ -13,16 +14,77 @@ def get_memory_usage():
     return process.memory_info().rss / 1024 / 1024
 
 
+class SystemStatsSampler:
+    """
+    Фоновый сбор системной статистики.
+    Поток раз в interval секунд обновляет снимок, обработчики читают готовый снимок и не ждут замеров.
+    """
+
+    def __init__(self, interval=STATS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._process = psutil.Process()
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _count_open_files(self):
+        """Количество открытых дескрипторов процесса (на Windows - открытых файлов)"""
+        if hasattr(self._process, 'num_fds'):
+            return self._process.num_fds()
+        return len(self._process.open_files())
+
+    def sample(self):
+        """Снимает статистику и сохраняет снимок"""
+        snapshot = {
+            'memory_used': f"{self._process.memory_info().rss / 1024 / 1024:.1f}",
+            'memory_percent': f"{psutil.virtual_memory().percent:.1f}",
+            # Без interval psutil возвращает загрузку CPU с момента предыдущего замера, то есть за период сэмплера
+            'cpu_percent': f"{psutil.cpu_percent(interval=None):.1f}",
+            'open_files': self._count_open_files(),
+            'threads': self._process.num_threads(),
+            'timestamp': datetime.now().isoformat()
+        }
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def get_snapshot(self):
+        """Возвращает последний снимок статистики"""
+        with self._lock:
+            snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.sample()
+        return dict(snapshot)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Ошибка сбора системной статистики: {e}")
+
+    def start(self):
+        """Запускает фоновый поток сбора статистики"""
+        if self._thread is None:
+            self.sample()
+            self._thread = threading.Thread(target=self._run, name='stats_sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Останавливает фоновый поток"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+
+
+STATS_SAMPLER = SystemStatsSampler()
+
+
 def get_system_stats():
-    """Возвращает системную статистику"""
-    return {
-        'memory_used': f"{get_memory_usage():.1f}",
-        'memory_percent': f"{psutil.virtual_memory().percent:.1f}",
-        'cpu_percent': f"{psutil.cpu_percent(interval=1):.1f}",
-        'open_files': len(psutil.Process().open_files()),
-        'threads': psutil.Process().num_threads(),
-        'timestamp': datetime.now().isoformat()
-    }
+    """Возвращает системную статистику (последний снимок фонового сэмплера)"""
+    return STATS_SAMPLER.get_snapshot()
 
 
 def log_system_stats():
@@ -75,7 +137,8 @@ async def cleanup_old_sessions(context: CallbackContext):
                             datetime.now() - last_activity).total_seconds() > CLEANUP_INTERVAL:
                         # Очищаем данные поиска УДАЛЕНИЕМ ключей
                         search_keys = [
-                            'BOOKS', 'PAGES_OF_BOOKS', 'FOUND_BOOKS_COUNT',
+                            'BOOKS_QUERY', 'BOOKS_PAGE_SIZE', 'BOOKS_PAGE_KEYS',
+                            'FOUND_BOOKS_COUNT', 'FOUND_BOOKS_CAPPED',
                             'SERIES', 'PAGES_OF_SERIES', 'FOUND_SERIES_COUNT',
                             'last_activity'
                         ]
@@ -0,0 +1,79 @@
+import aiohttp
+
+from constants import HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT, \
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_TOTAL_TIMEOUT
+
+
+class HttpClient:
+    """
+    Общий на всё время работы бота HTTP-клиент.
+    Соединения с сайтами переиспользуются (keep-alive), результаты DNS кэшируются,
+    поэтому повторные скачивания не платят за DNS, TCP и TLS заново.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._stats = {
+            'requests': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'dns_cache_hits': 0,
+            'dns_cache_misses': 0
+        }
+
+    def _create_trace_config(self):
+        """Счётчики запросов и переиспользования соединений"""
+        trace_config = aiohttp.TraceConfig()
+
+        def counter(name):
+            async def increment(session, context, params):
+                self._stats[name] += 1
+            return increment
+
+        trace_config.on_request_start.append(counter('requests'))
+        trace_config.on_connection_create_end.append(counter('connections_created'))
+        trace_config.on_connection_reuseconn.append(counter('connections_reused'))
+        trace_config.on_dns_cache_hit.append(counter('dns_cache_hits'))
+        trace_config.on_dns_cache_miss.append(counter('dns_cache_misses'))
+        return trace_config
+
+    async def start(self):
+        """Создаёт сессию (вызывается при запуске бота)"""
+        self.get_session()
+
+    def get_session(self):
+        """Возвращает общую сессию, создавая её при первом обращении"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=HTTP_TOTAL_TIMEOUT,
+                connect=HTTP_CONNECT_TIMEOUT,
+                sock_read=HTTP_READ_TIMEOUT
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+                trace_configs=[self._create_trace_config()]
+            )
+        return self._session
+
+    async def close(self):
+        """Закрывает сессию и все соединения пула (вызывается при остановке бота)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def get_stats(self):
+        """Возвращает статистику соединений"""
+        stats = dict(self._stats)
+        connections = stats['connections_created'] + stats['connections_reused']
+        stats['reuse_rate'] = round(stats['connections_reused'] / connections * 100, 1) if connections else 0
+        return stats
+
+
+HTTP_CLIENT = HttpClient()
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import FLIBUSTA_ARCHIVES_PATH, LOCAL_ARCHIVES_POOL_SIZE, DOWNLOAD_SPOOL_SIZE, DOWNLOAD_CHUNK_SIZE
+from database import DatabaseCache, ArchiveMember
+
+# Структуры zip-формата (без zip64: в ответ упаковывается одна книга)
+ZIP_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+ZIP_CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+ZIP_END_OF_CENTRAL_DIR = struct.Struct('<4s4H2LH')
+ZIP_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+ZIP_CENTRAL_HEADER_SIGNATURE = b'PK\x01\x02'
+ZIP_END_OF_CENTRAL_DIR_SIGNATURE = b'PK\x05\x06'
+ZIP_VERSION = 20
+
+
+class LocalArchives:
+    """
+    Выдача книг из локальных zip-архивов библиотеки (поле Folder книги - имя архива).
+    Центральный каталог каждого архива один раз сохраняется в БД кэшей (имя файла -> смещение и размер),
+    поэтому книга читается одним позиционированием в архиве без разбора всего zip.
+    Сжатые данные не распаковываются: они частями копируются во временный zip из одного файла,
+    как его отдаёт сайт библиотеки.
+    """
+
+    def __init__(self, archives_path=FLIBUSTA_ARCHIVES_PATH, pool_size=LOCAL_ARCHIVES_POOL_SIZE):
+        self.archives_path = archives_path
+        self._executor = ThreadPoolExecutor(max_workers=max(1, pool_size), thread_name_prefix='local_archives')
+        self._local = threading.local()
+        self._index_lock = threading.Lock()
+
+    def _get_db(self):
+        """Возвращает соединение с БД кэшей текущего потока пула (создаётся при первом обращении)"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = DatabaseCache()
+            self._local.db = db
+        return db
+
+    def _index_archive(self, db, archive, archive_path, state):
+        """Перестраивает индекс архива, если архива ещё нет в индексе или он изменился"""
+        with self._index_lock:
+            # Индекс мог построить другой поток, пока этот ждал блокировку
+            if db.get_archive_state(archive) == state:
+                return
+            with zipfile.ZipFile(archive_path, 'r') as zip_file:
+                members = [
+                    ArchiveMember(info.filename, info.header_offset, info.compress_size, info.file_size,
+                                  info.compress_type, info.CRC)
+                    for info in zip_file.infolist() if not info.is_dir()
+                ]
+            db.save_archive_index(archive, *state, members)
+            print(f"Проиндексирован архив {archive}: {len(members)} файлов")
+
+    @staticmethod
+    def _seek_member_data(archive_file, member):
+        """Переходит к сжатым данным файла архива по смещению из индекса"""
+        archive_file.seek(member.HeaderOffset)
+        header = archive_file.read(ZIP_LOCAL_HEADER.size)
+        if len(header) != ZIP_LOCAL_HEADER.size or header[:4] != ZIP_LOCAL_HEADER_SIGNATURE:
+            raise ValueError(f"неверный заголовок файла {member.MemberName}")
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        archive_file.seek(name_length + extra_length, os.SEEK_CUR)
+
+    @staticmethod
+    def _write_single_file_zip(output, member, archive_file):
+        """Записывает zip из одного файла, копируя уже сжатые данные из архива частями"""
+        name = member.MemberName.encode('utf-8')
+        flags = 0x800 if not name.isascii() else 0  # Имя в UTF-8
+        now = time.localtime()
+        dos_time = (now.tm_hour << 11) | (now.tm_min << 5) | (now.tm_sec // 2)
+        dos_date = ((now.tm_year - 1980) << 9) | (now.tm_mon << 5) | now.tm_mday
+
+        output.write(ZIP_LOCAL_HEADER.pack(
+            ZIP_LOCAL_HEADER_SIGNATURE, ZIP_VERSION, flags, member.CompressType, dos_time, dos_date,
+            member.CRC, member.CompressSize, member.FileSize, len(name), 0
+        ))
+        output.write(name)
+
+        remaining = member.CompressSize
+        while remaining:
+            chunk = archive_file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"файл {member.MemberName} обрезан")
+            output.write(chunk)
+            remaining -= len(chunk)
+
+        central_header = ZIP_CENTRAL_HEADER.pack(
+            ZIP_CENTRAL_HEADER_SIGNATURE, ZIP_VERSION, ZIP_VERSION, flags, member.CompressType, dos_time, dos_date,
+            member.CRC, member.CompressSize, member.FileSize, len(name), 0, 0, 0, 0, 0, 0
+        )
+        central_dir_offset = ZIP_LOCAL_HEADER.size + len(name) + member.CompressSize
+        output.write(central_header)
+        output.write(name)
+        output.write(ZIP_END_OF_CENTRAL_DIR.pack(
+            ZIP_END_OF_CENTRAL_DIR_SIGNATURE, 0, 0, 1, 1, len(central_header) + len(name), central_dir_offset, 0
+        ))
+
+    def _read_book(self, folder, file_name, file_ext):
+        archive_path = os.path.join(self.archives_path, folder)
+        if not os.path.isfile(archive_path):
+            return None, None
+
+        db = self._get_db()
+        stat = os.stat(archive_path)
+        state = (stat.st_mtime_ns, stat.st_size)
+        if db.get_archive_state(folder) != state:
+            self._index_archive(db, folder, archive_path, state)
+
+        member = db.get_archive_member(folder, f"{file_name}{file_ext}")
+        if member is None:
+            return None, None
+
+        book_file = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
+        try:
+            with open(archive_path, 'rb') as archive_file:
+                self._seek_member_data(archive_file, member)
+                self._write_single_file_zip(book_file, member, archive_file)
+        except Exception:
+            book_file.close()
+            raise
+        book_file.seek(0)
+        return book_file, f"{member.MemberName}.zip"
+
+    def has_archive(self, folder):
+        """Есть ли архив с таким именем в каталоге локальных архивов"""
+        if not self.archives_path or not folder or os.path.basename(folder) != folder:
+            return False
+        return os.path.isfile(os.path.join(self.archives_path, folder))
+
+    async def read_book(self, folder, file_name, file_ext):
+        """
+        Читает книгу из локального архива
+        :return: (временный файл с zip книги, имя файла) или (None, None), если книги нет в локальных архивах
+        """
+        # Имя архива приходит из callback-данных - не выпускаем путь за пределы каталога архивов
+        if not self.archives_path or not folder or os.path.basename(folder) != folder:
+            return None, None
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self._read_book, folder, file_name, file_ext)
+        except Exception as e:
+            print(f"Ошибка чтения книги {file_name}{file_ext} из архива {folder}: {e}")
+            return None, None
+
+    def close(self):
+        """Останавливает пул потоков"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
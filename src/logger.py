@@ -1,10 +1,103 @@
 import logging
+import queue
+import threading
+import time
 from logging.handlers import TimedRotatingFileHandler
 from datetime import datetime
 
-from constants import FLIBUSTA_LOG_PATH
+from constants import FLIBUSTA_LOG_PATH, FLIBUSTA_DB_LOGS_PATH, USER_LOG_FLUSH_INTERVAL, USER_LOG_BATCH_SIZE
 from database import  DatabaseLogs
 
+
+class UserLogWriter:
+    """
+    Фоновая запись действий пользователей в БД логов.
+    Обработчики только кладут запись в очередь, поток пишет накопленные записи пачками одной транзакцией:
+    как только набралось batch_size записей или прошло flush_interval секунд.
+    """
+
+    _STOP = object()  # Маркер остановки потока
+
+    def __init__(self, db_path=FLIBUSTA_DB_LOGS_PATH, flush_interval=USER_LOG_FLUSH_INTERVAL,
+                 batch_size=USER_LOG_BATCH_SIZE):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._written = 0
+        self._batches = 0
+        self._errors = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._thread = threading.Thread(target=self._run, name='user_log_writer', daemon=True)
+        self._thread.start()
+
+    def put(self, record):
+        """Ставит запись в очередь на запись (не блокирует)"""
+        self._queue.put_nowait(record)
+
+    def _flush(self, db, batch):
+        """Записывает пачку в БД и обновляет статистику"""
+        started = time.perf_counter()
+        try:
+            db.write_user_logs(batch)
+        except Exception as e:
+            print(f"Ошибка записи журнала действий ({len(batch)} записей): {e}")
+            with self._lock:
+                self._errors += 1
+            return
+        flush_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._written += len(batch)
+            self._batches += 1
+            self._last_flush_ms = flush_ms
+            self._max_flush_ms = max(self._max_flush_ms, flush_ms)
+
+    def _run(self):
+        # Соединение SQLite создаётся и используется только в этом потоке
+        db = DatabaseLogs(self.db_path)
+        try:
+            stopping = False
+            while not stopping:
+                batch = []
+                deadline = None
+                while len(batch) < self.batch_size:
+                    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                    try:
+                        record = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if record is self._STOP:
+                        stopping = True
+                        break
+                    batch.append(record)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                if batch:
+                    self._flush(db, batch)
+        finally:
+            db.close()
+
+    def close(self):
+        """Записывает всё накопленное и останавливает поток"""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+    def get_stats(self):
+        """Возвращает статистику записи журнала"""
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'written': self._written,
+                'batches': self._batches,
+                'errors': self._errors,
+                'last_flush_ms': round(self._last_flush_ms, 1),
+                'max_flush_ms': round(self._max_flush_ms, 1)
+            }
+
+
 class SingletonLogger:
     _instance = None
 
@@ -16,7 +109,7 @@ class SingletonLogger:
         return cls._instance
 
     def _initialize_db_logger(self):
-        self.db_logger = DatabaseLogs()
+        self.db_logger = UserLogWriter()
 
     def _initialize_logger(self):
         """
@@ -49,7 +142,7 @@ class SingletonLogger:
         info = f"User {user.id} ({user.username}) performed action: {action}/{detail}"
 
         # #debug
-        print(f"DEBUG: {info}")
+        # print(f"DEBUG: {info}")
         # print(f"DEBUG: {user}")
 
         if self.logger:
@@ -60,7 +153,7 @@ class SingletonLogger:
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]  # Обрезаем до 7 знаков после точки
             fullname = (f"{user.first_name}" if user.first_name else '') + (f" {user.last_name}" if user.last_name else '')
             fullname = f"({fullname.strip()})" if fullname.strip() else ''
-            self.db_logger.write_user_log(timestamp, user.id, f"{user.username} {fullname}", action, detail)
+            self.db_logger.put((timestamp, user.id, f"{user.username} {fullname}", action, detail))
 
     def log_system_action(self, action, detail = ''):
         """
@@ -81,6 +174,11 @@ class SingletonLogger:
         #     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]  # Обрезаем до 7 знаков после точки
         #     self.db_logger.write_user_log(timestamp, 0, "SYSTEM", action, detail)
 
+    def close(self):
+        """Дописывает накопленные записи журнала в БД"""
+        if self.db_logger:
+            self.db_logger.close()
+
 # Создаём единственный экземпляр логгера
 logger = SingletonLogger()
 
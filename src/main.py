@@ -8,12 +8,13 @@ from telegram.ext import Application, CommandHandler, MessageHandler, filters, C
 from telegram.request import HTTPXRequest
 from telegram.error import Forbidden, BadRequest, TimedOut
 
-from handlers import handle_message, button_callback, start_cmd, genres_cmd, langs_cmd, settings_cmd, donate_cmd, \
-    help_cmd, about_cmd, news_cmd, handle_group_message
-from admin import admin_cmd, cancel_auth, auth_password, AUTH_PASSWORD, handle_admin_buttons, ADMIN_BUTTONS
-from constants import CLEANUP_INTERVAL #, MONITORING_INTERVAL  # FLIBUSTA_DB_BOOKS_PATH, FLIBUSTA_DB_SETTINGS_PATH
-from health import log_stats, cleanup_old_sessions
+# Обработчики бота (handlers, admin, health, logger) импортируются внутри функций, а не здесь:
+# процессы пула разбора fb2 (spawn) заново импортируют этот модуль как __mp_main__, и верхний уровень
+# не должен открывать БД, кэши и потоки бота в каждом процессе пула
+from constants import CLEANUP_INTERVAL, WARMUP_INTERVAL, BOT_CONCURRENT_UPDATES #, MONITORING_INTERVAL  # FLIBUSTA_DB_BOOKS_PATH, FLIBUSTA_DB_SETTINGS_PATH
 from utils import check_files
+from http_client import HTTP_CLIENT
+from update_processor import UserMessagesUpdateProcessor
 
 
 async def error_handler(update: Update, context: CallbackContext):
@@ -41,6 +42,28 @@ async def error_handler(update: Update, context: CallbackContext):
         print(f"User: {update.effective_user.id}")
 
 
+async def on_shutdown(application: Application):
+    """Освобождает ресурсы при остановке бота"""
+    from handlers import BOOKS_SEARCH, LOCAL_ARCHIVES, FB2_PARSER, FILE_SERVER
+    from health import STATS_SAMPLER
+    from logger import logger
+    BOOKS_SEARCH.close()
+    LOCAL_ARCHIVES.close()
+    FB2_PARSER.close()
+    await FILE_SERVER.stop()
+    STATS_SAMPLER.stop()
+    logger.close()
+    await HTTP_CLIENT.close()
+
+
+async def on_startup(application: Application):
+    """Готовит общие ресурсы при запуске бота"""
+    from handlers import FILE_SERVER
+    await HTTP_CLIENT.start()
+    await FILE_SERVER.start()
+    await set_commands(application)
+
+
 async def set_commands(application: Application):
     """Устанавливает меню команд"""
     commands = [
@@ -58,9 +81,19 @@ async def set_commands(application: Application):
 
 
 def main():
+    from handlers import handle_message, button_callback, start_cmd, genres_cmd, langs_cmd, settings_cmd, \
+        donate_cmd, help_cmd, about_cmd, news_cmd, handle_group_message, DB_BOOKS, warm_popular_books
+    from admin import admin_cmd, cancel_auth, auth_password, AUTH_PASSWORD, handle_admin_buttons, ADMIN_BUTTONS
+    from health import cleanup_old_sessions, STATS_SAMPLER
+
     if not check_files():
         raise RuntimeError("Необходимые файлы или БД недоступны в контейнере.")
 
+    # Проверяем, что поисковая таблица книг собрана
+    search_table_error = DB_BOOKS.check_search_table()
+    if search_table_error:
+        raise RuntimeError(search_table_error)
+
     # Получаем токен из переменной окружения
     TOKEN = os.getenv("BOT_TOKEN")
     if not TOKEN:
@@ -72,9 +105,12 @@ def main():
 #        if not TOKEN:
 #            raise ValueError("Токен бота не найден в config.ini.")
 
-    request = HTTPXRequest(connect_timeout=60, read_timeout=60)
+    request = HTTPXRequest(connect_timeout=60, read_timeout=60, connection_pool_size=BOT_CONCURRENT_UPDATES)
     #application = Application.builder().token(TOKEN).read_timeout(60).build()
-    application = Application.builder().token(TOKEN).request(request).build()
+    # Обновления обрабатываются параллельно: долгая отправка книги одному пользователю не задерживает остальных.
+    # Сообщения одного пользователя - по очереди, иначе параллельно меняется состояние диалога входа администратора
+    application = Application.builder().token(TOKEN).request(request) \
+        .concurrent_updates(UserMessagesUpdateProcessor(BOT_CONCURRENT_UPDATES)).build()
 
     application.add_error_handler(error_handler)
 
@@ -120,7 +156,8 @@ def main():
     application.add_handler(CallbackQueryHandler(button_callback))
 
     # Устанавливаем меню команд
-    application.post_init = set_commands
+    application.post_init = on_startup
+    application.post_shutdown = on_shutdown
 
     # Добавляем периодическую очистку сессий (каждые 5 минут)
     #job_queue = application.job_queue
@@ -132,6 +169,11 @@ def main():
         # job_queue.run_repeating(log_stats, interval=MONITORING_INTERVAL, first=10)
         # Периодическая очистка старых пользовательских сессий
         job_queue.run_repeating(cleanup_old_sessions, interval=CLEANUP_INTERVAL, first=CLEANUP_INTERVAL)
+        # Прогрев кэша file_id популярными книгами (выполняется только в тихие часы)
+        job_queue.run_repeating(warm_popular_books, interval=WARMUP_INTERVAL, first=WARMUP_INTERVAL)
+
+    # Системная статистика собирается в фоне, обработчики читают готовый снимок
+    STATS_SAMPLER.start()
 
     application.run_polling()
 
@@ -0,0 +1,307 @@
+import asyncio
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+from constants import FLIBUSTA_MIRRORS, MIRROR_RETRIES, MIRROR_RETRY_BACKOFF_MS, MIRROR_FAILURE_THRESHOLD, \
+    MIRROR_OPEN_TIME, MIRROR_DOWNLOAD_DEADLINE, DOWNLOAD_MAX_SIZE, DOWNLOAD_CHUNK_SIZE, HTTP_CONNECT_TIMEOUT, \
+    HTTP_READ_TIMEOUT, HTTP_TOTAL_TIMEOUT
+from http_client import HTTP_CLIENT
+from utils import read_book_response, get_response_filename, format_size
+from format_availability import FormatAvailabilityCache
+from partial_downloads import PartialDownloads, get_range_start, get_validator
+
+MIRROR_CLOSED = 'работает'
+MIRROR_OPEN = 'отключено'
+MIRROR_HALF_OPEN = 'проверка'
+
+# Вес нового замера в скользящем среднем времени ответа
+LATENCY_SMOOTHING = 0.3
+# Ответы сайта, означающие, что книги в запрошенном формате нет
+MISSING_BOOK_STATUSES = (404, 410)
+# Ответы зеркала, означающие, что оно сейчас не отдаёт книги (доступ запрещён, слишком много запросов):
+# запрос повторяется на другом зеркале, как при ошибке сервера
+MIRROR_REFUSED_STATUSES = (403, 429)
+# Ответ сайта на запрос Range за пределами файла: сохранённая часть не подходит
+RANGE_NOT_SATISFIABLE = 416
+
+
+class MirrorsUnavailableError(Exception):
+    """Ни одно зеркало сайта не ответило"""
+
+
+class Mirror:
+    """Зеркало сайта: время ответа и состояние автоматического отключения"""
+
+    def __init__(self, url):
+        self.url = url
+        self.host = urlparse(url).hostname
+        self.latency = None            # скользящее среднее времени ответа в секундах
+        self.state = MIRROR_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False           # идёт проверочный запрос к отключённому зеркалу
+        self.successes = 0
+        self.failures = 0
+        self.last_error = None
+
+    def is_available(self, now):
+        """Можно ли отправить запрос: зеркало работает или пора проверить отключённое"""
+        if self.state == MIRROR_OPEN and now - self.opened_at >= MIRROR_OPEN_TIME:
+            self.state = MIRROR_HALF_OPEN
+        if self.state == MIRROR_HALF_OPEN:
+            # Пока идёт проверочный запрос, остальные зеркало не используют
+            return not self.probing
+        return self.state == MIRROR_CLOSED
+
+    def record_success(self, latency):
+        self.latency = latency if self.latency is None else \
+            self.latency + LATENCY_SMOOTHING * (latency - self.latency)
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.state = MIRROR_CLOSED
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = error
+        if self.state == MIRROR_HALF_OPEN or self.consecutive_failures >= MIRROR_FAILURE_THRESHOLD:
+            if self.state != MIRROR_OPEN:
+                print(f"Зеркало {self.host} отключено на {MIRROR_OPEN_TIME} с: {error}")
+            self.state = MIRROR_OPEN
+            self.opened_at = time.monotonic()
+
+
+class MirrorPool:
+    """
+    Скачивание книг с зеркал сайта.
+    Запрос уходит на самое быстрое работающее зеркало; при сетевой ошибке, ошибке сервера или отказе (403, 429)
+    повторяется на следующем с нарастающей паузой. Зеркало, ошибающееся раз за разом, отключается на время,
+    поэтому запросы к недоступному сайту не ждут таймаутов, а сразу идут на другие зеркала или завершаются ошибкой.
+    Наличие книги в формате запоминается: заведомо отсутствующий формат повторно не запрашивается.
+    Оборвавшееся скачивание докачивается с того места, где прервалось (если сайт поддерживает Range);
+    попытки, на которых книга докачивалась, в число повторов не входят, но все повторы укладываются в общий срок.
+    """
+
+    def __init__(self, urls=FLIBUSTA_MIRRORS, retries=MIRROR_RETRIES, backoff_ms=MIRROR_RETRY_BACKOFF_MS,
+                 availability=None, partials=None, deadline=MIRROR_DOWNLOAD_DEADLINE):
+        self.mirrors = [Mirror(url) for url in urls]
+        self.retries = max(1, retries)
+        self.backoff_ms = backoff_ms
+        self.availability = availability or FormatAvailabilityCache()
+        self.partials = partials or PartialDownloads()
+        self.deadline = deadline
+        self._fast_failures = 0
+        self._stats = {'retries': 0, 'deadline_exceeded': 0, 'resumed': 0, 'bytes_saved': 0, 'restarted': 0}
+
+    def get_candidates(self):
+        """Доступные зеркала: сначала ещё не опрошенные, затем по возрастанию времени ответа"""
+        now = time.monotonic()
+        available = [mirror for mirror in self.mirrors if mirror.is_available(now)]
+        return sorted(available, key=lambda mirror: mirror.latency or 0.0)
+
+    def get_preferred_host(self):
+        """Сайт, с которого сейчас скорее всего будет скачана книга"""
+        candidates = [mirror for mirror in self.mirrors if mirror.state == MIRROR_CLOSED]
+        if candidates:
+            return min(candidates, key=lambda mirror: mirror.latency or 0.0).host
+        return self.mirrors[0].host
+
+    async def _download(self, mirror, path, max_size, resumable=False, timeout=None):
+        """
+        Один запрос к зеркалу
+        :param resumable: тело ответа сохраняется как часть книги и при обрыве докачивается следующим запросом
+        """
+        session = HTTP_CLIENT.get_session()
+        partial = self.partials.get(path) if resumable else None
+        headers = {'Range': f"bytes={partial['size']}-", 'If-Range': partial['validator']} if partial else None
+        started_at = time.monotonic()
+        async with session.get(f"{mirror.url}{path}", headers=headers, timeout=timeout) as response:
+            if response.status >= 500 or response.status in MIRROR_REFUSED_STATUSES:
+                raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                  status=response.status, message=response.reason)
+            mirror.record_success(time.monotonic() - started_at)
+            if response.status in (200, 206):
+                self.availability.set(path, True)
+                if resumable:
+                    return await self._read_resumable(response, path, partial, max_size)
+                return await read_book_response(response, max_size)
+            if response.status in MISSING_BOOK_STATUSES:
+                # Зеркало ответило, что книги в этом формате нет
+                self.availability.set(path, False)
+            if response.status != RANGE_NOT_SATISFIABLE or partial is None:
+                return None, None
+        # Сохранённая часть не подходит к файлу на сайте - скачиваем заново
+        self.partials.drop(path)
+        self._stats['restarted'] += 1
+        return await self._download(mirror, path, max_size, resumable, timeout)
+
+    async def _read_resumable(self, response, path, partial, max_size):
+        """
+        Читает тело ответа в файл части книги: ответ 206 дописывается к сохранённой части,
+        ответ 200 (сайт не поддерживает Range или книга изменилась) пишется с начала.
+        Если сайт не сообщает версию файла и не поддерживает Range, книга читается как обычно, без сохранения части
+        :return: (файл с книгой, оригинальное имя файла) или (None, None), если книга больше max_size
+        """
+        offset = 0
+        if response.status == 206:
+            offset = get_range_start(response)
+            if partial is None or offset != partial['size']:
+                # Сайт вернул не ту часть, которую просили: следующая попытка скачает книгу заново
+                self.partials.drop(path)
+                content_range = response.headers.get('Content-Range')
+                raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status,
+                                                  message=f"неожиданный Content-Range: {content_range}")
+        elif partial is not None:
+            self._stats['restarted'] += 1
+
+        validator = get_validator(response)
+        if not offset and (not validator or response.headers.get('Accept-Ranges', '').lower() != 'bytes'):
+            self.partials.drop(path)
+            return await read_book_response(response, max_size)
+
+        if response.content_length and offset + response.content_length > max_size:
+            print(f"Книга {response.url} слишком большая: {format_size(offset + response.content_length)}")
+            self.partials.drop(path)
+            return None, None
+
+        filename = get_response_filename(response) or (partial or {}).get('filename')
+        book_file = self.partials.open(path, offset, validator or partial['validator'], filename)
+        try:
+            downloaded = offset
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                downloaded += len(chunk)
+                if downloaded > max_size:
+                    print(f"Книга {response.url} слишком большая: больше {format_size(max_size)}")
+                    book_file.close()
+                    self.partials.drop(path)
+                    return None, None
+                book_file.write(chunk)
+        except BaseException:
+            # Полученная часть остаётся на диске для докачки
+            book_file.close()
+            raise
+
+        if offset:
+            self._stats['resumed'] += 1
+            self._stats['bytes_saved'] += offset
+        return self.partials.finish(path, book_file), filename
+
+    def is_missing(self, path):
+        """Известно, что книги в этом формате на сайте нет"""
+        return self.availability.get(path) is False
+
+    async def check_book(self, path):
+        """
+        Проверяет наличие книги в формате запросом HEAD (без скачивания) к лучшему зеркалу, без повторов
+        :return: True/False или None, если проверить не удалось
+        """
+        candidates = [mirror for mirror in self.get_candidates() if mirror.state == MIRROR_CLOSED]
+        if not candidates:
+            return None
+        try:
+            session = HTTP_CLIENT.get_session()
+            async with session.head(f"{candidates[0].url}{path}", allow_redirects=True) as response:
+                if response.status == 200:
+                    available = True
+                elif response.status in MISSING_BOOK_STATUSES:
+                    available = False
+                else:
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # Предварительная проверка необязательна - ошибки не влияют на состояние зеркала
+            return None
+        self.availability.set(path, available, probe=True)
+        return available
+
+    async def download_book(self, path, max_size=DOWNLOAD_MAX_SIZE):
+        """
+        Скачивает книгу с зеркал
+        :param path: путь на сайте, например /b/123/fb2
+        :return: (временный файл с книгой, оригинальное имя файла) или (None, None), если книги нет
+        :raises MirrorsUnavailableError: все зеркала отключены или не ответили
+        """
+        if self.is_missing(path):
+            return None, None
+
+        deadline = time.monotonic() + self.deadline
+        resumable = self.partials.acquire(path)
+        failed = set()
+        attempt, failures = 0, 0
+        try:
+            while failures < self.retries:
+                candidates = self.get_candidates()
+                # Сначала пробуем зеркала, которые ещё не ошиблись в этом запросе
+                untried = [mirror for mirror in candidates if mirror.url not in failed]
+                candidates = untried or candidates
+                if not candidates:
+                    self._fast_failures += 1
+                    raise MirrorsUnavailableError("все зеркала временно отключены")
+
+                if attempt:
+                    delay = self.backoff_ms * 2 ** (failures - 1) / 1000 if failures else 0
+                    if time.monotonic() + delay >= deadline:
+                        self._stats['deadline_exceeded'] += 1
+                        raise MirrorsUnavailableError(f"книга не скачана за {self.deadline} с")
+                    await asyncio.sleep(delay)
+                    self._stats['retries'] += 1
+                attempt += 1
+
+                # Запрос не должен выйти за общий срок скачивания
+                timeout = aiohttp.ClientTimeout(total=min(HTTP_TOTAL_TIMEOUT, deadline - time.monotonic()),
+                                                connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+                mirror = candidates[0]
+                mirror.probing = mirror.state == MIRROR_HALF_OPEN
+                saved_before = self._get_saved_size(path, resumable)
+                try:
+                    return await self._download(mirror, path, max_size, resumable, timeout)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = str(e) or type(e).__name__
+                    print(f"Ошибка скачивания {path} с зеркала {mirror.host}: {error}")
+                    # Попытка, на которой часть книги докачалась, не считается ни повтором, ни ошибкой зеркала:
+                    # иначе обрывы при докачке отключили бы единственное зеркало раньше общего срока
+                    if self._get_saved_size(path, resumable) <= saved_before:
+                        mirror.record_failure(error)
+                        failed.add(mirror.url)
+                        failures += 1
+                finally:
+                    mirror.probing = False
+        finally:
+            if resumable:
+                self.partials.release(path)
+
+        raise MirrorsUnavailableError(f"зеркала не ответили за {self.retries} попыток")
+
+    def _get_saved_size(self, path, resumable):
+        """Сколько байт книги уже сохранено для докачки"""
+        partial = self.partials.get(path) if resumable else None
+        return partial['size'] if partial else 0
+
+    def get_stats(self):
+        """Возвращает состояние зеркал"""
+        return {
+            'fast_failures': self._fast_failures,
+            'retries': self._stats['retries'],
+            'deadline_exceeded': self._stats['deadline_exceeded'],
+            'resumed': self._stats['resumed'],
+            'bytes_saved': self._stats['bytes_saved'],
+            'restarted': self._stats['restarted'],
+            'partials': self.partials.get_stats(),
+            'availability': self.availability.get_stats(),
+            'mirrors': [
+                {
+                    'host': mirror.host,
+                    'state': mirror.state,
+                    'latency_ms': round(mirror.latency * 1000) if mirror.latency is not None else None,
+                    'successes': mirror.successes,
+                    'failures': mirror.failures,
+                    'consecutive_failures': mirror.consecutive_failures,
+                    'last_error': mirror.last_error
+                }
+                for mirror in self.mirrors
+            ]
+        }
+
+
+MIRRORS = MirrorPool()
@@ -0,0 +1,131 @@
+import json
+import os
+import re
+import time
+
+from constants import DOWNLOAD_PARTIAL_PATH, DOWNLOAD_PARTIAL_TTL
+
+# Начало части в заголовке ответа на запрос Range: "bytes 1000-4999/5000"
+CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+(\d+)-\d+/(\d+|\*)', re.IGNORECASE)
+
+
+def get_range_start(response):
+    """С какого байта начинается тело ответа 206 (None - заголовок Content-Range не распознан)"""
+    range_match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+    return int(range_match.group(1)) if range_match else None
+
+
+def get_validator(response):
+    """Признак версии файла на сайте (ETag или Last-Modified) для заголовка If-Range"""
+    return response.headers.get('ETag') or response.headers.get('Last-Modified')
+
+
+class PartialDownloads:
+    """
+    Недокачанные с сайта книги: при обрыве скачивания полученная часть остаётся на диске (в каталоге кэша скачиваний),
+    и следующая попытка запрашивает у сайта только недостающие байты (Range).
+    Рядом с частью хранится признак версии файла: если книга на сайте изменилась, сайт вернёт её целиком.
+    Части, которые долго не продолжали, удаляются.
+    Одну книгу одновременно докачивает только одно скачивание - остальные скачивают её как обычно.
+    """
+
+    def __init__(self, path=DOWNLOAD_PARTIAL_PATH, ttl=DOWNLOAD_PARTIAL_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._busy = set()
+        if self.enabled:
+            os.makedirs(self.path, exist_ok=True)
+            self.cleanup()
+
+    @property
+    def enabled(self):
+        return bool(self.path) and self.ttl > 0
+
+    def _get_paths(self, key):
+        """Файлы части и её описания: /b/123/fb2 -> b_123_fb2.part, b_123_fb2.json"""
+        name = os.path.join(self.path, key.strip('/').replace('/', '_'))
+        return f"{name}.part", f"{name}.json"
+
+    def acquire(self, key):
+        """Занимает часть книги для скачивания; False - докачка выключена или книгу уже скачивают"""
+        if not self.enabled or key in self._busy:
+            return False
+        self._busy.add(key)
+        return True
+
+    def release(self, key):
+        self._busy.discard(key)
+
+    def get(self, key):
+        """
+        Сохранённая часть книги
+        :return: {'size': сколько байт скачано, 'validator': ..., 'filename': ...} или None
+        """
+        data_path, meta_path = self._get_paths(key)
+        try:
+            with open(meta_path, encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+            stat = os.stat(data_path)
+        except (OSError, ValueError):
+            return None
+        if not stat.st_size or time.time() - stat.st_mtime > self.ttl or not meta.get('validator'):
+            self.drop(key)
+            return None
+        return dict(meta, size=stat.st_size)
+
+    def open(self, key, offset, validator, filename):
+        """
+        Открывает файл части для записи с позиции offset (0 - книга скачивается заново)
+        :return: файл, в который дописывается тело ответа
+        """
+        if not offset:
+            self.cleanup()
+        data_path, meta_path = self._get_paths(key)
+        with open(meta_path, 'w', encoding='utf-8') as meta_file:
+            json.dump({'validator': validator, 'filename': filename}, meta_file)
+        book_file = open(data_path, 'r+b' if offset else 'wb')
+        book_file.truncate(offset)
+        book_file.seek(offset)
+        return book_file
+
+    def finish(self, key, book_file):
+        """
+        Книга скачана целиком: файлы части удаляются из каталога, а открытый файл отдаётся вызывающему
+        :return: файл с книгой, установленный на начало; закрывает вызывающий
+        """
+        book_file.seek(0)
+        self.drop(key)
+        return book_file
+
+    def drop(self, key):
+        for file_path in self._get_paths(key):
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+    def cleanup(self):
+        """Удаляет части (и их описания), которые давно не продолжали"""
+        if not self.enabled:
+            return
+        now = time.time()
+        for file_name in os.listdir(self.path):
+            file_path = os.path.join(self.path, file_name)
+            try:
+                if now - os.stat(file_path).st_mtime > self.ttl:
+                    os.remove(file_path)
+            except OSError:
+                pass
+
+    def get_stats(self):
+        """Количество и общий размер сохранённых частей"""
+        files, size = 0, 0
+        if self.enabled:
+            for file_name in os.listdir(self.path):
+                if file_name.endswith('.part'):
+                    try:
+                        size += os.path.getsize(os.path.join(self.path, file_name))
+                        files += 1
+                    except OSError:
+                        pass
+        return {'enabled': self.enabled, 'files': files, 'size': size, 'ttl': self.ttl}
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from constants import FLIBUSTA_DB_BOOKS_PATH, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
+
+
+class SearchCache:
+    """
+    Общий для всех пользователей кэш результатов поиска.
+    Ограничен по размеру (вытесняются давно не запрошенные записи) и по времени жизни записи.
+    Одинаковые одновременные запросы ждут одно выполнение, а не запускают поиск повторно.
+    Кэш сбрасывается, когда меняется файл БД библиотеки.
+    """
+
+    def __init__(self, db_path=FLIBUSTA_DB_BOOKS_PATH, max_size=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # ключ -> (время истечения, результат)
+        self._in_flight = {}           # ключ -> задача, выполняющая поиск
+        self._db_signature = self._get_db_signature()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def make_query_key(query):
+        """Приводит текст запроса к каноническому виду: регистр и лишние пробелы на результат не влияют"""
+        return ' '.join(query.split()).lower()
+
+    def _get_db_signature(self):
+        """Время изменения и размер файла БД библиотеки"""
+        try:
+            stat = os.stat(self.db_path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _check_db_file(self):
+        """Сбрасывает кэш, если файл БД библиотеки изменился"""
+        signature = self._get_db_signature()
+        if signature != self._db_signature:
+            self._db_signature = signature
+            self.clear()
+            self._invalidations += 1
+            print("Файл БД библиотеки изменился, кэш поиска сброшен")
+
+    def clear(self):
+        """Удаляет все записи кэша"""
+        self._entries.clear()
+        # Выполняющиеся запросы не отменяем, но их результаты в кэш уже не попадут
+        self._in_flight.clear()
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _on_done(self, key, signature, task):
+        """Сохраняет результат завершившегося поиска"""
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+            if not task.cancelled() and task.exception() is None and signature == self._db_signature:
+                self._store(key, task.result())
+
+    async def get_or_compute(self, key, compute):
+        """
+        Возвращает результат из кэша или выполняет поиск
+        :param key: ключ запроса (хешируемый)
+        :param compute: функция без аргументов, возвращающая корутину поиска
+        """
+        if self.max_size <= 0:
+            return await compute()
+
+        self._check_db_file()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return value
+            del self._entries[key]
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._coalesced += 1
+        else:
+            self._misses += 1
+            task = asyncio.ensure_future(compute())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t, signature=self._db_signature: self._on_done(key, signature, t))
+
+        # shield: отмена одного из ожидающих не должна прерывать поиск для остальных
+        return await asyncio.shield(task)
+
+    def get_stats(self):
+        """Возвращает статистику кэша"""
+        requests_count = self._hits + self._misses + self._coalesced
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self._hits,
+            'misses': self._misses,
+            'coalesced': self._coalesced,
+            'invalidations': self._invalidations,
+            'hit_rate': round((self._hits + self._coalesced) / requests_count * 100, 1) if requests_count else 0
+        }
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import FLIBUSTA_DB_BOOKS_PATH, SEARCH_POOL_SIZE, SEARCH_COUNT_LIMIT
+from database import DatabaseBooks
+from search_cache import SearchCache
+
+
+class BooksSearchPool:
+    """
+    Асинхронный фасад над DatabaseBooks.
+    Запросы выполняются в ограниченном пуле потоков, чтобы медленный поиск не останавливал цикл событий бота.
+    У каждого потока пула своё соединение с БД библиотеки только для чтения.
+    Результаты поиска кэшируются общим для всех пользователей кэшем.
+    """
+
+    def __init__(self, db_path=FLIBUSTA_DB_BOOKS_PATH, pool_size=SEARCH_POOL_SIZE):
+        self.db_path = db_path
+        self.pool_size = max(1, pool_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='books_search')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = 0    # Отправлено в пул и ещё не завершено
+        self._running = 0    # Выполняется потоками прямо сейчас
+        self._completed = 0  # Всего выполнено запросов
+        self.cache = SearchCache(db_path)
+
+    def _get_db(self):
+        """Возвращает соединение с БД текущего потока пула (создаётся при первом обращении)"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = DatabaseBooks(self.db_path, read_only=True)
+            self._local.db = db
+        return db
+
+    def _call(self, method_name, args):
+        """Выполняет метод DatabaseBooks в потоке пула"""
+        with self._lock:
+            self._running += 1
+        try:
+            return getattr(self._get_db(), method_name)(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    async def _run(self, method_name, *args):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._pending += 1
+        try:
+            return await loop.run_in_executor(self._executor, self._call, method_name, args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def _run_cached(self, key, method_name, *args):
+        """Выполняет метод DatabaseBooks в пуле через общий кэш результатов"""
+        return await self.cache.get_or_compute(key, lambda: self._run(method_name, *args))
+
+    @staticmethod
+    def _make_filters_key(lang, size_limit, rating_filter):
+        """Часть ключа кэша с настройками пользователя (None и пустая строка равнозначны)"""
+        return lang or '', size_limit or '', rating_filter or ''
+
+    async def search_books(self, query, max_books, lang, sort_order, size_limit, rating_filter=None):
+        """Асинхронный аналог DatabaseBooks.search_books"""
+        key = ('books', SearchCache.make_query_key(query), max_books, str(sort_order).upper(),
+               *self._make_filters_key(lang, size_limit, rating_filter))
+        return await self._run_cached(key, 'search_books', query, max_books, lang, sort_order, size_limit,
+                                      rating_filter)
+
+    async def search_books_page(self, query, page_size, lang, sort_order, size_limit, rating_filter=None,
+                                count_limit=SEARCH_COUNT_LIMIT):
+        """Асинхронный аналог DatabaseBooks.search_books_page"""
+        key = ('books_page', SearchCache.make_query_key(query), page_size, str(sort_order).upper(), count_limit,
+               *self._make_filters_key(lang, size_limit, rating_filter))
+        return await self._run_cached(key, 'search_books_page', query, page_size, lang, sort_order, size_limit,
+                                      rating_filter, count_limit)
+
+    async def fetch_books_page(self, books_query, page_size, after=None, before=None, from_end=False):
+        """Асинхронный аналог DatabaseBooks.fetch_books_page"""
+        # Скомпилированный запрос уже учитывает все настройки поиска
+        key = ('page', books_query, page_size, after, before, from_end)
+        return await self._run_cached(key, 'fetch_books_page', books_query, page_size, after, before, from_end)
+
+    async def get_book_card(self, file_name):
+        """Асинхронный аналог DatabaseBooks.get_book_card (без кэша: выборка одной книги по индексу)"""
+        return await self._run('get_book_card', file_name)
+
+    async def get_book_size(self, file_name):
+        """Асинхронный аналог DatabaseBooks.get_book_size"""
+        return await self._run('get_book_size', file_name)
+
+    async def search_series(self, query, max_books, lang, size_limit, rating_filter=None):
+        """Асинхронный аналог DatabaseBooks.search_series"""
+        # max_books в ключ не входит: серии выбираются целиком
+        key = ('series', SearchCache.make_query_key(query), *self._make_filters_key(lang, size_limit, rating_filter))
+        return await self._run_cached(key, 'search_series', query, max_books, lang, size_limit, rating_filter)
+
+    def get_queue_depth(self):
+        """Количество запросов, ожидающих свободного потока"""
+        with self._lock:
+            return max(0, self._pending - self._running)
+
+    def get_stats(self):
+        """Возвращает статистику пула поиска"""
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'running': self._running,
+                'queue_depth': max(0, self._pending - self._running),
+                'completed': self._completed
+            }
+
+    def close(self):
+        """Останавливает пул потоков"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+from constants import DOWNLOAD_SPOOL_SIZE, DOWNLOAD_CHUNK_SIZE
+
+
+class SeriesZip:
+    """
+    Один zip со всеми книгами серии. Книги дописываются в него по мере скачивания,
+    архив пишется во временный файл (небольшой - в памяти, большой - на диске), а не собирается в памяти целиком.
+    Методы блокирующие - из цикла событий их вызывают через asyncio.to_thread и по одному.
+    """
+
+    def __init__(self, spool_size=DOWNLOAD_SPOOL_SIZE):
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self._zip = zipfile.ZipFile(self.file, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.books_count = 0
+
+    def add_book(self, prefix, book_file, file_name):
+        """
+        Дописывает книгу в архив. Книга в zip (fb2 с сайта и из локальных архивов) распаковывается,
+        остальные файлы (epub, mobi - уже сжатые) добавляются без повторного сжатия
+        :param prefix: начало имён файлов книги в архиве (номер книги в серии)
+        """
+        book_file.seek(0)
+        if file_name.lower().endswith('.zip') and zipfile.is_zipfile(book_file):
+            book_file.seek(0)
+            with zipfile.ZipFile(book_file) as book_zip:
+                for member in book_zip.infolist():
+                    if member.is_dir():
+                        continue
+                    with book_zip.open(member) as source, \
+                            self._zip.open(f"{prefix}{os.path.basename(member.filename)}", 'w') as target:
+                        shutil.copyfileobj(source, target, DOWNLOAD_CHUNK_SIZE)
+        else:
+            book_file.seek(0)
+            member = zipfile.ZipInfo(f"{prefix}{os.path.basename(file_name)}", time.localtime()[:6])
+            member.compress_type = zipfile.ZIP_STORED
+            with self._zip.open(member, 'w') as target:
+                shutil.copyfileobj(book_file, target, DOWNLOAD_CHUNK_SIZE)
+        self.books_count += 1
+
+    def finish(self):
+        """
+        Дописывает каталог архива
+        :return: размер архива; файл установлен на начало для отправки
+        """
+        self._zip.close()
+        size = self.file.seek(0, os.SEEK_END)
+        self.file.seek(0)
+        return size
+
+    def close(self):
+        self._zip.close()
+        self.file.close()
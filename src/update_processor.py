@@ -0,0 +1,50 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class UserMessagesUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений, при которой сообщения одного пользователя в одном чате обрабатываются
+    по очереди: на сообщениях построен диалог входа администратора (ConversationHandler), и его состояние
+    не должно меняться двумя сообщениями одновременно. Нажатия кнопок (в том числе долгие отправки книг)
+    по-прежнему обрабатываются параллельно.
+    Ожидающее своей очереди сообщение не занимает место в общем лимите одновременных обновлений.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # (чат, пользователь) -> [блокировка, сколько обновлений её ждут или держат]
+
+    @staticmethod
+    def _get_key(update):
+        """Ключ очереди для сообщения пользователя или None, если обновление можно обрабатывать сразу"""
+        if not isinstance(update, Update) or update.message is None or update.effective_user is None:
+            return None
+        return update.effective_chat.id if update.effective_chat else None, update.effective_user.id
+
+    async def process_update(self, update, coroutine):
+        key = self._get_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
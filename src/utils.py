@@ -1,8 +1,12 @@
+import codecs
 import os
 import re
 import sys
+import tempfile
 import xml.etree.ElementTree as ET
 import base64
+import zipfile
+from io import BytesIO
 from urllib.parse import unquote #, urljoin, quote
 import aiohttp
 import chardet
@@ -10,7 +14,9 @@ import chardet
 import importlib.util
 from typing import List, Dict, Any
 
-from constants import CRITERIA_PATTERN, CRITERIA_PATTERN_SERIES_QUOTED, FLIBUSTA_DB_BOOKS_PATH  # FLIBUSTA_BASE_URL
+from constants import CRITERIA_PATTERN, CRITERIA_PATTERN_SERIES_QUOTED, FLIBUSTA_DB_BOOKS_PATH, \
+    DOWNLOAD_SPOOL_SIZE, DOWNLOAD_MAX_SIZE, DOWNLOAD_CHUNK_SIZE, COVER_FILE_FORMAT  # FLIBUSTA_BASE_URL
+from http_client import HTTP_CLIENT
 
 #from html import unescape
 #from constants import FLIBUSTA_BASE_URL
@@ -19,6 +25,10 @@ from constants import CRITERIA_PATTERN, CRITERIA_PATTERN_SERIES_QUOTED, FLIBUSTA
 FB2_NAMESPACE = "http://www.gribuser.ru/xml/fictionbook/2.0"
 XLINK_NAMESPACE = "http://www.w3.org/1999/xlink"
 
+# Кодировка из XML-декларации и сколько байт начала файла смотрим, чтобы её определить
+FB2_ENCODING_DECLARATION = re.compile(rb'\s*<\?xml[^>]*?encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+FB2_SNIFF_SIZE = 64 * 1024
+
 # Словарь с пространствами имен для использования в XPath
 NAMESPACES = {
     "fb": FB2_NAMESPACE,
@@ -211,115 +221,138 @@ def extract_criteria(text):
 
     return results
 
-def extract_cover_from_fb2(file):
+def detect_fb2_encoding(head):
+    """
+    Кодировка fb2 по началу файла: BOM, затем XML-декларация, затем проверка на UTF-8 и только потом chardet
+    :return: (кодировка, объявлена ли она в самом файле)
+    """
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8', True
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16', True
+    declaration = FB2_ENCODING_DECLARATION.match(head)
+    if declaration:
+        return declaration.group(1).decode('ascii').lower(), True
     try:
-        # парсим FB2 файл
-        tree = ET.parse(file)
-        root = tree.getroot()
-
-        # Находим ссылку на обложку
-        cover_element = root.find(".//fb:coverpage/fb:image", namespaces=NAMESPACES)
-        if cover_element is None:
-            raise ValueError("Обложка не найдена в FB2-файле.")
-
-        cover_href = cover_element.get(f"{{{XLINK_NAMESPACE}}}href")
-        cover_id = cover_href.lstrip("#")  # Убираем символ "#"
-
-        # Находим бинарные данные обложки
-        binary_element = root.find(f".//fb:binary[@id='{cover_id}']", namespaces=NAMESPACES)
-        if binary_element is None:
-            raise ValueError(f"Бинарные данные для обложки с id '{cover_id}' не найдены.")
-
-        binary_data = binary_element.text
-        if not binary_data:
-            raise ValueError("Бинарные данные обложки пусты.")
-
-        # Декодируем Base64 в байтовый объект
-        cover_bytes = base64.b64decode(binary_data)
-        return cover_bytes
-    except Exception as e:
-        print(f"Ошибка при извлечении обложки: {e}")
+        # Незавершённый многобайтовый символ на границе прочитанного куска ошибкой не считается
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+        return 'utf-8', False
+    except UnicodeDecodeError:
+        return chardet.detect(head)['encoding'] or 'windows-1251', False
+
+
+def _extract_fb2_metadata(description):
+    """Метаданные книги из элемента description"""
+    def find_text(path):
+        element = description.find(path, namespaces=NAMESPACES)
+        return element.text if element is not None else None
+
+    return {
+        "title": find_text(".//fb:book-title"),
+        "author": {
+            "first_name": find_text(".//fb:author/fb:first-name"),
+            "last_name": find_text(".//fb:author/fb:last-name"),
+        },
+        "publisher": find_text(".//fb:publish-info/fb:publisher"),
+        "year": find_text(".//fb:publish-info/fb:year"),
+        "city": find_text(".//fb:publish-info/fb:city"),
+        "isbn": find_text(".//fb:publish-info/fb:isbn"),
+        "annotation": _extract_fb2_annotation(description),
+    }
+
+
+def _extract_fb2_annotation(description):
+    """Текст аннотации книги: абзацы через перевод строки"""
+    annotation = description.find(".//fb:title-info/fb:annotation", namespaces=NAMESPACES)
+    if annotation is None:
         return None
-    finally:
-        file.seek(0)
+    paragraphs = [' '.join(''.join(paragraph.itertext()).split()) for paragraph in (list(annotation) or [annotation])]
+    text = '\n'.join(paragraph for paragraph in paragraphs if paragraph)
+    return text or None
 
-def extract_metadata_from_fb2(file):
+
+def parse_fb2(file, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Извлекает из fb2 обложку и метаданные за один проход.
+    Файл читается частями, дерево целиком не строится: разобранные элементы текста книги сразу удаляются,
+    а чтение прекращается, как только получены описание книги и двоичные данные обложки.
+    :return: (байты обложки или None, словарь метаданных или None)
+    """
+    cover_bytes, metadata = None, None
     try:
-        ## Парсим XML из байтов
-        #tree = ET.parse(file)
-        #root = ET.parse(file).getroot()
-
-        # Пытаемся прочитать файл с автоматическим определением кодировки
-        content = file.read()
-
-        # Определяем кодировку (если не UTF-8)
-        try:
-            xml_content = content.decode('utf-8')
-        except UnicodeDecodeError:
-            encoding = chardet.detect(content)['encoding'] or 'windows-1251'
-            xml_content = content.decode(encoding, errors='replace')
-
-        # Парсим XML с обработкой ошибок
-        try:
-            root = ET.fromstring(xml_content)
-        except ET.ParseError:
-            # Пробуем починить битый XML (базовый случай)
-            xml_content = xml_content.split('<?xml', 1)[-1]  # Удаляем все до <?xml
-            xml_content = '<?xml' + xml_content.split('>', 1)[0] + '>' + xml_content.split('>', 1)[1]
-            root = ET.fromstring(xml_content)
-
-        # Извлекаем метаданные
-        metadata = {
-            "title": None,
-            "author": {
-                "first_name": None,
-                "last_name": None,
-            },
-            "publisher": None,
-            "year": None,
-            "city": None,
-            "isbn": None,
-        }
-
-        # Название книги
-        title_element = root.find(".//fb:book-title", namespaces=NAMESPACES)
-        if title_element is not None:
-            metadata["title"] = title_element.text
-
-        # Автор
-        first_name_element = root.find(".//fb:author/fb:first-name", namespaces=NAMESPACES)
-        if first_name_element is not None:
-            metadata["author"]["first_name"] = first_name_element.text
-
-        last_name_element = root.find(".//fb:author/fb:last-name", namespaces=NAMESPACES)
-        if last_name_element is not None:
-            metadata["author"]["last_name"] = last_name_element.text
-
-        # Издательство
-        publisher_element = root.find(".//fb:publish-info/fb:publisher", namespaces=NAMESPACES)
-        if publisher_element is not None:
-            metadata["publisher"] = publisher_element.text
-
-        # Год издания
-        year_element = root.find(".//fb:publish-info/fb:year", namespaces=NAMESPACES)
-        if year_element is not None:
-            metadata["year"] = year_element.text
-
-        # Город
-        city_element = root.find(".//fb:publish-info/fb:city", namespaces=NAMESPACES)
-        if city_element is not None:
-            metadata["city"] = city_element.text
-
-        # ISBN
-        isbn_element = root.find(".//fb:publish-info/fb:isbn", namespaces=NAMESPACES)
-        if isbn_element is not None:
-            metadata["isbn"] = isbn_element.text
-        return metadata
+        head = file.read(FB2_SNIFF_SIZE)
+        encoding, declared = detect_fb2_encoding(head)
+        # Кодировку из декларации expat применяет сам; без декларации он ждёт UTF-8 - остальное перекодируем
+        decoder = None if declared or encoding == 'utf-8' else \
+            codecs.getincrementaldecoder(encoding)(errors='replace')
+        # Мусор перед началом XML (встречается в битых файлах) expat не принимает. Файлы с BOM и декларацией
+        # начинаются с них, а в UTF-16 байт '<' идёт в паре с нулевым - такие файлы не обрезаем
+        if decoder is None and not declared and b'<' in head:
+            head = head[head.find(b'<'):]
+
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        description_tag = f"{{{FB2_NAMESPACE}}}description"
+        binary_tag = f"{{{FB2_NAMESPACE}}}binary"
+        root, depth, in_description, cover_id = None, 0, False, None
+
+        raw = head
+        while True:
+            data = raw if decoder is None else decoder.decode(raw, final=not raw)
+            if decoder is not None and raw is head and '<' in data:
+                data = data[data.find('<'):]
+            if data:
+                parser.feed(data)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    if root is None:
+                        root = element
+                    depth += 1
+                    in_description = in_description or element.tag == description_tag
+                    continue
+
+                depth -= 1
+                if element.tag == description_tag:
+                    in_description = False
+                    metadata = _extract_fb2_metadata(element)
+                    cover_element = element.find(".//fb:coverpage/fb:image", namespaces=NAMESPACES)
+                    cover_href = cover_element.get(f"{{{XLINK_NAMESPACE}}}href") if cover_element is not None else None
+                    if not cover_href:
+                        return None, metadata
+                    cover_id = cover_href.lstrip("#")
+                elif element.tag == binary_tag and cover_id is not None and element.get('id') == cover_id:
+                    if element.text:
+                        cover_bytes = base64.b64decode(element.text)
+                    return cover_bytes, metadata
+                if in_description:
+                    continue
+                # Разобранное содержимое книги больше не нужно
+                element.clear()
+                if depth == 1:
+                    root.remove(element)
+
+            if not raw:
+                break
+            raw = file.read(chunk_size)
+
+        if metadata is not None and cover_id is not None:
+            print(f"Бинарные данные для обложки с id '{cover_id}' не найдены.")
     except Exception as e:
-        print(f"Ошибка при извлечении метаданных: {e}")
-        return None
-    finally:
-        file.seek(0)
+        print(f"Ошибка при разборе FB2: {e}")
+    return cover_bytes, metadata
+
+
+def parse_fb2_zip(zip_source):
+    """
+    Разбирает все fb2 из zip-архива книги (для выполнения в отдельном процессе)
+    :param zip_source: байты архива или путь к нему на диске
+    :return: список (байты обложки, метаданные) по файлам архива
+    """
+    with zipfile.ZipFile(BytesIO(zip_source) if isinstance(zip_source, bytes) else zip_source, 'r') as zip_file:
+        results = []
+        for file_info in zip_file.infolist():
+            with zip_file.open(file_info) as fb2_file:
+                results.append(parse_fb2(fb2_file))
+        return results
 
 def format_metadata_message(metadata):
     if metadata:
@@ -342,6 +375,38 @@ def format_metadata_message(metadata):
         message = None
     return message
 
+
+async def send_book_metadata(parser, db_cache, book_file, send_photo, send_text, book_id=None):
+    """
+    Отправляет обложку и описание fb2 (разбор выполняется в пуле процессов) и запоминает их file_id
+    :param send_photo: отправка фото, например message.reply_photo или partial(bot.send_photo, chat_id)
+    :param send_text: отправка текста, например message.reply_text или partial(bot.send_message, chat_id)
+    """
+    try:
+        parsed_files = await parser.parse(book_file)
+    except Exception as e:
+        print(f"Ошибка разбора книги {book_id}: {e}")
+        return
+
+    for cover_bytes, metadata in parsed_files:
+        caption = format_metadata_message(metadata)
+
+        cover_file_id = None
+        if cover_bytes:
+            sent_message = await send_photo(
+                photo=cover_bytes,
+                caption=caption or "",
+                disable_notification=True
+            )
+            cover_file_id = sent_message.photo[-1].file_id if sent_message.photo else None
+        elif caption:
+            await send_text(caption, disable_notification=True)
+
+        # Запоминаем обложку и описание, даже если их нет, чтобы при повторной отправке не разбирать книгу
+        if book_id is not None:
+            db_cache.save_telegram_file(book_id, COVER_FILE_FORMAT, cover_file_id, caption=caption)
+
+
 def remove_punctuation(text):
     if text is None:
         return None
@@ -405,46 +470,61 @@ def get_platform_recommendations() -> str:
 
 # ===== СЛУЖЕБНЫЕ ФУНКЦИИ =====
 
-async def download_book_with_filename(url: str):
-    """Скачивает книгу и возвращает данные + оригинальное имя файла"""
+async def read_book_response(response, max_size: int = DOWNLOAD_MAX_SIZE):
+    """
+    Читает тело успешного ответа частями во временный файл (в памяти держится не больше DOWNLOAD_SPOOL_SIZE)
+    :return: (временный файл с книгой, оригинальное имя файла) или (None, None), если книга больше max_size;
+             файл закрывает вызывающий
+    """
+    if response.content_length and response.content_length > max_size:
+        print(f"Книга {response.url} слишком большая: {format_size(response.content_length)}")
+        return None, None
+
+    book_file = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    book_data = await response.read()
-                    filename = None
-
-                    content_disposition = response.headers.get('Content-Disposition', '')
-                    if content_disposition:
-                        filename_match = re.search(r'filename[^;=\n]*=([\'"]?)([^\'"\n]+)\1', content_disposition,
-                                                   re.IGNORECASE)
-                        if filename_match:
-                            filename = unquote(filename_match.group(2))
-
-                    return book_data, filename
+        downloaded = 0
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            downloaded += len(chunk)
+            if downloaded > max_size:
+                print(f"Книга {response.url} слишком большая: больше {format_size(max_size)}")
+                book_file.close()
                 return None, None
-    except Exception as e:
-        print(f"Ошибка скачивания книги: {e}")
-        return None, None
+            book_file.write(chunk)
+    except BaseException:
+        book_file.close()
+        raise
+    book_file.seek(0)
+    return book_file, get_response_filename(response)
+
+
+def get_response_filename(response):
+    """Оригинальное имя файла из заголовка Content-Disposition или None"""
+    content_disposition = response.headers.get('Content-Disposition', '')
+    if content_disposition:
+        filename_match = re.search(r'filename[^;=\n]*=([\'"]?)([^\'"\n]+)\1', content_disposition,
+                                   re.IGNORECASE)
+        if filename_match:
+            return unquote(filename_match.group(2))
+    return None
 
 
 async def upload_to_tmpfiles(file, file_name: str) -> str:
     """Загружает файл на tmpfiles.org и возвращает URL для скачивания"""
     try:
-        async with aiohttp.ClientSession() as session:
-            form_data = aiohttp.FormData()
-            form_data.add_field('file', file, filename=file_name)
-            params = {'duration': '15m'}
-
-            async with session.post(
-                    'https://tmpfiles.org/api/v1/upload',
-                    data=form_data,
-                    params=params
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result['data']['url']
-                return None
+        session = HTTP_CLIENT.get_session()
+        form_data = aiohttp.FormData()
+        form_data.add_field('file', file, filename=file_name)
+        params = {'duration': '15m'}
+
+        async with session.post(
+                'https://tmpfiles.org/api/v1/upload',
+                data=form_data,
+                params=params
+        ) as response:
+            if response.status == 200:
+                result = await response.json()
+                return result['data']['url']
+            return None
     except Exception as e:
         print(f"Ошибка загрузки: {e}")
         return None
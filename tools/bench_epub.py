@@ -0,0 +1,109 @@
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import time
+import zipfile
+from io import BytesIO
+
+import aiohttp
+
+# Добавляем путь к src в Python path: преобразование то же, что и в боте
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(project_root, 'src'))
+
+from fb2_epub import convert_fb2_zip_to_epub
+
+FLIBUSTA_DB_BOOKS_PATH = "/media/sf_FlibustaBot/data/Flibusta_FB2_local.hlc2"
+PREFIX_FILE_PATH = "/media/sf_FlibustaFiles/"
+FLIBUSTA_BASE_URL = "https://flibusta.is"
+
+# Сколько случайных fb2-книг из локальных архивов сравнивать и таймаут скачивания с сайта в секундах
+SAMPLE_SIZE = 20
+UPSTREAM_TIMEOUT = 120
+
+
+def get_sample_books(db_path, sample_size):
+    """Случайные fb2-книги из БД библиотеки: (Folder, FileName, Ext, BookSize); FileName - id книги на сайте"""
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("""
+            SELECT Folder, FileName, Ext, BookSize FROM Books
+            WHERE Ext = '.fb2' ORDER BY RANDOM() LIMIT ?
+        """, (sample_size,)).fetchall()
+
+
+def convert_local(files_path, folder, file_name, ext):
+    """Время преобразования книги из локального архива (вместе с чтением из архива) и размер EPUB"""
+    started_at = time.monotonic()
+    with zipfile.ZipFile(os.path.join(files_path, folder)) as archive:
+        fb2_data = archive.read(f"{file_name}{ext}")
+    zip_data = BytesIO()
+    with zipfile.ZipFile(zip_data, 'w', zipfile.ZIP_DEFLATED) as book_zip:
+        book_zip.writestr(f"{file_name}{ext}", fb2_data)
+    epub_bytes, _ = convert_fb2_zip_to_epub(zip_data.getvalue(), file_name)
+    return time.monotonic() - started_at, len(epub_bytes)
+
+
+async def fetch_upstream(session, base_url, book_id):
+    """Время скачивания EPUB с сайта и размер файла (None при ошибке)"""
+    started_at = time.monotonic()
+    try:
+        async with session.get(f"{base_url}/b/{book_id}/epub") as response:
+            if response.status != 200:
+                return time.monotonic() - started_at, None
+            body = await response.read()
+            return time.monotonic() - started_at, len(body)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return time.monotonic() - started_at, None
+
+
+def format_times(times):
+    if not times:
+        return "нет данных"
+    return (f"среднее {statistics.mean(times):.2f} с, медиана {statistics.median(times):.2f} с, "
+            f"макс. {max(times):.2f} с")
+
+
+async def run_benchmark(db_path=FLIBUSTA_DB_BOOKS_PATH, files_path=PREFIX_FILE_PATH, base_url=FLIBUSTA_BASE_URL,
+                        sample_size=SAMPLE_SIZE):
+    """Сравнивает время преобразования fb2 в EPUB на месте со временем скачивания EPUB с сайта"""
+    books = get_sample_books(db_path, sample_size)
+    if not books:
+        print("В БД нет fb2-книг")
+        return
+
+    local_times, upstream_times, upstream_failed = [], [], 0
+    timeout = aiohttp.ClientTimeout(total=UPSTREAM_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        print(f"{'Книга':>10} {'Размер fb2':>12} {'Локально, с':>12} {'EPUB':>10} {'Сайт, с':>10} {'EPUB':>10}")
+        for folder, file_name, ext, book_size in books:
+            try:
+                local_time, local_size = await asyncio.to_thread(convert_local, files_path, folder, file_name, ext)
+                local_times.append(local_time)
+            except Exception as e:
+                print(f"Ошибка преобразования книги {file_name}: {e}")
+                local_time, local_size = None, None
+
+            upstream_time, upstream_size = await fetch_upstream(session, base_url, file_name)
+            if upstream_size is None:
+                upstream_failed += 1
+            else:
+                upstream_times.append(upstream_time)
+
+            local_text = f"{local_time:.2f}" if local_time is not None else '-'
+            print(f"{file_name:>10} {book_size or 0:>12} {local_text:>12} {local_size or '-':>10} "
+                  f"{upstream_time:>10.2f} {upstream_size or '-':>10}")
+
+    print(f"\nПреобразование на месте: {len(local_times)} книг, {format_times(local_times)}")
+    print(f"Скачивание с сайта: {len(upstream_times)} книг (ошибок {upstream_failed}), {format_times(upstream_times)}")
+
+
+def main():
+    """Точка входа для запуска из командной строки: python bench_epub.py [число книг]"""
+    sample_size = int(sys.argv[1]) if len(sys.argv) > 1 else SAMPLE_SIZE
+    asyncio.run(run_benchmark(sample_size=sample_size))
+
+
+if __name__ == "__main__":
+    main()
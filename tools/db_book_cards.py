@@ -0,0 +1,181 @@
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+import zipfile
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Добавляем путь к src в Python path: разбор fb2 тот же, что и в боте
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(project_root, 'src'))
+
+from utils import parse_fb2
+
+FLIBUSTA_DB_BOOKS_PATH = "/media/sf_FlibustaBot/data/Flibusta_FB2_local.hlc2"
+PREFIX_FILE_PATH = "/media/sf_FlibustaFiles/"
+# Хранилище обложек: файл называется по SHA-256 содержимого, одинаковые обложки хранятся один раз
+BOOK_CARDS_PATH = "/media/sf_FlibustaBot/data/cards"
+
+# Размер уменьшенной обложки и качество JPEG
+THUMBNAIL_SIZE = (320, 480)
+THUMBNAIL_QUALITY = 80
+
+SQL_CREATE_BOOKS_CARDS = """
+    CREATE TABLE IF NOT EXISTS Books_Cards (
+        BookID INTEGER PRIMARY KEY,
+        CoverHash TEXT,
+        Annotation TEXT,
+        FOREIGN KEY (BookID) REFERENCES Books(BookID)
+    )
+"""
+
+
+def make_thumbnail(cover_bytes):
+    """Уменьшает обложку до THUMBNAIL_SIZE (без Pillow обложка сохраняется как есть)"""
+    if Image is None:
+        return cover_bytes
+    with Image.open(io.BytesIO(cover_bytes)) as image:
+        image = image.convert('RGB')
+        image.thumbnail(THUMBNAIL_SIZE)
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+        return output.getvalue()
+
+
+def get_cover_path(store_path, cover_hash):
+    """Путь к обложке в хранилище: <первые два символа хеша>/<хеш>.jpg"""
+    return os.path.join(store_path, cover_hash[:2], f"{cover_hash}.jpg")
+
+
+def save_cover(store_path, cover_bytes):
+    """Сохраняет обложку в хранилище и возвращает её хеш"""
+    cover_hash = hashlib.sha256(cover_bytes).hexdigest()
+    cover_path = get_cover_path(store_path, cover_hash)
+    if not os.path.exists(cover_path):
+        os.makedirs(os.path.dirname(cover_path), exist_ok=True)
+        # Пишем во временный файл и переименовываем, чтобы бот не прочитал недописанную обложку
+        tmp_path = f"{cover_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as cover_file:
+            cover_file.write(cover_bytes)
+        os.replace(tmp_path, cover_path)
+    return cover_hash
+
+
+class BookCardsManager:
+    def __init__(self, db_path=FLIBUSTA_DB_BOOKS_PATH, files_path=PREFIX_FILE_PATH, store_path=BOOK_CARDS_PATH):
+        self.db_path = db_path
+        self.files_path = files_path
+        self.store_path = store_path
+        self.conn = None
+        self._init_db()
+
+    def _init_db(self):
+        """Создаёт таблицу карточек книг: хеш обложки в хранилище и аннотация"""
+        with self._get_connection() as conn:
+            conn.execute(SQL_CREATE_BOOKS_CARDS)
+            conn.commit()
+
+    def _get_connection(self):
+        """Возвращает соединение с БД"""
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path)
+        return self.conn
+
+    def close(self):
+        """Закрывает соединение с БД"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def get_books_to_process(self, limit=None):
+        """Получает список fb2-книг, для которых ещё нет карточки"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            query = """
+            SELECT b.BookID, b.Folder, b.FileName, b.Ext
+            FROM Books b
+            LEFT JOIN Books_Cards c ON b.BookID = c.BookID
+            WHERE c.BookID IS NULL AND b.Ext = '.fb2'
+            """
+            if limit:
+                query += f" LIMIT {limit}"
+            cursor.execute(query)
+            return cursor.fetchall()
+
+    def process_book(self, book_info):
+        """Извлекает из книги обложку и аннотацию, обложку кладёт в хранилище"""
+        book_id, folder, file_name, ext = book_info
+        file_path = os.path.join(self.files_path, folder)
+
+        try:
+            with zipfile.ZipFile(file_path, 'r') as zip_file:
+                with zip_file.open(f"{file_name}{ext}") as file:
+                    cover_bytes, metadata = parse_fb2(file)
+            if metadata is None:
+                print(f"Ошибка обработки описания книги: Book_ID:{book_id}, Folder:{folder}, Filename:{file_name}")
+                return None
+
+            cover_hash = None
+            if cover_bytes:
+                try:
+                    cover_hash = save_cover(self.store_path, make_thumbnail(cover_bytes))
+                except Exception as e:
+                    print(f"Ошибка обработки обложки книги {file_name}: {str(e)}")
+            # Книга без обложки и аннотации тоже записывается, чтобы не разбирать её повторно
+            return book_id, cover_hash, metadata.get('annotation')
+        except Exception as e:
+            print(f"Ошибка обработки книги {file_name}: {str(e)}")
+            return None
+
+    def save_cards(self, cards_list):
+        """Сохраняет карточки в БД"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+            INSERT OR REPLACE INTO Books_Cards (BookID, CoverHash, Annotation) VALUES (?, ?, ?)
+            """, [card for card in cards_list if card is not None])
+            conn.commit()
+
+    def update_cards(self, batch_size=1000, max_workers=4):
+        """Собирает карточки для новых книг"""
+        if Image is None:
+            print("Pillow не установлен: обложки сохраняются без уменьшения")
+
+        books = self.get_books_to_process()
+        if not books:
+            print("Все книги уже обработаны")
+            return
+
+        print(f"Найдено {len(books)} книг для обработки")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for i in tqdm(range(0, len(books), batch_size)):
+                batch = books[i:i + batch_size]
+                cards = list(tqdm(
+                    executor.map(self.process_book, batch),
+                    total=len(batch),
+                    desc="Обработка книг"
+                ))
+                self.save_cards(cards)
+
+        print("Обновление карточек книг завершено")
+
+
+def main():
+    """Точка входа для запуска из командной строки"""
+    manager = BookCardsManager()
+    try:
+        manager.update_cards()
+    finally:
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import re
+import sqlite3
+import sys
+from datetime import datetime
+
+FLIBUSTA_DB_BOOKS_PATH = "/media/sf_FlibustaBot/data/Flibusta_FB2_local.hlc2"
+
+# Разделитель значений в многозначных полях (авторы, жанры)
+VALUE_SEPARATOR = '|'
+
+SQL_CREATE_BOOK_SEARCH = """
+    CREATE TABLE BookSearch (
+        BookID INTEGER PRIMARY KEY,
+        FileName TEXT,
+        Title TEXT,
+        SearchTitle TEXT,
+        SearchLang TEXT,
+        Author TEXT,
+        LastName TEXT,
+        FirstName TEXT,
+        MiddleName TEXT,
+        Genre TEXT,
+        GenreUpper TEXT,
+        GenreParent TEXT,
+        Folder TEXT,
+        Ext TEXT,
+        BookSize INTEGER,
+        BookSizeCat TEXT,
+        SearchYear INTEGER,
+        LibRate INTEGER,
+        UpdateDate TEXT,
+        SeriesTitle TEXT,
+        SearchSeriesTitle TEXT,
+        SearchCity TEXT,
+        SearchPublisher TEXT,
+        FullSearch TEXT
+    )
+"""
+
+SQL_CREATE_BOOK_SEARCH_INFO = """
+    CREATE TABLE IF NOT EXISTS BookSearchInfo (
+        BooksCount INTEGER,
+        MaxUpdateDate TEXT,
+        BuildDate TEXT
+    )
+"""
+
+# Денормализация бывшего SQL_QUERY_BOOKS бота: одна строка на книгу.
+# Авторы и жанры агрегируются заранее, отображаемые поля берутся через max(), как раньше делал GROUP BY FileName.
+# INNER JOIN сохраняют прежнее поведение: книги без авторов, жанров или Books_Meta в поиск не попадают.
+SQL_FILL_BOOK_SEARCH = f"""
+    INSERT INTO BookSearch
+    SELECT
+        Books.BookID,
+        Books.FileName,
+        Books.Title,
+        Books.SearchTitle,
+        Books.SearchLang,
+        BookAuthors.Author,
+        BookAuthors.LastName,
+        BookAuthors.FirstName,
+        BookAuthors.MiddleName,
+        BookGenres.Genre,
+        BookGenres.GenreUpper,
+        BookGenres.GenreParent,
+        Books.Folder,
+        Books.Ext,
+        Books.BookSize,
+        case
+          when Books.BookSize <= 800 * 1024 then 'less800'
+          when Books.BookSize > 800 * 1024 then 'more800'
+          end as BookSizeCat,
+        Books_Meta.SearchYear,
+        Books.LibRate,
+        coalesce(Books.UpdateDate, '') AS UpdateDate,
+        Series.SeriesTitle,
+        Series.SearchSeriesTitle,
+        Books_Meta.SearchCity,
+        Books_Meta.SearchPublisher,
+        REMOVE_PUNCTUATION(' ' || Books.SearchTitle
+            || ' ' || replace(BookAuthors.Author, '{VALUE_SEPARATOR}', ' ')
+            || ' ' || coalesce(Series.SearchSeriesTitle, '')
+            || ' ' || replace(BookGenres.GenreUpper, '{VALUE_SEPARATOR}', ' ')
+            || ' ' || Books.SearchLang || ' ') AS FullSearch
+    FROM Books
+    INNER JOIN (
+        SELECT
+            Author_List.BookID,
+            group_concat(coalesce(Authors.SearchName, ''), '{VALUE_SEPARATOR}') AS Author,
+            max(Authors.LastName) AS LastName,
+            max(Authors.FirstName) AS FirstName,
+            max(Authors.MiddleName) AS MiddleName
+        FROM Author_List
+        INNER JOIN Authors ON Author_List.AuthorID = Authors.AuthorID
+        GROUP BY Author_List.BookID
+    ) AS BookAuthors ON BookAuthors.BookID = Books.BookID
+    INNER JOIN (
+        SELECT
+            Genre_List.BookID,
+            max(Genres.GenreAlias) AS Genre,
+            group_concat(coalesce(Genres.SearchGenre, ''), '{VALUE_SEPARATOR}') AS GenreUpper,
+            max(GenresParent.GenreAlias) AS GenreParent
+        FROM Genre_List
+        INNER JOIN SearchGenres AS Genres ON Genres.GenreCode = Genre_List.GenreCode
+        LEFT JOIN SearchGenres AS GenresParent ON GenresParent.GenreCode = Genres.ParentCode
+        GROUP BY Genre_List.BookID
+    ) AS BookGenres ON BookGenres.BookID = Books.BookID
+    LEFT JOIN Series ON Series.SeriesID = Books.SeriesID
+    INNER JOIN Books_Meta ON Books_Meta.BookID = Books.BookID
+"""
+
+
+# Индексы под сортировку выдачи, выборку серий и карточку книги (имена проверяет бот при старте - src/database.py)
+BOOK_SEARCH_INDEXES = {
+    'IXBookSearch_UpdateDate_FileName': "BookSearch (UpdateDate, FileName)",
+    'IXBookSearch_FileName': "BookSearch (FileName)",
+    'IXBookSearch_SearchSeriesTitle': "BookSearch (SearchSeriesTitle)"
+}
+
+
+def remove_punctuation(text):
+    """Та же нормализация, что и у REMOVE_PUNCTUATION в боте (src/utils.py)"""
+    if text is None:
+        return None
+    else:
+        return re.sub(r'[^\w\s]', ' ', text)
+
+
+class BookSearchManager:
+    def __init__(self, db_path=FLIBUSTA_DB_BOOKS_PATH):
+        self.db_path = db_path
+        self.conn = None
+
+    def _get_connection(self):
+        """Возвращает соединение с БД"""
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path)
+            self.conn.create_function("REMOVE_PUNCTUATION", 1, remove_punctuation)
+        return self.conn
+
+    def close(self):
+        """Закрывает соединение с БД"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def rebuild(self):
+        """Пересобирает таблицу BookSearch (запускать после каждого обновления hlc2)"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+
+            print("Собираем таблицу BookSearch...")
+            cursor.execute("DROP TABLE IF EXISTS BookSearch")
+            cursor.execute(SQL_CREATE_BOOK_SEARCH)
+            cursor.execute(SQL_FILL_BOOK_SEARCH)
+
+            self._create_indexes(cursor)
+
+            # Запоминаем состояние Books на момент сборки для проверки актуальности при старте бота
+            cursor.execute(SQL_CREATE_BOOK_SEARCH_INFO)
+            cursor.execute("DELETE FROM BookSearchInfo")
+            cursor.execute("""
+                INSERT INTO BookSearchInfo (BooksCount, MaxUpdateDate, BuildDate)
+                SELECT COUNT(*), MAX(UpdateDate), ? FROM Books
+            """, (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+
+            cursor.execute("SELECT COUNT(*) FROM BookSearch")
+            books_count = cursor.fetchone()[0]
+            conn.commit()
+
+        cursor.execute("ANALYZE BookSearch")
+        print(f"Таблица BookSearch собрана: {books_count} книг")
+
+    @staticmethod
+    def _create_indexes(cursor):
+        """Создаёт недостающие индексы BookSearch"""
+        for index_name, index_columns in BOOK_SEARCH_INDEXES.items():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {index_columns}")
+
+    def migrate(self):
+        """Добавляет в уже собранную таблицу BookSearch индексы, появившиеся после её сборки (без пересборки)"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            print("Создаём недостающие индексы BookSearch...")
+            self._create_indexes(cursor)
+            conn.commit()
+            cursor.execute("ANALYZE BookSearch")
+        print("Индексы BookSearch созданы")
+
+
+def main():
+    """
+    Точка входа для запуска из командной строки:
+    python db_book_search.py - пересобрать таблицу, python db_book_search.py --indexes - только добавить индексы
+    """
+    manager = BookSearchManager()
+    try:
+        if '--indexes' in sys.argv[1:]:
+            manager.migrate()
+        else:
+            manager.rebuild()
+    finally:
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import re
+import sqlite3
+
+FLIBUSTA_DB_BOOKS_PATH = "/media/sf_FlibustaBot/data/Flibusta_FB2_local.hlc2"
+
+# Выборка текстов для индекса: одна строка на книгу, авторы и жанры склеены через пробел
+SQL_QUERY_BOOKS_TEXT = """
+    SELECT
+        Books.BookID,
+        Books.SearchTitle,
+        (SELECT group_concat(Authors.SearchName, ' ')
+         FROM Author_List
+         INNER JOIN Authors ON Authors.AuthorID = Author_List.AuthorID
+         WHERE Author_List.BookID = Books.BookID) AS Author,
+        Series.SearchSeriesTitle,
+        (SELECT group_concat(SearchGenres.SearchGenre, ' ')
+         FROM Genre_List
+         INNER JOIN SearchGenres ON SearchGenres.GenreCode = Genre_List.GenreCode
+         WHERE Genre_List.BookID = Books.BookID) AS Genre,
+        Books.SearchLang
+    FROM Books
+    LEFT JOIN Series ON Series.SeriesID = Books.SeriesID
+    WHERE Books.BookID > ?
+    ORDER BY Books.BookID
+    LIMIT ?
+"""
+
+
+def remove_punctuation(text):
+    """Та же нормализация, что и у REMOVE_PUNCTUATION в боте (src/utils.py)"""
+    if text is None:
+        return None
+    else:
+        return re.sub(r'[^\w\s]', ' ', text)
+
+
+class BooksFtsManager:
+    def __init__(self, db_path=FLIBUSTA_DB_BOOKS_PATH):
+        self.db_path = db_path
+        self.conn = None
+
+    def _get_connection(self):
+        """Возвращает соединение с БД"""
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path)
+        return self.conn
+
+    def close(self):
+        """Закрывает соединение с БД"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def create_index(self):
+        """Пересоздаёт пустую таблицу полнотекстового индекса"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DROP TABLE IF EXISTS BooksFTS")
+            # remove_diacritics 0 - чтобы Ё и Е различались так же, как при поиске через LIKE
+            cursor.execute("""
+            CREATE VIRTUAL TABLE BooksFTS USING fts5(
+                Title, Author, Series, Genre, Lang,
+                tokenize = 'unicode61 remove_diacritics 0'
+            )
+            """)
+            conn.commit()
+
+    def fill_index(self, batch_size=10000):
+        """Заполняет индекс пачками по BookID (rowid индекса совпадает с Books.BookID)"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT COUNT(*) FROM Books")
+        total_rows = cursor.fetchone()[0]
+        print(f"Всего книг для индексации: {total_rows}")
+
+        last_book_id = -1
+        processed = 0
+        while True:
+            cursor.execute(SQL_QUERY_BOOKS_TEXT, (last_book_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            cursor.executemany("""
+                INSERT INTO BooksFTS (rowid, Title, Author, Series, Genre, Lang)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(row[0], *[remove_punctuation(value) for value in row[1:]]) for row in rows])
+            conn.commit()
+
+            last_book_id = rows[-1][0]
+            processed += len(rows)
+            print(f"Проиндексировано: {processed}/{total_rows} ({processed / max(total_rows, 1) * 100:.1f}%)")
+
+        # Сливаем сегменты индекса для ускорения поиска
+        cursor.execute("INSERT INTO BooksFTS (BooksFTS) VALUES ('optimize')")
+        conn.commit()
+
+    def rebuild(self):
+        """Полностью перестраивает индекс (запускать после каждого обновления hlc2)"""
+        self.create_index()
+        self.fill_index()
+        print("Полнотекстовый индекс BooksFTS построен")
+
+
+def main():
+    """Точка входа для запуска из командной строки"""
+    manager = BooksFtsManager()
+    try:
+        manager.rebuild()
+    finally:
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()